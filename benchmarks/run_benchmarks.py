@@ -0,0 +1,254 @@
+# Throughput benchmarks of binfilepy, vitalfilepy and the extraction pipeline on synthetic files
+# Results are printed as a table and saved as JSON, to compare versions and catch regressions in the decode loop
+# e.g. python benchmarks/run_benchmarks.py --duration 600 --channels 4 --format short --gap-density 0.01 --fs 240 --output bench.json
+
+import argparse
+import contextlib
+import datetime
+import importlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "vitalfilepy_master"))
+
+from binfilepy import BinFile  # noqa: E402
+from binfilepy import constant  # noqa: E402
+from vitalfilepy import VitalFile  # noqa: E402
+from vitalfilepy import VITALBINARY  # noqa: E402
+from synthetic import writeSyntheticBinFile  # noqa: E402
+
+FORMATS = {"double": constant.FORMAT_DOUBLE, "float": constant.FORMAT_FLOAT, "short": constant.FORMAT_SHORT}
+
+
+def measure(fn, repeat: int):
+    # best wall time of repeat calls, and the result of the last call
+    best = None
+    for i in range(repeat):
+        t = time.perf_counter()
+        out = fn()
+        seconds = time.perf_counter() - t
+        best = seconds if best is None else min(best, seconds)
+    return best, out
+
+
+def result(name: str, seconds: float, numBytes: int, numSamples: int):
+    # numBytes and numSamples processed by one call, samples count every channel
+    return {"name": name, "seconds": seconds, "bytes": numBytes, "samples": numSamples,
+            "MB_per_s": numBytes / seconds / 1e6 if seconds > 0 else None,
+            "samples_per_s": numSamples / seconds if seconds > 0 else None}
+
+
+def benchBinFile(tmpDir: str, args):
+    results = []
+    filename = os.path.join(tmpDir, "bench.adibin")
+
+    def write():
+        if os.path.exists(filename):
+            os.remove(filename)
+        return writeSyntheticBinFile(filename, args.duration, args.channels, FORMATS[args.format], args.gap_density, args.fs)
+
+    seconds, numSamples = measure(write, args.repeat)
+    numBytes = os.path.getsize(filename)
+    numValues = numSamples * args.channels
+    results.append(result("binfile_write", seconds, numBytes, numValues))
+
+    def read(**kwargs):
+        with BinFile(filename, "r") as f:
+            f.readHeader()
+            return f.readChannelData(0, 0, False, False, **kwargs)
+
+    def readMapped():
+        with BinFile(filename, "mmap") as f:
+            f.readHeader()
+            return [c[:] for c in f.mapChannels()]
+
+    def iterChunks():
+        with BinFile(filename, "r") as f:
+            f.readHeader()
+            return sum(block.shape[1] for sampleNum, startTime, block in f.iterChannelData(60.0))
+
+    cases = [
+        ("binfile_read_scaled", lambda: read()),
+        ("binfile_read_raw", lambda: read(noDataScaling=True)),
+        ("binfile_read_downsampled", lambda: read(downSamplingRatio=args.downsampling)),
+        ("binfile_read_downsampled_antialiasing", lambda: read(downSamplingRatio=args.downsampling, antiAliasing=True)),
+        ("binfile_read_first_channel", lambda: read(channels=[0])),
+        ("binfile_read_mmap", readMapped),
+        ("binfile_iter_chunks", iterChunks),
+    ]
+    for name, fn in cases:
+        seconds, out = measure(fn, args.repeat)
+        # throughput is counted on the file read, also when fewer samples are returned
+        results.append(result(name, seconds, numBytes, numValues))
+    return results
+
+
+def benchVitalFile(tmpDir: str, args):
+    results = []
+    filename = os.path.join(tmpDir, "bench.vital")
+    n = args.vital_records
+    values = np.arange(n) % 50 + 60.0
+    offsets = np.arange(n, dtype=np.float64)
+    lows = np.zeros(n)
+    highs = np.full(n, 1000.0)
+    header = VITALBINARY("HR", "Bpm", "T1ICU", "101", 2019, 3, 31, 8, 15, 30.0)
+
+    def write(bulk: bool):
+        if os.path.exists(filename):
+            os.remove(filename)
+        with VitalFile(filename, "w") as f:
+            f.setHeader(header)
+            f.writeHeader()
+            if bulk:
+                f.writeVitalDataBuf(values, offsets, lows, highs)
+            else:
+                for i in range(n):
+                    f.writeVitalData(values[i], offsets[i], lows[i], highs[i])
+
+    seconds, out = measure(lambda: write(False), args.repeat)
+    numBytes = os.path.getsize(filename)
+    results.append(result("vitalfile_write_records", seconds, numBytes, n))
+    seconds, out = measure(lambda: write(True), args.repeat)
+    results.append(result("vitalfile_write_buf", seconds, numBytes, n))
+
+    def read(mode: str, fn):
+        with VitalFile(filename, mode) as f:
+            f.readHeader()
+            return len(fn(f))
+
+    cases = [
+        ("vitalfile_read_buf", lambda: read("r", lambda f: f.readVitalDataBuf(n))),
+        ("vitalfile_read_all", lambda: read("r", lambda f: f.readAll())),
+        ("vitalfile_read_all_mmap", lambda: read("mmap", lambda f: f.readAll())),
+    ]
+    for name, fn in cases:
+        seconds, out = measure(fn, args.repeat)
+        results.append(result(name, seconds, numBytes, n))
+    return results
+
+
+def benchExtraction(tmpDir: str, args):
+    # end-to-end extractContinuousWaveforms with the local storage backend over a directory tree laid out like the server
+    serverDir = os.path.join(tmpDir, "server") + "/"
+    outputDir = os.path.join(tmpDir, "Output") + "/"
+    os.makedirs(outputDir)
+    rows = []
+    numBytes = 0
+    numValues = 0
+    fileSeconds = args.duration / args.e2e_files
+    startTime = np.datetime64("2013-05-12T19:00:00", "us")
+    for c in range(args.e2e_cycles):
+        patient = "DE{0}".format(c + 1)
+        uid = 1000 + c
+        folder = os.path.join(serverDir, "2013-08-deid", patient, "9ICU_13-" + patient)
+        os.makedirs(folder)
+        for j in range(args.e2e_files):
+            fileStart = startTime + np.timedelta64(int(j * fileSeconds * 1e6), "us")
+            filename = os.path.join(folder, "{0}_{1}_{2}.adibin".format(patient, j, uid))
+            numValues += args.channels * writeSyntheticBinFile(filename, fileSeconds, args.channels, FORMATS[args.format],
+                                                               args.gap_density, args.fs, fileStart, seed=j)
+            numBytes += os.path.getsize(filename)
+        rows.append({"Wynton_folder": "2013-08-deid", "Patient_ID_GE": patient, "WaveCycleUID": uid,
+                     "ValidStartTime": np.datetime64(startTime, "ns"),
+                     "ValidStopTime": np.datetime64(startTime + np.timedelta64(int(args.duration * 1e6), "us"), "ns")})
+    with open(os.path.join(tmpDir, "config.txt"), "w") as f:
+        f.write("usr=bench\npwd=bench\nhost=localhost\ndir_waveform={0}\ndir_output={1}\nstorage=local\n".format(serverDir, outputDir))
+
+    cwd = os.getcwd()
+    os.chdir(tmpDir)
+    try:
+        # the script reads config.txt of the working directory when it is imported
+        script = importlib.import_module("extractContinuousWaveforms")
+    finally:
+        os.chdir(cwd)
+
+    def extract():
+        # every run starts without the catalog, listing cache and checkpoints of the previous one
+        if script.storage is not None:
+            script.catalog.close()
+            script.listing.close()
+            script.storage = None
+        shutil.rmtree(outputDir)
+        os.makedirs(outputDir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i, row in enumerate(rows):
+                script.extract_rows([(i, row)], len(rows))
+
+    results = []
+    # float64 output, raw output in the storage type of the files, and raw output in compressed chunks
+    for name, raw, codec in [("extraction_end_to_end", 0, ""), ("extraction_end_to_end_raw", 1, ""),
+                             ("extraction_end_to_end_zlib", 1, "zlib")]:
+        script.raw_samples = raw
+        script.compress_output = codec
+        seconds, out = measure(extract, args.repeat)
+        results.append(result(name, seconds, numBytes, numValues))
+    script.catalog.close()
+    script.listing.close()
+    script.storage = None
+    return results
+
+
+def getVersion():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Throughput benchmarks on synthetic ADIBIN and vital files')
+    parser.add_argument('--duration', type=float, default=600.0, help='seconds of the synthetic ADIBIN file')
+    parser.add_argument('--channels', type=int, default=4, help='number of channels')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='short', help='DataFormat of the samples')
+    parser.add_argument('--gap-density', type=float, default=0.01, help='fraction of the samples in gaps')
+    parser.add_argument('--fs', type=float, default=240.0, help='sampling rate in Hz')
+    parser.add_argument('--downsampling', type=float, default=0.5, help='downSamplingRatio of the downsampled reads')
+    parser.add_argument('--vital-records', type=int, default=100000, help='number of records of the vital file')
+    parser.add_argument('--e2e-cycles', type=int, default=2, help='wave cycles of the end-to-end extraction')
+    parser.add_argument('--e2e-files', type=int, default=3, help='ADIBIN files per wave cycle, splitting --duration')
+    parser.add_argument('--skip', nargs='*', default=[], choices=['binfile', 'vitalfile', 'extraction'], help='groups not to run')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each case, the best time is reported')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file of the results')
+    args = parser.parse_args()
+
+    groups = [("binfile", benchBinFile), ("vitalfile", benchVitalFile), ("extraction", benchExtraction)]
+    results = []
+    for group, bench in groups:
+        if group in args.skip:
+            continue
+        tmpDir = tempfile.mkdtemp(prefix="bench_")
+        try:
+            results.extend(bench(tmpDir, args))
+        except ImportError as e:
+            # e.g. pandas is not installed for the extraction
+            results.append({"name": group, "skipped": str(e)})
+        finally:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+
+    report = {
+        "version": getVersion(),
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "params": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+
+    print("{0:<40} {1:>10} {2:>10} {3:>14}".format("case", "seconds", "MB/s", "samples/s"))
+    for r in results:
+        if "skipped" in r:
+            print("{0:<40} skipped: {1}".format(r["name"], r["skipped"]))
+        else:
+            print("{0:<40} {1:>10.4f} {2:>10.1f} {3:>14.0f}".format(r["name"], r["seconds"], r["MB_per_s"], r["samples_per_s"]))
@@ -0,0 +1,47 @@
+# Synthetic ADIBIN files for the benchmarks, written with BinFile.writeHeader() and writeChannelData()
+# Samples are sine waves with noise, and gaps are runs of gap values covering gapDensity of the samples
+
+import numpy as np
+from binfilepy import BinFile
+from binfilepy import CFWBINARY
+from binfilepy import CFWBCHANNEL
+from binfilepy import constant
+
+# samples are generated and written in blocks of this many seconds
+BLOCK_SECONDS = 60.0
+# length of one gap in seconds
+GAP_SECONDS = 1.0
+
+
+def writeSyntheticBinFile(filename: str, durationSeconds: float = 600.0, numChannels: int = 4, dataFormat: int = constant.FORMAT_SHORT,
+                          gapDensity: float = 0.0, fs: float = 240.0, startTime: np.datetime64 = np.datetime64("2013-05-12T19:00:00"),
+                          seed: int = 0):
+    # returns the number of samples per channel written
+    rng = np.random.RandomState(seed)
+    dtype = np.dtype(constant.SAMPLE_TYPECODES[dataFormat])
+    gapValue = constant.GAP_FILL_VALUES[dataFormat]
+    numSamples = int(durationSeconds * fs)
+    blockSamples = max(int(BLOCK_SECONDS * fs), 1)
+    gapSamples = max(int(GAP_SECONDS * fs), 1)
+    with BinFile(filename, "w") as f:
+        f.setHeader(CFWBINARY(1.0 / fs, NChannels=numChannels, DataFormat=dataFormat))
+        f.setStartTime(startTime)
+        for k in range(numChannels):
+            f.addChannel(CFWBCHANNEL("Channel_{0}".format(k + 1), "mV", 0.01, 0.0, 100.0, -100.0))
+        f.writeHeader()
+        numWritten = 0
+        for start in range(0, numSamples, blockSamples):
+            n = min(blockSamples, numSamples - start)
+            t = (start + np.arange(n)) / fs
+            block = np.empty((numChannels, n), dtype=dtype)
+            for k in range(numChannels):
+                wave = 20.0 * np.sin(2 * np.pi * (k + 1) * t) + rng.normal(0.0, 2.0, n)
+                # raw values of SHORT samples are scaled by 0.01 when read
+                block[k] = np.rint(wave * 100.0) if dataFormat == constant.FORMAT_SHORT else wave
+            # gaps start at random samples, so that gapDensity of the samples are in a gap on average
+            numGaps = rng.binomial(n, gapDensity / gapSamples) if gapDensity > 0 else 0
+            for g in rng.randint(0, n, numGaps):
+                block[:, g:g + gapSamples] = gapValue
+            numWritten += f.writeChannelData(block)
+        f.updateSamplesPerChannel(numWritten, True)
+    return numWritten
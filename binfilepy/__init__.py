@@ -1,4 +1,6 @@
 from .binfile import CFWBINARY
 from .binfile import CFWBCHANNEL
+from .binfile import MappedChannel
 from .binfile import BinFileError
 from .binfile import BinFile
+from .segment import WaveformSegment
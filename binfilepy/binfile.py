@@ -25,14 +25,20 @@ SOFTWARE.
 
 import os
 import sys
+import mmap
 from pathlib import Path
 import datetime
 from array import array
 import struct
 from typing import List
 from typing import Any
+from typing import BinaryIO
+from typing import Union
+import numpy as np
 from . import constant
-from .fixsampling import fixsamplingarr
+from .fixsampling import resample
+from .segment import WaveformSegment
+from .segment import calibrateSamples
 
 
 class CFWBINARY:
@@ -113,6 +119,33 @@ class CFWBCHANNEL:
         self.RangeLow = RangeLow
 
 
+def _scaleSamples(samples: np.ndarray, dataFormat: int, scale, offset):
+    # only short data is stored with scale and offset, double and float data are stored in physical units
+    if dataFormat != constant.FORMAT_SHORT:
+        return samples.astype(np.float64)
+    return calibrateSamples(samples, scale, offset, constant.GAP_SHORT_VALUES)
+
+
+class MappedChannel:
+    raw = None              # strided ndarray view over the mapped file, in storage type
+    channel = None          # CFWBCHANNEL
+    DataFormat = 0
+
+    def __init__(self, raw: np.ndarray, channel: CFWBCHANNEL, DataFormat: int):
+        self.raw = raw
+        self.channel = channel
+        self.DataFormat = DataFormat
+
+    def __len__(self):
+        return len(self.raw)
+
+    def __getitem__(self, key):
+        samples = self.raw[key]
+        if np.ndim(samples) == 0:
+            return float(_scaleSamples(np.atleast_1d(samples), self.DataFormat, self.channel.scale, self.channel.offset)[0])
+        return _scaleSamples(samples, self.DataFormat, self.channel.scale, self.channel.offset)
+
+
 class BinFileError(BaseException):
     def __init__(self, message):
         self.message = message
@@ -124,14 +157,23 @@ class BinFile:
     header = None
     channels = []
 
-    def __init__(self, filename: str, mode: str):
+    def __init__(self, filename: Union[str, BinaryIO], mode: str):
+        # filename can also be a seekable file-like object (e.g. paramiko SFTPFile), which is not closed by close()
+        self.fileObj = None
+        if not isinstance(filename, (str, os.PathLike)):
+            self.fileObj = filename
+            filename = getattr(filename, "name", "")
         self.filename = filename
         self.mode = mode
         self.header = None
         self.channels = []
+        self._map = None
+        self._frames = None
 
     def open(self):
-        if self.mode == "r":
+        if self.fileObj is not None:
+            self.f = self.fileObj
+        elif self.mode == "r" or self.mode == "mmap":
             try:
                 self.f = open(self.filename, "rb")
             except:
@@ -178,6 +220,8 @@ class BinFile:
             scale, offset, rangeHigh, rangeLow = struct.unpack("dddd", self.f.read(constant.DOUBLE_SIZE * 4))
             channel = CFWBCHANNEL(label, uom, scale, offset, rangeHigh, rangeLow)
             self.channels.append(channel)
+        if self.mode == "mmap":
+            self._mapFrames()
 
     def writeHeader(self):
         # set to beginning of file
@@ -207,16 +251,94 @@ class BinFile:
                 self.f.write(struct.pack("d", channel.RangeHigh))
                 self.f.write(struct.pack("d", channel.RangeLow))
 
+    def _sampleType(self):
+        if self.header.DataFormat not in constant.SAMPLE_TYPECODES:
+            raise BinFileError("Unsupported array type!")
+        return constant.SAMPLE_TYPECODES[self.header.DataFormat]
+
+    def _dataPosition(self, sampleNum: int = 0):
+        frameSize = np.dtype(self._sampleType()).itemsize * self.header.NChannels
+        return constant.CFWB_SIZE + constant.CHANNEL_SIZE * self.header.NChannels + sampleNum * frameSize
+
+    def _readFrames(self, offsetSampleNum: int, lengthSampleNum: int):
+        # read a block of interleaved samples in one call, returns ndarray of shape (samples, NChannels)
+        dtype = np.dtype(self._sampleType())
+        lengthSampleNum = max(lengthSampleNum, 0)
+        if self._frames is not None:
+            return self._frames[offsetSampleNum:offsetSampleNum + lengthSampleNum]
+        pos = self._dataPosition(offsetSampleNum)
+        size = lengthSampleNum * dtype.itemsize * self.header.NChannels
+        if hasattr(self.f, "readv"):
+            # remote file (paramiko SFTPFile), readv() pipelines the requests for the whole range
+            buf = b"".join(self.f.readv([(pos, size)])) if size > 0 else b""
+        else:
+            self.f.seek(pos, 0)
+            buf = self.f.read(size)
+        numFrames = len(buf) // (dtype.itemsize * self.header.NChannels) if self.header.NChannels > 0 else 0
+        return np.frombuffer(buf, dtype=dtype, count=numFrames * self.header.NChannels).reshape(numFrames, self.header.NChannels)
+
+    def _gapValue(self, noDataScaling: bool):
+        # largest value of a gap sample as returned by readChannelData
+        if noDataScaling or self.header.DataFormat != constant.FORMAT_SHORT:
+            return float(np.array(constant.GAP_FILL_VALUES[self.header.DataFormat], dtype=self._sampleType()))
+        return constant.MIN_DOUBLE_VALUE
+
+    def getChannelNames(self):
+        # channel titles, unnamed channels are called 'Unnamed_Channel_1', 'Unnamed_Channel_2', etc.
+        return [c.Title if c.Title else "Unnamed_Channel_{0}".format(i + 1) for i, c in enumerate(self.channels)]
+
+    def _channelIndices(self, channels: List[Any] = None):
+        # resolve channel titles or indices to a list of channel indices, None means all channels
+        if channels is None:
+            return list(range(self.header.NChannels))
+        names = self.getChannelNames()
+        indices = []
+        for c in channels:
+            if isinstance(c, str):
+                if c not in names:
+                    raise BinFileError("Channel not found!")
+                indices.append(names.index(c))
+            elif 0 <= int(c) < self.header.NChannels:
+                indices.append(int(c))
+            else:
+                raise BinFileError("Channel not found!")
+        return indices
+
+    def _decodeFrames(self, frames: np.ndarray, indices: List[int], noDataScaling: bool):
+        # decode the selected channels through strided views of the interleaved frames,
+        # unselected channels are never converted or scaled
+        if noDataScaling:
+            return frames.T[indices]
+        channelArr = np.empty((len(indices), len(frames)), dtype=np.float64)
+        for k, i in enumerate(indices):
+            channelArr[k] = _scaleSamples(frames[:, i], self.header.DataFormat, self.channels[i].scale, self.channels[i].offset)
+        return channelArr
 
-    def readChannelData(self, offset: float, length: float, useSecForOffset: bool, useSecForLength: bool, downSamplingRatio: float = 1.0, *, noDataScaling: bool = False):
+    def _mapFrames(self):
+        # map the data region read-only, frames is a (samples, NChannels) view without copy
+        if self._frames is None:
+            dtype = np.dtype(self._sampleType())
+            try:
+                self._map = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (AttributeError, ValueError, OSError):
+                raise BinFileError("Cannot map file!")
+            dataPos = self._dataPosition()
+            numFrames = 0
+            if self.header.NChannels > 0:
+                numFrames = min(self.header.SamplesPerChannel, max(len(self._map) - dataPos, 0) // (dtype.itemsize * self.header.NChannels))
+            self._frames = np.frombuffer(self._map, dtype=dtype, count=numFrames * self.header.NChannels,
+                                         offset=dataPos).reshape(numFrames, self.header.NChannels)
+        return self._frames
+
+    def mapChannels(self, channels: List[Any] = None):
+        # return one MappedChannel per selected channel, samples are only scaled when a slice is taken
+        frames = self._mapFrames()
+        return [MappedChannel(frames[:, i], self.channels[i], self.header.DataFormat) for i in self._channelIndices(channels)]
+
+    def _sampleRange(self, offset: float, length: float, useSecForOffset: bool, useSecForLength: bool):
+        # returns (offsetSampleNum, lengthSampleNum) of a read clipped to the file
         offsetSampleNum = int(offset / self.header.secsPerTick) if useSecForOffset else int(offset)
         lengthSampleNum = int(length / self.header.secsPerTick) if useSecForLength else int(length)
-        if (self.header.DataFormat == constant.FORMAT_DOUBLE):
-            sampleSize = constant.DOUBLE_SIZE
-        elif (self.header.DataFormat == constant.FORMAT_FLOAT):
-            sampleSize = constant.FLOAT_SIZE
-        elif (self.header.DataFormat == constant.FORMAT_SHORT):
-            sampleSize = constant.SHORT_SIZE
         # offset and lenght are 0, then read entire file
         if (offsetSampleNum == 0) and (lengthSampleNum == 0):
             lengthSampleNum = self.header.SamplesPerChannel
@@ -226,91 +348,131 @@ class BinFile:
         # do not read anything if offset is bigger then total sample number
         elif offsetSampleNum > self.header.SamplesPerChannel:
             lengthSampleNum = 0
-        self.f.seek(constant.CFWB_SIZE + constant.CHANNEL_SIZE * self.header.NChannels + offsetSampleNum * sampleSize * self.header.NChannels, 0)
-        channelArr = []
+        return offsetSampleNum, lengthSampleNum
+
+    def readChannelData(self, offset: float, length: float, useSecForOffset: bool, useSecForLength: bool, downSamplingRatio: float = 1.0, *,
+                        noDataScaling: bool = False, asArrayList: bool = False, antiAliasing: bool = False, channels: List[Any] = None):
+        indices = self._channelIndices(channels)
+        offsetSampleNum, lengthSampleNum = self._sampleRange(offset, length, useSecForOffset, useSecForLength)
+        frames = self._readFrames(offsetSampleNum, lengthSampleNum)
+
+        # channelArr is indexed by channel, i.e. channelArr[i] is the i-th selected channel
+        channelArr = self._decodeFrames(frames, indices, noDataScaling)
+        # raw samples are resampled too, in their storage type, readChannelData() used to resample only scaled samples
+        if downSamplingRatio != 1.0:
+            channelArr = resample(channelArr, downSamplingRatio, gapValue=self._gapValue(noDataScaling), antiAliasing=antiAliasing)
+
+        if asArrayList:
+            typecode = self._sampleType() if noDataScaling else "d"
+            return [array(typecode, c.tolist()) for c in channelArr]
+        return channelArr
 
-        if noDataScaling:
-            for i in range(0, self.header.NChannels):
-                if self.header.DataFormat == constant.FORMAT_DOUBLE:
-                    channelArr.append(array("d", (0,) * lengthSampleNum))
-                elif self.header.DataFormat == constant.FORMAT_FLOAT:
-                    channelArr.append(array("f", (0,) * lengthSampleNum))
-                elif self.header.DataFormat == constant.FORMAT_SHORT:
-                    channelArr.append(array("h", (0,) * lengthSampleNum))
-            for x in range(0, lengthSampleNum):
-                i = 0
-                for c in channelArr:
-                    if self.header.DataFormat == constant.FORMAT_DOUBLE:
-                        c[x] = struct.unpack("d", self.f.read(constant.DOUBLE_SIZE))[0]
-                    elif self.header.DataFormat == constant.FORMAT_FLOAT:
-                        c[x] = struct.unpack("f", self.f.read(constant.FLOAT_SIZE))[0]
-                    elif self.header.DataFormat == constant.FORMAT_SHORT:
-                        c[x] = struct.unpack("h", self.f.read(constant.SHORT_SIZE))[0]
+    def readSegment(self, offset: float, length: float, useSecForOffset: bool, useSecForLength: bool, *,
+                    noDataScaling: bool = False, channels: List[Any] = None):
+        # read like readChannelData, returns a WaveformSegment with the start time of the first sample read,
+        # noDataScaling keeps the samples in the storage type, short samples with the scales, offsets and gap values to calibrate them
+        indices = self._channelIndices(channels)
+        offsetSampleNum, lengthSampleNum = self._sampleRange(offset, length, useSecForOffset, useSecForLength)
+        channelArr = self._decodeFrames(self._readFrames(offsetSampleNum, lengthSampleNum), indices, noDataScaling)
+        segment = WaveformSegment(self._sampleTime(offsetSampleNum), self.header.secsPerTick, [self.getChannelNames()[i] for i in indices],
+                                  [self.channels[i].Units for i in indices], channelArr)
+        if noDataScaling and self.header.DataFormat == constant.FORMAT_SHORT:
+            segment.scales = [self.channels[i].scale for i in indices]
+            segment.offsets = [self.channels[i].offset for i in indices]
+            segment.gapValues = list(constant.GAP_SHORT_VALUES)
+        return segment
+
+    def mapSegment(self, channels: List[Any] = None):
+        # WaveformSegment of the whole mapped file, samples are only read and scaled when a slice is taken
+        indices = self._channelIndices(channels)
+        return WaveformSegment(self.getStartTime(), self.header.secsPerTick, [self.getChannelNames()[i] for i in indices],
+                               [self.channels[i].Units for i in indices], self.mapChannels(indices))
+
+    def iterChannelData(self, chunkSeconds: float = 60.0, start: float = 0.0, stop: float = None, useSecForRange: bool = True, *,
+                        noDataScaling: bool = False, channels: List[Any] = None):
+        # yield (start sample index, start time, block) for consecutive blocks of chunkSeconds,
+        # block is indexed by channel like the result of readChannelData
+        startSampleNum = int(start / self.header.secsPerTick) if useSecForRange else int(start)
+        stopSampleNum = self.header.SamplesPerChannel
+        if stop is not None:
+            stopSampleNum = min(int(stop / self.header.secsPerTick) if useSecForRange else int(stop), stopSampleNum)
+        chunkSampleNum = max(int(chunkSeconds / self.header.secsPerTick), 1)
+        indices = self._channelIndices(channels)
+        for sampleNum in range(max(startSampleNum, 0), stopSampleNum, chunkSampleNum):
+            frames = self._readFrames(sampleNum, min(chunkSampleNum, stopSampleNum - sampleNum))
+            if len(frames) == 0:
+                break
+            block = self._decodeFrames(frames, indices, noDataScaling)
+            yield sampleNum, self._sampleTime(sampleNum), block
+
+    def getStartTime(self):
+        # start time of the first sample as datetime64 in microseconds
+        startTime = np.datetime64("{0:04}-{1:02}-{2:02}T{3:02}:{4:02}".format(
+            self.header.Year, self.header.Month, self.header.Day, self.header.Hour, self.header.Minute), "us")
+        return startTime + np.timedelta64(int(round(self.header.Second * 1e6)), "us")
+
+    def _sampleTime(self, sampleNum: int):
+        return self.getStartTime() + np.timedelta64(int(round(sampleNum * self.header.secsPerTick * 1e6)), "us")
+
+    def setStartTime(self, startTime: np.datetime64):
+        # set the header date and time fields from a datetime64, Second keeps the fraction of a second
+        t = np.datetime64(startTime, "us").astype(datetime.datetime)
+        self.header.Year, self.header.Month, self.header.Day, self.header.Hour, self.header.Minute = t.year, t.month, t.day, t.hour, t.minute
+        self.header.Second = t.second + t.microsecond / 1e6
+
+    def _toSampleType(self, samples):
+        # cast samples to the stored type, values that do not fit raise an error like struct.pack() instead of wrapping around
+        dtype = np.dtype(self._sampleType())
+        samples = np.asarray(samples)
+        if np.can_cast(samples.dtype, dtype, "safe"):
+            return samples.astype(dtype, copy=False)
+        values = samples.astype(np.float64)
+        if dtype.kind == "i":
+            info = np.iinfo(dtype)
+            valid = np.all(np.isfinite(values)) and np.all(values == np.trunc(values)) and \
+                (values.size == 0 or (values.min() >= info.min and values.max() <= info.max))
         else:
-            for i in range(0, self.header.NChannels):
-                channelArr.append(array("d", (0,) * lengthSampleNum))
-
-            for x in range(0, lengthSampleNum):
-                i = 0
-                for c in channelArr:
-                    if self.header.DataFormat == constant.FORMAT_DOUBLE:
-                        c[x] = struct.unpack("d", self.f.read(constant.DOUBLE_SIZE))[0]
-                    elif self.header.DataFormat == constant.FORMAT_FLOAT:
-                        c[x] = struct.unpack("f", self.f.read(constant.FLOAT_SIZE))[0]
-                    elif self.header.DataFormat == constant.FORMAT_SHORT:
-                        v = struct.unpack("h", self.f.read(constant.SHORT_SIZE))[0]
-                        if v in constant.GAP_SHORT_VALUES:
-                            c[x] = constant.MIN_DOUBLE_VALUE
-                        else:
-                            c[x] = self.channels[i].scale * (v + self.channels[i].offset)
-                    i += 1
-            if downSamplingRatio != 1.0:
-                channelArr = fixsamplingarr(channelArr, downSamplingRatio)
-        
-        return channelArr
+            finite = np.abs(values[np.isfinite(values)])
+            valid = finite.size == 0 or finite.max() <= np.finfo(dtype).max
+        if not valid:
+            raise BinFileError("Sample value out of range!")
+        return samples.astype(dtype)
+
+    def _writeFrames(self, frames: np.ndarray):
+        self.f.write(np.ascontiguousarray(self._toSampleType(frames)).tobytes())
 
     def writeChannelData(self, chanData: List[List[Any]], fs: int = 0, gapInSecs: int = 0):
+        # chanData is indexed by channel, either a 2-D ndarray or a list of arrays, channels shorter
+        # than the first one are padded with the gap value and longer ones are truncated
+        dtype = np.dtype(self._sampleType())
+        gapValue = constant.GAP_FILL_VALUES[self.header.DataFormat]
         # 2 means the end of file
         self.f.seek(0, 2)
         numSamplesWritten = 0
         numChannels = len(chanData)
         if gapInSecs > 0:
-            numSamples = gapInSecs * fs
+            numSamples = int(gapInSecs * fs)
             numSamplesWritten += numSamples
-            for j in range(numSamples):
-                for i in range(numChannels):
-                    if self.header.DataFormat == constant.FORMAT_SHORT:
-                        d = constant.MIN_SHORT_VALUE
-                        self.f.write(struct.pack("h", d))
-                    elif self.header.DataFormat == constant.FORMAT_DOUBLE:
-                        d = constant.MIN_DOUBLE_VALUE
-                        self.f.write(struct.pack("d", d))
-                    elif self.header.DataFormat == constant.FORMAT_FLOAT:
-                        d = constant.MIN_FLOAT_VALUE
-                        self.f.write(struct.pack("f", d))
-        overlappedSamples = (-1 * gapInSecs * fs) if gapInSecs < 0 else 0
+            if numChannels > 0:
+                # write the padding in blocks of bounded size
+                blockSize = max(constant.WRITE_BLOCK_SIZE // (dtype.itemsize * numChannels), 1)
+                for j in range(0, numSamples, blockSize):
+                    self._writeFrames(np.full((min(blockSize, numSamples - j), numChannels), gapValue, dtype=dtype))
+        overlappedSamples = int(-1 * gapInSecs * fs) if gapInSecs < 0 else 0
         len_chanData = 0
         if len(chanData) > 0:
             len_chanData = len(chanData[0])
-        numSamplesWritten += max(len_chanData - overlappedSamples, 0)
-        for j in range(len_chanData):
-            if j < overlappedSamples:
-                continue
-            for i in range(len(chanData)):
-                # bug fix, prevent idx out of range
-                out_of_range = j > (len(chanData[i]) - 1)
-                if self.header.DataFormat == constant.FORMAT_SHORT:
-                    d = chanData[i][j] if not out_of_range else constant.MIN_SHORT_VALUE
-                    self.f.write(struct.pack("h", d))
-                elif self.header.DataFormat == constant.FORMAT_DOUBLE:
-                    d = chanData[i][j] if not out_of_range else constant.MIN_DOUBLE_VALUE
-                    self.f.write(struct.pack("d", d))
-                elif self.header.DataFormat == constant.FORMAT_FLOAT:
-                    d = chanData[i][j] if not out_of_range else constant.MIN_FLOAT_VALUE
-                    self.f.write(struct.pack("f", d))
-                else:
-                    # raise exception
-                    raise BinFileError("Unsupported array type!")
+        numSamples = max(len_chanData - overlappedSamples, 0)
+        numSamplesWritten += numSamples
+        if numSamples > 0:
+            if isinstance(chanData, np.ndarray) and chanData.ndim == 2:
+                frames = chanData[:, overlappedSamples:].T
+            else:
+                frames = np.full((numSamples, numChannels), gapValue, dtype=dtype)
+                for i in range(numChannels):
+                    c = self._toSampleType(np.asarray(chanData[i])[overlappedSamples:len_chanData])
+                    frames[:len(c), i] = c
+            self._writeFrames(frames)
         return numSamplesWritten
 
     def updateSamplesPerChannel(self, numSamples: int, writeToFile: bool):
@@ -323,7 +485,15 @@ class BinFile:
 
     def close(self):
         # print("Close")
-        if self.f is not None:
+        self._frames = None
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # views returned by mapChannels() are still alive, the map is released with them
+                pass
+            self._map = None
+        if self.f is not None and self.fileObj is None:
             self.f.flush()
             self.f.close()
 
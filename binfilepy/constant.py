@@ -34,6 +34,8 @@ DOUBLE_SIZE = 8
 FORMAT_DOUBLE = 1
 FORMAT_FLOAT = 2
 FORMAT_SHORT = 3
+# array/numpy typecode of a stored sample for each DataFormat
+SAMPLE_TYPECODES = {FORMAT_DOUBLE: "d", FORMAT_FLOAT: "f", FORMAT_SHORT: "h"}
 N_SAMPLE_POSITION = MAGIC_LEN + INT32_SIZE + DOUBLE_SIZE + 5 * INT32_SIZE + DOUBLE_SIZE + DOUBLE_SIZE + INT32_SIZE
 CFWB_SIZE = MAGIC_LEN + INT32_SIZE + DOUBLE_SIZE + 5 * INT32_SIZE + DOUBLE_SIZE + DOUBLE_SIZE + 4 * INT32_SIZE
 CHANNEL_SIZE = CHANNEL_TITLE_LEN + UNITS_LEN + 4 * DOUBLE_SIZE
@@ -44,3 +46,7 @@ MIN_DOUBLE_VALUE = -1.7e+308
 MAX_DOUBLE_VALUE = 1.7e+308
 MIN_FLOAT_VALUE = -3.4e+38
 MAX_FLOAT_VALUE = 3.4e+38
+# value written for samples in a gap for each DataFormat
+GAP_FILL_VALUES = {FORMAT_DOUBLE: MIN_DOUBLE_VALUE, FORMAT_FLOAT: MIN_FLOAT_VALUE, FORMAT_SHORT: MIN_SHORT_VALUE}
+# maximum size in bytes of a single buffered write
+WRITE_BLOCK_SIZE = 16 * 1024 * 1024
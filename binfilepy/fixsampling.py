@@ -29,17 +29,67 @@ from array import array
 from typing import List
 
 
-def fixsamplingarr(arr: array, downSamplingRatio: float):
-    x = np.array(list(range(0, len(arr))))
-    y = np.array(arr)
+# number of filter taps per decimation step of the anti-aliasing filter
+ANTI_ALIASING_TAPS_PER_STEP = 8
+
+
+def _lowpassFilter(step: float):
+    # windowed-sinc low pass filter with cutoff at the new Nyquist frequency
+    numTaps = int(ANTI_ALIASING_TAPS_PER_STEP * step) | 1
+    n = np.arange(numTaps) - (numTaps - 1) / 2.0
+    taps = np.sinc(n / step) * np.hamming(numTaps)
+    return taps / taps.sum()
+
+
+def _antiAliasing(data: np.ndarray, gaps: np.ndarray, step: float):
+    taps = _lowpassFilter(step)
+    half = len(taps) // 2
+    filtered = np.empty(data.shape, dtype=np.float64)
+    for i in range(data.shape[0]):
+        # gap samples do not contribute, and a filtered sample touching a gap becomes a gap
+        c = np.pad(np.where(gaps[i], 0.0, data[i]), half, mode="edge")
+        filtered[i] = np.convolve(c, taps, mode="valid")
+        if gaps[i].any():
+            gaps[i] = np.convolve(np.pad(gaps[i], half), np.ones(len(taps)), mode="valid") > 0
+    return filtered, gaps
+
+
+def resample(data: np.ndarray, downSamplingRatio: float, *, gapValue: float = None, antiAliasing: bool = False):
+    # resample every channel of data (indexed by channel, or a single channel) by downSamplingRatio,
+    # i.e. targetSamplesPerSec / samplesPerSec, keeping the dtype of data. Samples <= gapValue are gaps,
+    # they are never interpolated with valid samples and are set to gapValue in the result.
+    data = np.asarray(data)
+    single = data.ndim == 1
+    data = np.atleast_2d(data)
+    n = data.shape[1]
+    if n == 0:
+        # an empty read resamples to no samples
+        return data[0] if single else data
     step = 1.0 / downSamplingRatio      # samplesPerSec / targetSamplesPerSec
-    new_x = []
-    for u in np.arange(0, len(arr), step):
-        new_x.append(u)
-    '''
-    fill_value = (y[0], y[len(y) - 1])
-    f = interpolate.interp1d(x, y, bounds_error=False, fill_value=fill_value)
-    new_y = f(new_x)
-    '''
-    new_y = np.interp(new_x, x, y)
-    return array('h', new_y.astype(int).tolist())
+    gaps = data <= gapValue if gapValue is not None else np.zeros(data.shape, dtype=bool)
+    values = data
+    if antiAliasing and step > 1.0:
+        values, gaps = _antiAliasing(data, gaps, step)
+
+    if step >= 1.0 and step == int(step):
+        # integer decimation, take every step-th sample
+        newData = values[:, ::int(step)]
+        newGaps = gaps[:, ::int(step)]
+    else:
+        newX = np.arange(0, n, step)
+        i0 = np.minimum(newX.astype(np.int64), n - 1)
+        i1 = np.minimum(i0 + 1, n - 1)
+        w = newX - i0
+        newData = values[:, i0] * (1.0 - w) + values[:, i1] * w
+        newGaps = gaps[:, i0] | (gaps[:, i1] & (w > 0))
+
+    if np.issubdtype(data.dtype, np.integer):
+        newData = np.rint(newData)
+    newData = newData.astype(data.dtype)
+    if gapValue is not None:
+        newData[newGaps] = gapValue
+    return newData[0] if single else newData
+
+
+def fixsamplingarr(arr: array, downSamplingRatio: float):
+    return resample(np.asarray(arr), downSamplingRatio)
@@ -0,0 +1,142 @@
+"""
+MIT License
+
+Copyright (c) 2019 UCSF Hu Lab
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+
+from typing import Any
+from typing import List
+import numpy as np
+from . import constant
+
+
+def calibrateSamples(samples: np.ndarray, scale: float, offset: float, gapValues: List[float] = None):
+    # physical values scale * (samples + offset) as float64, samples equal to one of gapValues become MIN_DOUBLE_VALUE
+    data = scale * (samples + np.asarray(offset, dtype=np.float64))
+    if gapValues:
+        data[np.isin(samples, gapValues)] = constant.MIN_DOUBLE_VALUE
+    return data
+
+
+class WaveformSegment:
+    startTime = None        # datetime64[ns] of the first sample
+    secsPerTick = 0.0
+    channelNames = []
+    units = []
+    data = None             # indexed by channel, 2-D ndarray or list of 1-D arrays, memory maps or MappedChannel
+    scales = None           # per channel scale of raw data in the storage type, None if data is in physical units (or None for a channel)
+    offsets = None          # per channel offset of raw data
+    gapValues = None        # raw values of gap samples
+
+    def __init__(self, startTime: np.datetime64, secsPerTick: float, channelNames: List[str], units: List[str], data: Any,
+                 scales: List[float] = None, offsets: List[float] = None, gapValues: List[float] = None):
+        # with scales and offsets, data holds the raw samples, e.g. int16, and is only calibrated when physical values are asked for
+        self.startTime = np.datetime64(startTime, "ns")
+        self.secsPerTick = secsPerTick
+        self.channelNames = channelNames
+        self.units = units
+        self.data = data
+        self.scales = scales
+        self.offsets = offsets
+        self.gapValues = gapValues
+
+    def getSamplingRate(self):
+        return 1.0 / self.secsPerTick
+
+    def getNumSamples(self):
+        return len(self.data[0]) if len(self.channelNames) > 0 else 0
+
+    def getDurationSeconds(self):
+        return self.getNumSamples() * self.secsPerTick
+
+    def getEndTime(self):
+        # time just after the last sample
+        return self.startTime + np.timedelta64(int(round(self.getDurationSeconds() * 1e9)), "ns")
+
+    def _channelIndex(self, name: Any):
+        if isinstance(name, str):
+            if name not in self.channelNames:
+                raise KeyError("Channel not found: {0}".format(name))
+            return self.channelNames.index(name)
+        return name
+
+    def getChannel(self, name: Any):
+        # channel by name or by index, raw samples if the segment has scales
+        return self.data[self._channelIndex(name)]
+
+    def isRaw(self):
+        return self.scales is not None
+
+    def getPhysicalChannel(self, name: Any):
+        # channel by name or by index as float64 in physical units, gaps of raw samples are MIN_DOUBLE_VALUE
+        k = self._channelIndex(name)
+        samples = np.asarray(self.data[k][:])
+        if self.scales is None or self.scales[k] is None:
+            return samples.astype(np.float64)
+        return calibrateSamples(samples, self.scales[k], self.offsets[k], self.gapValues)
+
+    def toPhysical(self):
+        # segment of the calibrated float64 samples, the segment itself if it is not raw
+        if self.scales is None:
+            return self
+        return WaveformSegment(self.startTime, self.secsPerTick, self.channelNames, self.units,
+                               np.array([self.getPhysicalChannel(k) for k in range(len(self.channelNames))]))
+
+    def getTimestamps(self, start: int = 0, stop: int = None):
+        # datetime64[ns] timestamps of samples [start, stop), only computed when asked for
+        if stop is None:
+            stop = self.getNumSamples()
+        ticks = np.rint(np.arange(start, stop) * (self.secsPerTick * 1e9)).astype(np.int64)
+        return self.startTime + ticks.astype("timedelta64[ns]")
+
+    def getSampleIndex(self, t: np.datetime64):
+        # index of the first sample at or after t, clipped to [0, number of samples]
+        seconds = (np.datetime64(t, "ns") - self.startTime) / np.timedelta64(1, "s")
+        # the tolerance absorbs the rounding of timestamps to nanoseconds
+        index = int(np.ceil(seconds / self.secsPerTick - 1e-6))
+        return min(max(index, 0), self.getNumSamples())
+
+    def slice(self, start: int, stop: int = None):
+        # samples [start, stop) as a new segment, ndarray and memory map data are views without copy
+        numSamples = self.getNumSamples()
+        start = min(max(start, 0), numSamples)
+        stop = numSamples if stop is None else min(max(stop, start), numSamples)
+        if isinstance(self.data, np.ndarray):
+            data = self.data[:, start:stop]
+        else:
+            data = [d[start:stop] for d in self.data]
+        startTime = self.startTime + np.timedelta64(int(round(start * self.secsPerTick * 1e9)), "ns")
+        return WaveformSegment(startTime, self.secsPerTick, self.channelNames, self.units, data, self.scales, self.offsets, self.gapValues)
+
+    def between(self, t0: np.datetime64, t1: np.datetime64):
+        # samples with timestamps t0 <= t < t1
+        return self.slice(self.getSampleIndex(t0), self.getSampleIndex(t1))
+
+    def toDataFrame(self, withTime: bool = True):
+        # DataFrame with one column per channel in physical units, and a 'time' column first if withTime
+        import pandas as pd
+        columns = {}
+        if withTime:
+            columns["time"] = self.getTimestamps()
+        for k, name in enumerate(self.channelNames):
+            columns[name] = self.getPhysicalChannel(k) if self.scales is not None else np.asarray(self.data[k][:])
+        return pd.DataFrame(columns)
@@ -0,0 +1,2 @@
+# The repository directory is put on the module search path by pytest for this conftest.py,
+# so that the tests under tests/ import binfilepy and wavepipeline from the working tree
@@ -1,12 +1,27 @@
 # Extract waveforms from ADIBIN files for patient encounters with the validated waveform time (start and end time)
+# Wave cycles can be extracted in parallel with --workers processes, each with its own connection pool to the server,
+# or reading the files directly where the server directory is mounted, e.g. over NFS
 # Author: Ran Xiao, Emory University, April 2024
 import os
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
-import paramiko
 from binfilepy import BinFile
-import stat
-import posixpath
+from wavepipeline import AdibinCatalog
+from wavepipeline import DirectoryListingCache
+from wavepipeline import ValidWindowIndex
+from wavepipeline import PrefetchPool
+from wavepipeline import fetchSampleRange
+from wavepipeline import writeColumnar
+from wavepipeline import ColumnarAppender
+from wavepipeline import ChunkedAppender
+from wavepipeline import CheckpointManifest
+from wavepipeline import checkpointKey
+from wavepipeline import LocalStorage
+from wavepipeline import SFTPStorage
+from wavepipeline import StageMetrics
 
 # connection string to the database from the config file
 config = {}
@@ -19,141 +34,405 @@ pwd = config['pwd']
 host = config['host']
 dir_waveform = config['dir_waveform']
 dir_output = config['dir_output']
-# create a directory for the output if it does not exist
-if not os.path.exists(dir_output):
-    os.makedirs(dir_output)
-
-# load validated waveform time
-ValidWaveTime_allEnc = pd.read_excel(dir_output+'ValidWaveTime_allEnc.xlsx')
-
-# establish a connection to the server
-transport = paramiko.Transport((host, 22))
-transport.connect(username=usr, password=pwd)
-sftp = paramiko.SFTPClient.from_transport(transport)
-sftp.chdir(dir_waveform)
-
-# create a dataframe to store the meta data for whether the adibin file exists for each row in ValidWaveTime_allEnc
-meta_data_Enc = ValidWaveTime_allEnc
-meta_data_Enc['exist_adibin'] = 0
-meta_data_Enc['total_dur_seconds'] = 0
-
-# for each row in ValidWaveTime_allEnc, extract the waveform data
-for i in range(5):#len(ValidWaveTime_allEnc)):
+# optional comma separated list of channel names to extract, e.g. channels=II,ART, empty means all channels
+channels_selected = [c for c in config.get('channels', '').split(',') if c]
+# local index of the adibin file headers, only headers of new or changed files are read from the server
+catalog_file = config.get('catalog', dir_output + 'adibin_catalog.sqlite')
+# number of download threads, each with its own connection, and number of files downloaded ahead of the decoding
+download_workers = int(config.get('download_workers', 4))
+download_depth = int(config.get('download_depth', 8))
+download_retries = int(config.get('download_retries', 3))
+# directory for the temporary downloaded files, default is the system temporary directory
+tmp_dir = config.get('tmp_dir') or None
+# local cache of the directory listings of the patient folders, a folder is listed again only when it changed
+listing_cache_file = config.get('listing_cache', dir_output + 'listing_cache.json')
+listing_workers = int(config.get('listing_workers', 4))
+# 1 stitches the valid waveform of all adibin files of a wave cycle into one continuous store, 0 writes one folder per adibin file
+stitch_wavecycles = int(config.get('stitch_wavecycles', 1))
+# 1 keeps the samples in their storage type, e.g. int16, with the scale and offset of each channel to calibrate them on reading,
+# 0 stores float64 samples in physical units
+raw_samples = int(config.get('raw_samples', 0))
+# zlib or lzma stores the output in delta encoded and compressed chunks of chunk_seconds, with an index to read any time range,
+# empty stores it uncompressed
+compress_output = config.get('compress_output', '')
+chunk_seconds = float(config.get('chunk_seconds', 60))
+# storage of the adibin files, sftp to the server, or local when dir_waveform is mounted on this node, e.g. over NFS
+storage_backend = config.get('storage', 'sftp')
+# the sftp connections of a process, the channels multiplexed over each connection, and the keepalive interval in seconds
+sftp_connections = int(config.get('sftp_connections', 2))
+sftp_channels = int(config.get('sftp_channels', 4))
+sftp_keepalive = int(config.get('sftp_keepalive', 30))
+# JSON lines of the wall time, bytes and samples of each stage of each file, and the stage profiled with cprofile or tracemalloc, if any
+metrics_file = config.get('metrics_file', dir_output + 'metrics.jsonl')
+profile_stage = config.get('profile_stage', '')
+profile_mode = config.get('profile_mode', 'cprofile')
+
+
+# open the storage of the adibin files
+def connect_storage():
+    if storage_backend == 'local':
+        storage = LocalStorage()
+    else:
+        storage = SFTPStorage(host, usr, pwd, maxConnections=sftp_connections, channelsPerConnection=sftp_channels, keepalive=sftp_keepalive)
+    storage.open()
+    return storage
+
+
+# storage, catalog, directory listing cache and stage metrics of this process, opened on first use
+storage = None
+catalog = None
+listing = None
+metrics = None
+
+
+def open_metrics():
+    global metrics
+    if metrics is None:
+        metrics = StageMetrics(metrics_file, profileStage=profile_stage, profileMode=profile_mode, profileDir=dir_output)
+        metrics.open()
+
+
+def open_connection():
+    global storage, catalog, listing
+    open_metrics()
+    if storage is None:
+        storage = connect_storage()
+        catalog = AdibinCatalog(catalog_file)
+        catalog.open()
+        # the subdirectories of a patient folder are listed concurrently, sharing the storage
+        listing = DirectoryListingCache(listing_cache_file, numWorkers=listing_workers)
+        listing.open()
+
+
+# open the store of the output at the path of get_output_path()
+def open_store(path):
+    if compress_output:
+        store = ChunkedAppender(path, raw=bool(raw_samples), codec=compress_output, chunkSeconds=chunk_seconds)
+    else:
+        store = ColumnarAppender(path, raw=bool(raw_samples))
+    store.open()
+    return store
+
+
+# total size of the files in a folder
+def folder_size(path):
+    if not os.path.isdir(path):
+        return 0
+    return sum(e.stat().st_size for e in os.scandir(path) if e.is_file())
+
+
+# checkpoint manifests of the wave cycle folders used by this process, the extracted files are skipped in a rerun
+manifests = {}
+
+
+# output folder for row combining Wynton_doler, Patient_ID_GE and WaveCycleUID
+def get_output_folder(row):
+    folder_name = row['Wynton_folder'] + '_' + row['Patient_ID_GE'] + '_' + str(row['WaveCycleUID'])
+    return dir_output+folder_name+'/'
+
+
+# valid waveform time of a row in a folder name, e.g. 20130512T190005_20130512T190100, with fractions of a second only if the row has them
+def get_window_name(row):
+    return '_'.join(np.datetime_as_string(np.datetime64(row[c], 'us'), unit='auto').replace('-', '').replace(':', '')
+                    for c in ['ValidStartTime', 'ValidStopTime'])
+
+
+# output of the j-th adibin file of a row with the current output settings, the continuous store of the wave cycle or a folder per file,
+# a folder per file is named with the valid waveform time as well, as the rows of a wave cycle cut the same file differently,
+# compressed stores are kept in another folder, as the two kinds cannot be appended to each other
+def get_output_path(row, j):
+    output_path = get_output_folder(row) + ('continuous' if stitch_wavecycles else str(j) + '_' + get_window_name(row))
+    return output_path + '_chunked' if compress_output else output_path
+
+
+def get_manifest(dir_output_extractedWaveform):
+    if dir_output_extractedWaveform not in manifests:
+        if not os.path.exists(dir_output_extractedWaveform):
+            os.makedirs(dir_output_extractedWaveform)
+        manifests[dir_output_extractedWaveform] = CheckpointManifest(dir_output_extractedWaveform + 'checkpoint.jsonl')
+        manifests[dir_output_extractedWaveform].open()
+    return manifests[dir_output_extractedWaveform]
+
+
+# key of a file cut with the valid waveform time of a row, in the checkpoint manifest and in the download pool
+def get_checkpoint_key(entry, row):
+    return checkpointKey(entry.path, entry.size, entry.mtime, row['ValidStartTime'], row['ValidStopTime'])
+
+
+# the checkpoint record of the j-th file extracted with the valid waveform time of a row, None if it has to be extracted
+def get_checkpoint(entry, row, j):
+    record = get_manifest(get_output_folder(row)).get(get_checkpoint_key(entry, row))
+    # the output may have been removed since, or was written with other output settings
+    if record is not None and (record['OutputFile_dir'] != get_output_path(row, j) or not os.path.exists(record['OutputFile_dir'])):
+        return None
+    return record
+
+
+# get the catalog entries of the adibin files of the wave cycle in a row sorted by the file name
+def get_adibin_entries(row):
     # construct dir for each patient encounter which can have multiple wavecycles in each subdirectory and each wavecycle has multiple adibin files
     # e.g., /labs/hulab/UCSF/2013-08-deid/DE106215743039212/9ICU_13-DE106215743039212/DE106215743039212_20130512191301_6413.adibin
-    dir_binFiles = dir_waveform + ValidWaveTime_allEnc['Wynton_folder'].values[i] + '/' + ValidWaveTime_allEnc['Patient_ID_GE'].values[i] + '/'
-    # list all files in only the subdirectories
-    def list_files_in_subdirectories(sftp, dir_path, is_subdirectory=False):
-        files = []
-        for item in sftp.listdir_attr(dir_path):
-            # Use posixpath.join to ensure Unix-style paths
-            item_path = posixpath.join(dir_path, item.filename)
-
-            if stat.S_ISDIR(item.st_mode):  # Check if it is a directory
-                files.extend(list_files_in_subdirectories(sftp, item_path, True))
-            elif is_subdirectory:  # Add files only if it's from a subdirectory
-                files.append(item_path)
-        return files
-    all_files = list_files_in_subdirectories(sftp, dir_binFiles)
+    dir_binFiles = dir_waveform + row['Wynton_folder'] + '/' + row['Patient_ID_GE'] + '/'
+    # list all files in only the subdirectories, as (path, size, mtime), from the cached listing of the patient folder
+    with metrics.stage('list', folder=dir_binFiles) as record:
+        all_files = listing.listFiles(storage, dir_binFiles, minDepth=1)
+        record['files'] = len(all_files)
     # Filtering for files ending with one wavecyle plus .adibin
-    adibin_files = [file for file in all_files if file.endswith(str(ValidWaveTime_allEnc['WaveCycleUID'].values[i])+'.adibin')]
+    wavecycle_suffix = str(row['WaveCycleUID'])+'.adibin'
+    adibin_files = [file for file in all_files if file[0].endswith(wavecycle_suffix)]
+    # sort by the file name, and get the file headers from the catalog
+    adibin_files.sort()
+    with metrics.stage('catalog', folder=dir_binFiles) as record:
+        record['files'] = len(adibin_files)
+        return catalog.refresh(storage, adibin_files)
+
+
+# get the set of files overlapping with the valid waveform time of each row of a wave cycle, as a dict keyed by row index
+def get_valid_files(rows, adibin_entries):
+    # index of the valid waveform time of the rows, queried once for each file
+    windows = ValidWindowIndex([row['ValidStartTime'] for i, row in rows], [row['ValidStopTime'] for i, row in rows])
+    valid_files = {i: set() for i, row in rows}
+    for entry in adibin_entries:
+        for k in windows.findOverlapping(entry.startTime, entry.endTime):
+            i, row = rows[k]
+            # the overlap is exclusive at the stop time, a file starting at ValidStopTime or ending at ValidStartTime,
+            # or with less than a sample in the valid waveform time, has nothing to download
+            if entry.startTime < row['ValidStopTime'] and get_valid_window(entry, row['ValidStartTime'], row['ValidStopTime'])[4] > 0:
+                valid_files[i].add(entry.path)
+    return valid_files
+
+
+# get the valid waveform time in the file, and its sample offset and length as computed by readChannelData()
+def get_valid_window(entry, ValidStartTime, ValidStopTime):
+    Binfile_ValidStartTime = max(entry.startTime, ValidStartTime)
+    Binfile_ValidEndTime = min(entry.endTime, ValidStopTime)
+    Binfile_duration_seconds = ((Binfile_ValidEndTime - Binfile_ValidStartTime) / np.timedelta64(1, 's')).astype(float)
+    offset_seconds = (Binfile_ValidStartTime - entry.startTime) / np.timedelta64(1, 's')
+    offset_samples = int(offset_seconds / entry.secsPerTick)
+    length_samples = int(Binfile_duration_seconds / entry.secsPerTick)
+    return Binfile_ValidStartTime, Binfile_ValidEndTime, Binfile_duration_seconds, offset_samples, length_samples
+
+
+# queue the downloads of the valid waveform of a row, only the files overlapping with the valid waveform time are downloaded,
+# rows with the same valid waveform time, e.g. the encounters of a wave cycle, share the download of a file
+def prefetch_wavecycle(pool, i, row, adibin_entries, valid_files):
+    for j, entry in enumerate(adibin_entries):
+        key = get_checkpoint_key(entry, row)
+        if entry.path in valid_files and not pool.submitted(key) and get_checkpoint(entry, row, j) is None:
+            offset_samples, length_samples = get_valid_window(entry, row['ValidStartTime'], row['ValidStopTime'])[3:]
+            pool.submit(key, lambda client, local_path, path=entry.path, offset=offset_samples, length=length_samples:
+                        download(client, i, path, local_path, offset, length))
+
+
+# download the samples of the valid waveform time of a file, in a download thread
+def download(client, i, path, local_path, offset_samples, length_samples):
+    with metrics.stage('download', encounter=i, file=path) as record:
+        fetchSampleRange(client, path, local_path, offset_samples, length_samples)
+        record['bytesIn'] = os.path.getsize(local_path)
+    return local_path
+
+
+# extract the waveform data of row i, returns (exist_adibin, total_dur_seconds)
+def extract_wavecycle(pool, i, row, adibin_entries, valid_files, num_encounters):
+    adibin_files = [entry.path for entry in adibin_entries]
     # if there is no adibin file in the directory, skip to the next row
     if len(adibin_files) == 0:
-        continue
-    else:
-        meta_data_Enc['exist_adibin'].values[i] = 1
-
-    # sort by the file name
-    adibin_files.sort()
+        return 0, 0
 
-    ValidStartTime = ValidWaveTime_allEnc['ValidStartTime'].values[i]
-    ValidStopTime = ValidWaveTime_allEnc['ValidStopTime'].values[i]
+    ValidStartTime = row['ValidStartTime']
+    ValidStopTime = row['ValidStopTime']
 
     # create a folder in the output directory for row combining Wynton_doler, Patient_ID_GE and WaveCycleUID
-    folder_name = ValidWaveTime_allEnc['Wynton_folder'].values[i] + '_' + ValidWaveTime_allEnc['Patient_ID_GE'].values[i] + '_' + str(ValidWaveTime_allEnc['WaveCycleUID'].values[i])
-    dir_output_extractedWaveform = dir_output+folder_name+'/'
+    dir_output_extractedWaveform = get_output_folder(row)
     if not os.path.exists(dir_output_extractedWaveform):
         os.makedirs(dir_output_extractedWaveform)
 
     # create an empty dataframe to store the meta data for each adibin file with row number of len(adibin_files)
     meta_data_adibin = pd.DataFrame(index=range(len(adibin_files)), columns=['file_ind','exist_valid_waveform', 'OutputFile_dir','channel_name', 'Binfile_ValidStartTime', 'Binfile_ValidEndTime', 'Binfile_duration_seconds', 'file_start_time', 'file_end_time', 'file_duration_seconds', 'Wavecycle_ValidStartTime', 'Wavecycle_ValidStopTime','Binfile_dir'])
+    # the continuous store of the wave cycle, gaps between files are filled with gap values and overlaps are trimmed,
+    # files with other channels or secsPerTick are merged into the channels and resampled to the secsPerTick of the store
+    store = None
+    if stitch_wavecycles:
+        # all files of the wave cycle go to the same store
+        store = open_store(get_output_path(row, 0))
     for j in range(len(adibin_files)):
-        # download the file to a temporary directory
-        sftp.get(adibin_files[j], 'temp.adibin')
-        # for each adibin file, extract the waveform data with valid start and end time, adding time vector, and save it to a pickle file
-        with BinFile('temp.adibin', "r") as f:
+        # get the starting and end time for the waveform file from the catalog
+        entry = adibin_entries[j]
+        file_start_time = entry.startTime
+        file_duration_seconds = entry.getDurationSeconds()
+        file_end_time = entry.endTime
+        # get channel names, if there is no channel name, use 'Unnamed_Channel_1', 'Unnamed_Channel_2', etc.
+        # duplicated channel names only keep the first channel
+        channel_name = list(dict.fromkeys(entry.getChannelNames()))
+        # only keep the channels listed in the config file, if any
+        if channels_selected:
+            channel_name = [name for name in channel_name if name in channels_selected]
+
+        meta_data_adibin['file_ind'].values[j] = j
+        meta_data_adibin['channel_name'].values[j] = channel_name
+        meta_data_adibin['file_start_time'].values[j] = file_start_time
+        meta_data_adibin['file_end_time'].values[j] = file_end_time
+        meta_data_adibin['file_duration_seconds'].values[j] = file_duration_seconds
+        meta_data_adibin['Wavecycle_ValidStartTime'].values[j] = ValidStartTime
+        meta_data_adibin['Wavecycle_ValidStopTime'].values[j] = ValidStopTime
+        meta_data_adibin['Binfile_dir'].values[j] = adibin_files[j]
+
+        if adibin_files[j] not in valid_files:
+            meta_data_adibin['exist_valid_waveform'].values[j] = 0
+            meta_data_adibin['Binfile_duration_seconds'].values[j] = 0
+            continue
+        else:
+            Binfile_ValidStartTime, Binfile_ValidEndTime, Binfile_duration_seconds = get_valid_window(entry, ValidStartTime, ValidStopTime)[:3]
+            meta_data_adibin['exist_valid_waveform'].values[j] = 1
+            meta_data_adibin['Binfile_ValidStartTime'].values[j] = Binfile_ValidStartTime
+            meta_data_adibin['Binfile_ValidEndTime'].values[j] = Binfile_ValidEndTime
+            meta_data_adibin['Binfile_duration_seconds'].values[j] = Binfile_duration_seconds
+
+        # skip the files extracted by a previous run or an earlier row, a download queued for the file is taken and dropped,
+        # so that it does not hold a slot of the pool
+        key = get_checkpoint_key(entry, row)
+        record = get_checkpoint(entry, row, j)
+        if record is not None:
+            meta_data_adibin['OutputFile_dir'].values[j] = record['OutputFile_dir']
+            if pool.submitted(key):
+                local_file = pool.get(key)
+                os.remove(local_file)
+            continue
+
+        # for each adibin file, extract the waveform data with valid start and end time, and append it to the continuous store
+        # or save it to a columnar folder
+        # the download pool has copied only the header and the samples of the valid waveform time to a local file
+        # time spent waiting for the download pool, i.e. downloads not keeping up with the decoding
+        with metrics.stage('wait', encounter=i, file=adibin_files[j]):
+            local_file = pool.get(key)
+        with BinFile(local_file, "r") as f:
             # You must read header first before you can read channel data
             f.readHeader()
-            # get channel names in each element of the list f.channels
-            channel_name = []
-            for c in f.channels:
-                channel_name.append(c.Title)
-            # if there is no channel name, use 'Unnamed_Channel_1', 'Unnamed_Channel_2', etc. There can be multiple unnamed channels
-            channel_name = [name if name else f'Unnamed_Channel_{c + 1}' for c, name in enumerate(channel_name) if
-                            name == '' or c == channel_name.index(name)]
-
-            # calculate the sampling frequency
-            fs = 1/ f.header.secsPerTick
-            # get the starting and end time for the waveform file
-            file_start_time = np.datetime64(
-                f"{f.header.Year}-{f.header.Month:02}-{f.header.Day:02}T{f.header.Hour:02}:{f.header.Minute:02}:{f.header.Second:09.6f}")
-            file_duration_seconds = f.header.SamplesPerChannel * f.header.secsPerTick
-            file_end_time = file_start_time + np.timedelta64(int(file_duration_seconds * 1e6), 'us')
-
-            meta_data_adibin['file_ind'].values[j] = j
-            meta_data_adibin['channel_name'].values[j] = channel_name
-            meta_data_adibin['file_start_time'].values[j] = file_start_time
-            meta_data_adibin['file_end_time'].values[j] = file_end_time
-            meta_data_adibin['file_duration_seconds'].values[j] = file_duration_seconds
-            meta_data_adibin['Wavecycle_ValidStartTime'].values[j] = ValidStartTime
-            meta_data_adibin['Wavecycle_ValidStopTime'].values[j] = ValidStopTime
-            meta_data_adibin['Binfile_dir'].values[j] = adibin_files[j]
-
-            if file_end_time < ValidStartTime or file_start_time > ValidStopTime:
-                meta_data_adibin['exist_valid_waveform'].values[j] = 0
-                meta_data_adibin['Binfile_duration_seconds'].values[j] = 0
-                continue
-            else:
-                Binfile_ValidStartTime = max(file_start_time, ValidStartTime)
-                Binfile_ValidEndTime = min(file_end_time, ValidStopTime)
-                meta_data_adibin['exist_valid_waveform'].values[j] = 1
-                meta_data_adibin['Binfile_ValidStartTime'].values[j] = Binfile_ValidStartTime
-                meta_data_adibin['Binfile_ValidEndTime'].values[j] = Binfile_ValidEndTime
-                Binfile_duration_seconds = ((Binfile_ValidEndTime - Binfile_ValidStartTime) / np.timedelta64(1, 's')).astype(float)
-                meta_data_adibin['Binfile_duration_seconds'].values[j] = Binfile_duration_seconds
-
-            # generate a time vector for the waveform data
-            time_vector = np.arange(0, Binfile_duration_seconds, 1/fs)
-            time_vector = Binfile_ValidStartTime + time_vector.astype('timedelta64[ms]')
-
-            # readChannelData() supports reading in random location (Note: offset=0, length=0 indicate read the whole file)
-            wave_data = f.readChannelData(offset=(Binfile_ValidStartTime-file_start_time).astype('timedelta64[s]').astype(float), length=meta_data_adibin['Binfile_duration_seconds'].values[j], useSecForOffset=True, useSecForLength=True)
-
-            # combine the time vector and the waveform data with channel names
-            dtype = [('time', 'datetime64[ms]')]  # start with the time column
-            dtype += [(name, 'float64') for name in channel_name]  # add each ECG channel
-            combined_data = np.empty(len(time_vector), dtype=dtype)
-            # Fill the time column
-            combined_data['time'] = time_vector
-            # Fill each ECG channel
-            for k, name in enumerate(channel_name):
-                combined_data[name] = wave_data[k]
-            combined_data = pd.DataFrame(combined_data)
-
-            meta_data_adibin['OutputFile_dir'].values[j] = dir_output_extractedWaveform + str(j) + '.pkl'
-
-            # save combined_data
-            combined_data.to_pickle(meta_data_adibin['OutputFile_dir'].values[j])
-            # combined_data.to_hdf(dir_output_extractedWaveform + '/' + adibin_files[j] + '.h5', key='df', mode='w')
-            # np.save(dir_output_extractedWaveform + '/' + adibin_files[j] + '.npy', combined_data)
+
+            # readSegment() supports reading in random location (Note: offset=0, length=0 indicate read the whole file),
+            # the segment holds the samples with the start time and secsPerTick, timestamps are only computed on request
+            with metrics.stage('decode', encounter=i, file=adibin_files[j]) as record:
+                segment = f.readSegment(offset=0, length=0, useSecForOffset=False, useSecForLength=False,
+                                        noDataScaling=bool(raw_samples), channels=channel_name)
+                record['bytesIn'] = os.path.getsize(local_file)
+                record['samples'] = segment.data.size
+
+            with metrics.stage('write', encounter=i, file=adibin_files[j]) as record:
+                meta_data_adibin['OutputFile_dir'].values[j] = get_output_path(row, j)
+                if store is not None:
+                    size = folder_size(store.path)
+                    store.append(segment)
+                elif compress_output:
+                    # the output of a previous run that was not completed is replaced
+                    shutil.rmtree(meta_data_adibin['OutputFile_dir'].values[j], ignore_errors=True)
+                    size = 0
+                    file_store = open_store(meta_data_adibin['OutputFile_dir'].values[j])
+                    file_store.append(segment)
+                    file_store.close()
+                else:
+                    size = 0
+                    # save one .npy file per channel and a json sidecar with the start time of the first sample and secsPerTick
+                    writeColumnar(meta_data_adibin['OutputFile_dir'].values[j], segment)
+                # readColumnar(path) loads the output back as a WaveformSegment, getPhysicalChannel() calibrates raw samples,
+                # readChunked(path, startTime, endTime) reads a time range of a compressed store
+                record['bytesOut'] = folder_size(meta_data_adibin['OutputFile_dir'].values[j]) - size
 
         # remove the temporary file
-        os.remove('temp.adibin')
-        # save meta_data_adibin to an excel file
-        meta_data_adibin.to_excel(dir_output_extractedWaveform + 'meta_data_adibin.xlsx')
+        os.remove(local_file)
+        # the output of the file is complete, record it in the checkpoint manifest
+        get_manifest(dir_output_extractedWaveform).markDone(key, {'OutputFile_dir': meta_data_adibin['OutputFile_dir'].values[j]})
 
         # print progress
-        print(f'Progress: {i+1} out of {len(ValidWaveTime_allEnc)} encounters, {j+1} out of {len(adibin_files)} adibin files')
-    meta_data_Enc['total_dur_seconds'].values[i] = meta_data_adibin['Binfile_duration_seconds'].sum()
+        print(f'Progress: {i+1} out of {num_encounters} encounters, {j+1} out of {len(adibin_files)} adibin files')
+    if store is not None:
+        store.close()
+    # save meta_data_adibin to an excel file once all files of the row are extracted
+    with metrics.stage('excel', encounter=i) as record:
+        meta_data_adibin.to_excel(dir_output_extractedWaveform + 'meta_data_adibin.xlsx')
+        record['bytesOut'] = os.path.getsize(dir_output_extractedWaveform + 'meta_data_adibin.xlsx')
+    return 1, meta_data_adibin['Binfile_duration_seconds'].sum()
+
+
+# extract the rows of one task, the rows of a task write to the same output folder and are extracted in order,
+# returns a list of (row index, exist_adibin, total_dur_seconds) and the totals of the stage metrics
+def extract_rows(rows, num_encounters):
+    open_connection()
+    results = []
+    # download the valid waveform of the upcoming files while the current file is decoded,
+    # the download threads share the storage, which reconnects by itself
+    with PrefetchPool(lambda: storage, numWorkers=download_workers, depth=download_depth, retries=download_retries,
+                      disconnect=lambda client: None, tmpDir=tmp_dir) as pool:
+        # all rows of a task are the same wave cycle, its files are listed once
+        adibin_entries = get_adibin_entries(rows[0][1])
+        valid_files = get_valid_files(rows, adibin_entries)
+        prefetched = set()
+        for k, (i, row) in enumerate(rows):
+            # queue the downloads of this row and of the next one
+            for ii, rr in rows[k:k + 2]:
+                if ii not in prefetched:
+                    prefetch_wavecycle(pool, ii, rr, adibin_entries, valid_files[ii])
+                    prefetched.add(ii)
+            # the encounter record adds up the bytes and samples of the stages of its files, except the downloads in other threads
+            with metrics.stage('encounter', encounter=i, folder=get_output_folder(row)):
+                exist_adibin, total_dur_seconds = extract_wavecycle(pool, i, row, adibin_entries, valid_files[i], num_encounters)
+            results.append((i, exist_adibin, total_dur_seconds))
+    for manifest in manifests.values():
+        manifest.close()
+    manifests.clear()
+    listing.save()
+    metrics.flush()
+    return results, metrics.takeTotals()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract waveforms from ADIBIN files with the validated waveform time')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes extracting wave cycles in parallel')
+    args = parser.parse_args()
+
+    # create a directory for the output if it does not exist
+    if not os.path.exists(dir_output):
+        os.makedirs(dir_output)
+
+    # load validated waveform time
+    ValidWaveTime_allEnc = pd.read_excel(dir_output+'ValidWaveTime_allEnc.xlsx')
+
+    # create a dataframe to store the meta data for whether the adibin file exists for each row in ValidWaveTime_allEnc
+    meta_data_Enc = ValidWaveTime_allEnc
+    meta_data_Enc['exist_adibin'] = 0
+    meta_data_Enc['total_dur_seconds'] = 0
+
+    # for each row in ValidWaveTime_allEnc, extract the waveform data
+    # rows writing to the same output folder are one task, and tasks are extracted in parallel
+    tasks = {}
+    for i in range(len(ValidWaveTime_allEnc)):
+        row = {c: ValidWaveTime_allEnc[c].values[i] for c in ['Wynton_folder', 'Patient_ID_GE', 'WaveCycleUID', 'ValidStartTime', 'ValidStopTime']}
+        tasks.setdefault(get_output_folder(row), []).append((i, row))
+    # the continuous store can only grow at its end, so the rows of a wave cycle are extracted by their valid start time
+    for rows in tasks.values():
+        rows.sort(key=lambda r: r[1]['ValidStartTime'])
+    num_encounters = [len(ValidWaveTime_allEnc)] * len(tasks)
+    # each process opens its own metrics in extract_rows(), the worker processes are forked without an open metrics file or profiler
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            task_results = list(executor.map(extract_rows, tasks.values(), num_encounters))
+    else:
+        task_results = list(map(extract_rows, tasks.values(), num_encounters))
+    open_metrics()
+
+    # merge the results of all tasks into meta_data_Enc
+    for results, totals in task_results:
+        metrics.addTotals(totals)
+        for i, exist_adibin, total_dur_seconds in results:
+            meta_data_Enc['exist_adibin'].values[i] = exist_adibin
+            meta_data_Enc['total_dur_seconds'].values[i] = total_dur_seconds
     # save meta_data_Enc to an excel file
-    meta_data_Enc.to_excel(dir_output + 'meta_data_Enc.xlsx')
\ No newline at end of file
+    with metrics.stage('excel') as record:
+        meta_data_Enc.to_excel(dir_output + 'meta_data_Enc.xlsx')
+        record['bytesOut'] = os.path.getsize(dir_output + 'meta_data_Enc.xlsx')
+    if catalog is not None:
+        catalog.close()
+        listing.close()
+        storage.close()
+    # totals of all processes per stage
+    print(metrics.formatSummary())
+    metrics.close()
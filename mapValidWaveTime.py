@@ -8,8 +8,10 @@
 
 # import the necessary libraries
 import pandas as pd
-import paramiko
 import os
+from wavepipeline import RemoteFileCache
+from wavepipeline import LocalStorage
+from wavepipeline import SFTPStorage
 
 # connection string to the database from the config file
 config = {}
@@ -22,6 +24,14 @@ pwd = config['pwd']
 host = config['host']
 dir_waveform = config['dir_waveform']
 dir_output = config['dir_output']
+# local copies of the MRN-Mapping.csv files, a file is downloaded again only when it changed on the server
+mapping_cache_dir = config.get('mapping_cache', dir_output + 'MRN-Mapping-cache/')
+# number of threads downloading the MRN-Mapping.csv files, sharing the pooled connections
+mapping_workers = int(config.get('mapping_workers', 8))
+# storage of the patient folders, sftp to the server, or local when dir_waveform is mounted on this node, e.g. over NFS
+storage_backend = config.get('storage', 'sftp')
+sftp_connections = int(config.get('sftp_connections', 2))
+sftp_channels = int(config.get('sftp_channels', 4))
 # create a directory for the output if it does not exist
 if not os.path.exists(dir_output):
     os.makedirs(dir_output)
@@ -30,25 +40,30 @@ if not os.path.exists(dir_output):
 df_enc = pd.read_excel('sampleEncounterList.xlsx')
 df_offset_table = pd.read_excel('encounter_date_offset_table_ver_Apr2024.xlsx')
 
-# establish a connection to the server
-transport = paramiko.Transport((host, 22))
-transport.connect(username=usr, password=pwd)
-sftp = paramiko.SFTPClient.from_transport(transport)
-sftp.chdir(dir_waveform)
+# open the storage of the patient folders
+if storage_backend == 'local':
+    storage = LocalStorage()
+else:
+    storage = SFTPStorage(host, usr, pwd, maxConnections=sftp_connections, channelsPerConnection=sftp_channels)
+storage.open()
 
 # find encounters with mapped Wynton_folder
 df_mapped = df_offset_table[df_offset_table['Encounter_ID'].isin(df_enc['Encounter_ID'])]
 
-# loop through each row in df_mapped
-ValidWaveTime_allEnc = pd.DataFrame()
-for i in range(len(df_mapped)):
-    # construct dir for MRN-Mapping.csv for each patient
-    # e.g., /labs/hulab/UCSF/2013-03-deid/DE104397434432468/MRN-Mapping.csv
-    dir_MappingFile = dir_waveform + df_mapped['Wynton_folder'].values[i] + '/DE' + str(df_mapped['Patient_ID_GE'].values[i]) + '/MRN-Mapping.csv'
-    # read the MRN-Mapping.csv file on the server
-    with sftp.open(dir_MappingFile) as f:
-        MRN_Mapping = pd.read_csv(f)
+# construct dir for MRN-Mapping.csv for each patient
+# e.g., /labs/hulab/UCSF/2013-03-deid/DE104397434432468/MRN-Mapping.csv
+dir_MappingFiles = [dir_waveform + df_mapped['Wynton_folder'].values[i] + '/DE' + str(df_mapped['Patient_ID_GE'].values[i]) + '/MRN-Mapping.csv'
+                    for i in range(len(df_mapped))]
+# download the MRN-Mapping.csv files that are new or changed concurrently, each file once
+with RemoteFileCache(mapping_cache_dir, numWorkers=mapping_workers) as cache:
+    unique_MappingFiles = list(dict.fromkeys(dir_MappingFiles))
+    local_MappingFiles = dict(zip(unique_MappingFiles, cache.fetchAll(storage, unique_MappingFiles)))
+storage.close()
 
+
+# read each MRN-Mapping.csv file once, tagged with the Wynton_folder and the patient folder it belongs to
+def read_mapping(dir_MappingFile, Wynton_folder, patient_folder):
+    MRN_Mapping = pd.read_csv(local_MappingFiles[dir_MappingFile])
     # convert BedTransfer_In','BedTransfer_Out', 'WaveStartTime' and 'WaveStopTime' to datetime
     # e.g. Wynton_folder    MRN_ADT	            UnitBed	BedTransfer_In	BedTransfer_Out  WaveCycleUID	WaveStartTime	WaveStopTime
     #     2018-08-deid      DE649769843712858	9ICU_6	10/2/17 14:41	10/2/17 23:59		44971	    1/11/17 23:31	2/17/69 0:00
@@ -56,34 +71,47 @@ for i in range(len(df_mapped)):
     MRN_Mapping['BedTransfer_Out'] = pd.to_datetime(MRN_Mapping['BedTransfer_Out'])
     MRN_Mapping['WaveStartTime'] = pd.to_datetime(MRN_Mapping['WaveStartTime'])
     MRN_Mapping['WaveStopTime'] = pd.to_datetime(MRN_Mapping['WaveStopTime'])
-
-    # for each unique 'WaveCycleUID' in MRN_Mapping, find time range for BedTransfer_In and BedTransfer_Out,
-    # and for WaveStartTime and WaveStopTime, here are the logics behind it:
-    # 1. get the smallest 'BedTransfer_In' and largest 'BedTransfer_Out',
-    # 2. and get the smallest "WaveStartTime" and largest "WaveStopTime"
-    MRN_Mapping_WaveCycles = MRN_Mapping.groupby('WaveCycleUID').agg(
-        Patient_ID_GE=('MRN_ADT', 'first'),
-        UnitBed=('UnitBed', 'first'),
-        BedTransfer_In=('BedTransfer_In', 'min'),
-        BedTransfer_Out=('BedTransfer_Out', 'max'),
-        WaveStartTime=('WaveStartTime', 'min'),
-        WaveStopTime=('WaveStopTime', 'max')
-    ).reset_index()
-
-    # if WaveStopTime is smaller than WaveStartTime, then set WaveStopTime to BedTransfer_Out
-    MRN_Mapping_WaveCycles.loc[MRN_Mapping_WaveCycles['WaveStopTime'] < MRN_Mapping_WaveCycles['WaveStartTime'], 'WaveStopTime'] = MRN_Mapping_WaveCycles['BedTransfer_Out']
-
-    # Logics for getting "ValidStartTime" and "ValidStopTime":
-    # "ValidStartTime" is the larger one of "BedTransfer_In" and "WaveStartTime"
-    # "ValidStopTime" is the smaller one of "BedTransfer_Out" and "WaveStopTime"
-    MRN_Mapping_WaveCycles['ValidStartTime'] = MRN_Mapping_WaveCycles[['BedTransfer_In', 'WaveStartTime']].max(axis=1)
-    MRN_Mapping_WaveCycles['ValidStopTime'] = MRN_Mapping_WaveCycles[['BedTransfer_Out', 'WaveStopTime']].min(axis=1)
-
-    # add Wynton_folder to the MRN_Mapping_WaveCycles
-    MRN_Mapping_WaveCycles.insert(0, 'Wynton_folder', df_mapped['Wynton_folder'].values[i])
-
-    ValidWaveTime_allEnc = pd.concat([ValidWaveTime_allEnc, MRN_Mapping_WaveCycles], ignore_index=True)
-    print(f'Progress: {i+1} out of {len(df_mapped)}')
+    MRN_Mapping['Wynton_folder'] = Wynton_folder
+    MRN_Mapping['patient_folder'] = patient_folder
+    return MRN_Mapping
+
+
+df_mapped = df_mapped.assign(patient_folder=pd.Series(['DE' + str(p) for p in df_mapped['Patient_ID_GE'].values], index=df_mapped.index, dtype=object),
+                             dir_MappingFile=dir_MappingFiles)
+patients = df_mapped.drop_duplicates(['Wynton_folder', 'patient_folder'])
+# an empty mapping with the columns of MRN-Mapping.csv when no encounter maps to a patient folder, so an empty list is written
+empty_mapping = pd.DataFrame(columns=['MRN_ADT', 'UnitBed', 'BedTransfer_In', 'BedTransfer_Out', 'WaveCycleUID', 'WaveStartTime', 'WaveStopTime',
+                                      'Wynton_folder', 'patient_folder'])
+MRN_Mapping = pd.concat([read_mapping(f, w, p) for f, w, p in patients[['dir_MappingFile', 'Wynton_folder', 'patient_folder']].values] or [empty_mapping],
+                        ignore_index=True)
+
+# for each wave cycle of all patients, i.e. each (Wynton_folder, patient folder, 'WaveCycleUID'), find time range for BedTransfer_In and BedTransfer_Out,
+# and for WaveStartTime and WaveStopTime, here are the logics behind it:
+# 1. get the smallest 'BedTransfer_In' and largest 'BedTransfer_Out',
+# 2. and get the smallest "WaveStartTime" and largest "WaveStopTime"
+MRN_Mapping_WaveCycles = MRN_Mapping.groupby(['Wynton_folder', 'patient_folder', 'WaveCycleUID']).agg(
+    Patient_ID_GE=('MRN_ADT', 'first'),
+    UnitBed=('UnitBed', 'first'),
+    BedTransfer_In=('BedTransfer_In', 'min'),
+    BedTransfer_Out=('BedTransfer_Out', 'max'),
+    WaveStartTime=('WaveStartTime', 'min'),
+    WaveStopTime=('WaveStopTime', 'max')
+).reset_index()
+
+# if WaveStopTime is smaller than WaveStartTime, then set WaveStopTime to BedTransfer_Out
+missing_WaveStopTime = MRN_Mapping_WaveCycles['WaveStopTime'] < MRN_Mapping_WaveCycles['WaveStartTime']
+MRN_Mapping_WaveCycles.loc[missing_WaveStopTime, 'WaveStopTime'] = MRN_Mapping_WaveCycles['BedTransfer_Out']
+
+# Logics for getting "ValidStartTime" and "ValidStopTime":
+# "ValidStartTime" is the larger one of "BedTransfer_In" and "WaveStartTime"
+# "ValidStopTime" is the smaller one of "BedTransfer_Out" and "WaveStopTime"
+MRN_Mapping_WaveCycles['ValidStartTime'] = MRN_Mapping_WaveCycles[['BedTransfer_In', 'WaveStartTime']].max(axis=1)
+MRN_Mapping_WaveCycles['ValidStopTime'] = MRN_Mapping_WaveCycles[['BedTransfer_Out', 'WaveStopTime']].min(axis=1)
+
+# the wave cycles of the patient of each row in df_mapped, in the order of df_mapped
+ValidWaveTime_allEnc = df_mapped[['Wynton_folder', 'patient_folder']].merge(MRN_Mapping_WaveCycles, on=['Wynton_folder', 'patient_folder'], how='inner')
+ValidWaveTime_allEnc = ValidWaveTime_allEnc.drop(columns='patient_folder')
+print(f"{len(ValidWaveTime_allEnc)} wave cycles of {len(df_mapped)} encounters")
 
 ValidWaveTime_allEnc.to_excel(dir_output+ 'ValidWaveTime_allEnc.xlsx', index=False)
 print('done')
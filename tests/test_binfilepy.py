@@ -0,0 +1,377 @@
+import os
+import struct
+from array import array
+import numpy as np
+from binfilepy import BinFile
+from binfilepy import BinFileError
+from binfilepy import CFWBINARY
+from binfilepy import CFWBCHANNEL
+from binfilepy import constant
+from binfilepy import WaveformSegment
+from binfilepy.fixsampling import resample
+
+
+def writeTestFile(filename, dataFormat, numSamples=500, numChannels=3):
+    # interleaved samples written directly after the header, short data has gap values in it
+    rng = np.random.default_rng(dataFormat)
+    typecode = constant.SAMPLE_TYPECODES[dataFormat]
+    if dataFormat == constant.FORMAT_SHORT:
+        frames = rng.integers(-32768, 32768, size=(numSamples, numChannels)).astype(typecode)
+        frames[::17, 0] = -32768
+        frames[::23, 1] = -32767
+    else:
+        frames = (rng.standard_normal((numSamples, numChannels)) * 100).astype(typecode)
+    with BinFile(filename, "w") as f:
+        f.setHeader(CFWBINARY(0.004, 2019, 3, 31, 8, 15, 30.0, NChannels=numChannels, SamplesPerChannel=numSamples, DataFormat=dataFormat))
+        for i in range(numChannels):
+            f.addChannel(CFWBCHANNEL("CH{0}".format(i), "mV", 0.01 * (i + 1), float(i - 1), 10.0, -10.0))
+        f.writeHeader()
+        f.f.write(frames.tobytes())
+    return frames
+
+
+def readReference(filename, offset, length, noDataScaling):
+    # sample by sample decoding of readChannelData() before it was vectorized
+    with open(filename, "rb") as f:
+        f.seek(constant.N_SAMPLE_POSITION - constant.INT32_SIZE)
+        nChannels, samplesPerChannel, timeChannel, dataFormat = struct.unpack("iiii", f.read(constant.INT32_SIZE * 4))
+        scales = []
+        offsets = []
+        for i in range(nChannels):
+            f.read(64)
+            scale, off, rangeHigh, rangeLow = struct.unpack("dddd", f.read(constant.DOUBLE_SIZE * 4))
+            scales.append(scale)
+            offsets.append(off)
+        typecode = constant.SAMPLE_TYPECODES[dataFormat]
+        sampleSize = struct.calcsize(typecode)
+        if offset == 0 and length == 0:
+            length = samplesPerChannel
+        elif length + offset > samplesPerChannel:
+            length = samplesPerChannel - offset
+        elif offset > samplesPerChannel:
+            length = 0
+        f.seek(constant.CFWB_SIZE + constant.CHANNEL_SIZE * nChannels + offset * sampleSize * nChannels, 0)
+        channelArr = [array(typecode if noDataScaling else "d", (0,) * length) for i in range(nChannels)]
+        for x in range(0, length):
+            for i, c in enumerate(channelArr):
+                v = struct.unpack(typecode, f.read(sampleSize))[0]
+                if noDataScaling or dataFormat != constant.FORMAT_SHORT:
+                    c[x] = v
+                elif v in constant.GAP_SHORT_VALUES:
+                    c[x] = constant.MIN_DOUBLE_VALUE
+                else:
+                    c[x] = scales[i] * (v + offsets[i])
+    return channelArr
+
+
+def test_readchanneldata_matches_reference(tmp_path):
+    for dataFormat in [constant.FORMAT_DOUBLE, constant.FORMAT_FLOAT, constant.FORMAT_SHORT]:
+        filename = str(tmp_path / "format{0}.adibin".format(dataFormat))
+        writeTestFile(filename, dataFormat)
+        # whole file, a range, a range clipped at the end, and an offset past the end
+        for offset, length in [(0, 0), (10, 100), (450, 100), (600, 10)]:
+            for noDataScaling in [False, True]:
+                expected = readReference(filename, offset, length, noDataScaling)
+                with BinFile(filename, "r") as f:
+                    f.readHeader()
+                    data = f.readChannelData(offset, length, False, False, noDataScaling=noDataScaling)
+                    arrays = f.readChannelData(offset, length, False, False, noDataScaling=noDataScaling, asArrayList=True)
+                assert len(data) == len(expected)
+                for k in range(len(expected)):
+                    assert np.array_equal(data[k], np.array(expected[k]))
+                    assert arrays[k] == expected[k]
+                if noDataScaling:
+                    assert data.dtype == np.dtype(constant.SAMPLE_TYPECODES[dataFormat])
+
+
+def test_readchanneldata_seconds(tmp_path):
+    filename = str(tmp_path / "seconds.adibin")
+    writeTestFile(filename, constant.FORMAT_SHORT)
+    expected = readReference(filename, 25, 250, False)
+    with BinFile(filename, "r") as f:
+        f.readHeader()
+        data = f.readChannelData(0.1, 1.0, True, True)
+    for k in range(len(expected)):
+        assert np.array_equal(data[k], np.array(expected[k]))
+
+
+def writeChannels(filename, dataFormat, chanData):
+    with BinFile(filename, "w") as f:
+        f.setHeader(CFWBINARY(0.004, 2019, 3, 31, 8, 15, 30.0, NChannels=len(chanData), DataFormat=dataFormat))
+        for i in range(len(chanData)):
+            f.addChannel(CFWBCHANNEL("CH{0}".format(i), "mV", 1.0, 0.0, 10.0, -10.0))
+        f.writeHeader()
+        numSamples = f.writeChannelData(chanData)
+        f.updateSamplesPerChannel(numSamples, True)
+
+
+def test_writechanneldata(tmp_path):
+    filename = str(tmp_path / "write.adibin")
+    chanData = [[1, -2, 3, 32767], [4, -32768, 6]]
+    writeChannels(filename, constant.FORMAT_SHORT, chanData)
+    with BinFile(filename, "r") as f:
+        f.readHeader()
+        data = f.readChannelData(0, 0, False, False, noDataScaling=True)
+    assert data.tolist() == [[1, -2, 3, 32767], [4, -32768, 6, constant.MIN_SHORT_VALUE]]
+
+
+def test_writechanneldata_out_of_range(tmp_path):
+    # values that do not fit the sample type are not wrapped around or truncated
+    for dataFormat, chanData in [(constant.FORMAT_SHORT, [[1, 40000]]), (constant.FORMAT_SHORT, [[1.7, 2.0]]),
+                                 (constant.FORMAT_SHORT, [[np.nan, 2.0]]), (constant.FORMAT_SHORT, np.array([[1, -40000]])),
+                                 (constant.FORMAT_FLOAT, [[1.0, 1e40]])]:
+        filename = str(tmp_path / "range.adibin")
+        if os.path.exists(filename):
+            os.remove(filename)
+        try:
+            writeChannels(filename, dataFormat, chanData)
+            assert False
+        except BinFileError:
+            pass
+    # integral floats and infinite floats are written
+    writeChannels(str(tmp_path / "integral.adibin"), constant.FORMAT_SHORT, [[1.0, -32768.0]])
+    writeChannels(str(tmp_path / "inf.adibin"), constant.FORMAT_FLOAT, [[1.0, np.inf]])
+
+
+def test_readchanneldata_downsampled_empty(tmp_path):
+    filename = str(tmp_path / "empty.adibin")
+    writeTestFile(filename, constant.FORMAT_SHORT)
+    with BinFile(filename, "r") as f:
+        f.readHeader()
+        for antiAliasing in [False, True]:
+            data = f.readChannelData(800, 10, False, False, downSamplingRatio=0.3, antiAliasing=antiAliasing)
+            assert data.shape == (3, 0)
+            data = f.readChannelData(100, 300, False, False, downSamplingRatio=0.3, antiAliasing=antiAliasing)
+            assert data.shape == (3, 90)
+
+
+def test_mapchannels(tmp_path):
+    for dataFormat in [constant.FORMAT_DOUBLE, constant.FORMAT_FLOAT, constant.FORMAT_SHORT]:
+        filename = str(tmp_path / "mapped{0}.adibin".format(dataFormat))
+        writeTestFile(filename, dataFormat)
+        with BinFile(filename, "r") as f:
+            f.readHeader()
+            scaled = f.readChannelData(0, 0, False, False)
+            raw = f.readChannelData(0, 0, False, False, noDataScaling=True)
+        with BinFile(filename, "mmap") as f:
+            f.readHeader()
+            mapped = f.mapChannels()
+            assert len(mapped) == 3
+            for k, c in enumerate(mapped):
+                assert len(c) == 500
+                # scaled like readChannelData, gap values included, and the raw view in the storage type
+                assert np.array_equal(c[:], scaled[k])
+                assert np.array_equal(c[10:50], scaled[k][10:50])
+                assert c[17] == scaled[k][17]
+                assert c.raw.dtype == raw.dtype
+                assert np.array_equal(c.raw, raw[k])
+            # reads of a mapped file are clipped like reads of the file
+            for offset, length in [(0, 0), (10, 100), (450, 100), (600, 10)]:
+                for noDataScaling in [False, True]:
+                    expected = readReference(filename, offset, length, noDataScaling)
+                    data = f.readChannelData(offset, length, False, False, noDataScaling=noDataScaling)
+                    for k in range(3):
+                        assert np.array_equal(data[k], np.array(expected[k]))
+            segment = f.mapSegment(["CH2"])
+            assert segment.channelNames == ["CH2"]
+            assert np.array_equal(segment.getChannel("CH2")[:], scaled[2])
+
+
+def test_mapchannels_clipped(tmp_path):
+    # the mapped samples end at SamplesPerChannel, or at the last complete frame of a truncated file
+    filename = str(tmp_path / "clipped.adibin")
+    frames = writeTestFile(filename, constant.FORMAT_SHORT)
+    with BinFile(filename, "r+") as f:
+        f.readHeader()
+        f.updateSamplesPerChannel(400, True)
+    with BinFile(filename, "mmap") as f:
+        f.readHeader()
+        assert np.array_equal(f.mapChannels()[1].raw, frames[:400, 1])
+    with BinFile(filename, "r+") as f:
+        f.readHeader()
+        f.updateSamplesPerChannel(500, True)
+    with open(filename, "r+b") as f:
+        f.truncate(os.path.getsize(filename) - 3 * 2 * 10 - 2)
+    with BinFile(filename, "mmap") as f:
+        f.readHeader()
+        mapped = f.mapChannels()
+        assert len(mapped[0]) == 489
+        assert np.array_equal(mapped[0].raw, frames[:489, 0])
+
+
+def test_iterchanneldata(tmp_path):
+    filename = str(tmp_path / "chunks.adibin")
+    writeTestFile(filename, constant.FORMAT_SHORT)
+    with BinFile(filename, "r") as f:
+        f.readHeader()
+        startTime = f.getStartTime()
+        for noDataScaling in [False, True]:
+            whole = f.readChannelData(0, 0, False, False, noDataScaling=noDataScaling)
+            # 0.3 seconds are 75 samples, which do not divide the 500 samples of the file
+            chunks = list(f.iterChannelData(0.3, noDataScaling=noDataScaling))
+            assert [c[0] for c in chunks] == list(range(0, 500, 75))
+            assert [c[2].shape[1] for c in chunks] == [75] * 6 + [50]
+            assert [c[1] for c in chunks] == [startTime + np.timedelta64(300000 * k, "us") for k in range(7)]
+            assert np.array_equal(np.concatenate([c[2] for c in chunks], axis=1), whole)
+        # a range in seconds or in samples, and selected channels
+        chunks = list(f.iterChannelData(0.1, 0.5, 1.1, channels=["CH1"]))
+        assert [c[0] for c in chunks] == list(range(125, 275, 25))
+        data = np.concatenate([c[2] for c in chunks], axis=1)
+        assert np.array_equal(data, f.readChannelData(125, 150, False, False, channels=["CH1"]))
+        chunks = list(f.iterChannelData(0.4, 480, 1000, False))
+        assert [(c[0], c[2].shape[1]) for c in chunks] == [(480, 20)]
+        assert chunks[0][1] == startTime + np.timedelta64(1920000, "us")
+
+
+def test_resample():
+    data = np.random.default_rng(0).standard_normal((2, 101))
+    x = np.arange(101)
+    # non-integer ratios and upsampling interpolate linearly
+    for ratio in [0.3, 0.7, 2.0]:
+        newX = np.arange(0, 101, 1.0 / ratio)
+        out = resample(data, ratio)
+        for k in range(2):
+            assert np.allclose(out[k], np.interp(newX, x, data[k]))
+    # integer ratios take every step-th sample
+    assert np.array_equal(resample(data, 0.25), data[:, ::4])
+    assert np.array_equal(resample(data[0], 0.5), data[0, ::2])
+
+
+def test_resample_gaps():
+    gap = constant.MIN_DOUBLE_VALUE
+    data = np.array([0.0, 1.0, gap, 3.0, 4.0, 5.0, 6.0, 7.0])
+    out = resample(data, 1 / 1.5, gapValue=gap)
+    # new samples at 0, 1.5, 3, 4.5, 6 and 7.5, the one between a valid sample and the gap is a gap and is not interpolated
+    assert out.tolist() == [0.0, gap, 3.0, 4.5, 6.0, 7.0]
+    assert resample(data, 0.5, gapValue=gap).tolist() == [0.0, gap, 4.0, 6.0]
+
+
+def test_resample_raw(tmp_path):
+    # raw samples keep their storage type, interpolated short samples are rounded
+    out = resample(np.array([[0, 1, 2, -32768, 4, 5, 6, 7]], dtype=np.int16), 0.4, gapValue=-32767)
+    assert out.dtype == np.int16
+    assert out.tolist() == [[0, -32767, 5, 7]]
+    assert resample(np.array([0, 1, 2, 3], dtype=np.int16), 0.4).tolist() == [0, 2]
+    filename = str(tmp_path / "raw.adibin")
+    frames = writeTestFile(filename, constant.FORMAT_SHORT)
+    with BinFile(filename, "r") as f:
+        f.readHeader()
+        data = f.readChannelData(0, 0, False, False, downSamplingRatio=0.5, noDataScaling=True)
+    # gap samples are set to the gap value
+    expected = frames[::2].T.copy()
+    expected[expected <= constant.MIN_SHORT_VALUE] = constant.MIN_SHORT_VALUE
+    assert data.dtype == np.int16
+    assert np.array_equal(data, expected)
+
+
+def test_resample_antialiasing():
+    # a sine above the Nyquist frequency of the new rate is removed by the anti-aliasing filter and aliased without it
+    x = np.arange(4000)
+    high = np.sin(2 * np.pi * 0.4 * x)
+    low = np.sin(2 * np.pi * 0.01 * x)
+    aliased = resample(high, 0.25)
+    filtered = resample(high, 0.25, antiAliasing=True)
+    kept = resample(low, 0.25, antiAliasing=True)
+    assert np.abs(aliased[50:-50]).max() > 0.5
+    assert np.abs(filtered[50:-50]).max() < 0.05
+    assert np.abs(kept[50:-50] - low[::4][50:-50]).max() < 0.05
+
+
+def test_readchanneldata_channels(tmp_path):
+    filename = str(tmp_path / "channels.adibin")
+    writeTestFile(filename, constant.FORMAT_SHORT)
+    with BinFile(filename, "r+") as f:
+        f.readHeader()
+        f.channels[1].Title = ""
+        f.writeHeader()
+    with BinFile(filename, "r") as f:
+        f.readHeader()
+        # a channel without title is called after its position
+        assert f.getChannelNames() == ["CH0", "Unnamed_Channel_2", "CH2"]
+        whole = f.readChannelData(0, 0, False, False)
+        assert np.array_equal(f.readChannelData(0, 0, False, False, channels=["CH2", "CH0"]), whole[[2, 0]])
+        assert np.array_equal(f.readChannelData(0, 0, False, False, channels=[1]), whole[[1]])
+        assert np.array_equal(f.readChannelData(0, 0, False, False, channels=["Unnamed_Channel_2", 2]), whole[[1, 2]])
+        raw = f.readChannelData(10, 20, False, False, noDataScaling=True, channels=["CH2"])
+        assert np.array_equal(raw, f.readChannelData(10, 20, False, False, noDataScaling=True)[[2]])
+        for channels in [["ART"], [3], [-1]]:
+            try:
+                f.readChannelData(0, 0, False, False, channels=channels)
+                assert False
+            except BinFileError:
+                pass
+
+
+def test_segment_time_axis():
+    # 240 Hz, the timestamps are rounded to nanoseconds
+    startTime = np.datetime64("2013-05-12T19:00:00.5", "ns")
+    s = WaveformSegment(startTime, 1 / 240.0, ["II", "ART"], ["mV", "mmHg"], np.array([np.arange(480.0), np.arange(480.0) + 1000]))
+    timestamps = s.getTimestamps()
+    assert len(timestamps) == 480 and timestamps.dtype == np.dtype("datetime64[ns]")
+    assert timestamps[0] == startTime and timestamps[240] == startTime + np.timedelta64(1, "s")
+    assert timestamps[1] == startTime + np.timedelta64(4166667, "ns")
+    assert np.array_equal(s.getTimestamps(100, 103), timestamps[100:103])
+    assert s.getEndTime() == startTime + np.timedelta64(2, "s")
+    # the index of a sample timestamp is the sample itself, also a nanosecond off from rounding,
+    # a time between two samples goes to the next sample
+    assert [s.getSampleIndex(t) for t in timestamps] == list(range(480))
+    assert s.getSampleIndex(timestamps[10] + np.timedelta64(1, "ns")) == 10
+    assert s.getSampleIndex(timestamps[10] - np.timedelta64(1, "ns")) == 10
+    assert s.getSampleIndex(timestamps[10] + np.timedelta64(1, "us")) == 11
+    assert s.getSampleIndex(startTime - np.timedelta64(1, "s")) == 0
+    assert s.getSampleIndex(startTime + np.timedelta64(10, "s")) == 480
+    # between() keeps t0 <= t < t1, with the start time of its first sample
+    b = s.between(timestamps[24], timestamps[48])
+    assert b.getNumSamples() == 24 and b.startTime == timestamps[24]
+    assert b.getChannel("ART").tolist() == list(range(1024, 1048))
+    assert np.array_equal(b.getTimestamps(), timestamps[24:48])
+    b = s.between(startTime + np.timedelta64(100, "ms"), startTime + np.timedelta64(200, "ms"))
+    assert b.getChannel(0).tolist() == list(range(24, 48))
+    assert s.between(timestamps[5], timestamps[5]).getNumSamples() == 0
+    assert s.between(startTime - np.timedelta64(1, "s"), startTime + np.timedelta64(10, "s")).getNumSamples() == 480
+    assert s.between(startTime + np.timedelta64(3, "s"), startTime + np.timedelta64(4, "s")).getNumSamples() == 0
+
+
+def test_segment_physical(tmp_path):
+    gap = constant.MIN_DOUBLE_VALUE
+    raw = np.array([[1, -32768, 3], [10, 20, -32767]], dtype=np.int16)
+    s = WaveformSegment("2013-05-12T19:00:00", 0.5, ["II", "ART"], ["mV", "mmHg"], raw, [0.01, 0.1], [0.0, 5.0], [-32768, -32767])
+    assert s.isRaw()
+    assert s.getChannel("II").dtype == np.int16
+    assert np.allclose(s.getPhysicalChannel("II"), [0.01, gap, 0.03])
+    assert np.allclose(s.getPhysicalChannel(1), [1.5, 2.5, gap])
+    try:
+        s.getChannel("SpO2")
+        assert False
+    except KeyError:
+        pass
+    physical = s.toPhysical()
+    assert not physical.isRaw() and physical.getChannel(1).dtype == np.float64
+    assert np.allclose(physical.getChannel("ART"), [1.5, 2.5, gap])
+    # the DataFrame has the time column first and the channels in physical units
+    df = s.toDataFrame()
+    assert list(df.columns) == ["time", "II", "ART"]
+    assert df["time"].tolist() == list(s.getTimestamps())
+    assert np.allclose(df["ART"], [1.5, 2.5, gap])
+    assert list(s.toDataFrame(withTime=False).columns) == ["II", "ART"]
+    # a segment without scales is already in physical units, also its gap values
+    s = WaveformSegment("2013-05-12T19:00:00", 0.5, ["II"], ["mV"], [np.array([1.5, constant.MIN_FLOAT_VALUE], dtype=np.float32)])
+    assert not s.isRaw()
+    assert s.getPhysicalChannel("II").dtype == np.float64
+    assert s.getPhysicalChannel("II")[1] == np.float32(constant.MIN_FLOAT_VALUE)
+    assert s.toPhysical() is s
+
+    # raw samples read from a file and calibrated are the scaled samples, with gaps as MIN_DOUBLE_VALUE
+    filename = str(tmp_path / "short.adibin")
+    writeTestFile(filename, constant.FORMAT_SHORT)
+    with BinFile(filename, "r") as f:
+        f.readHeader()
+        scaled = f.readChannelData(100, 200, False, False)
+        s = f.readSegment(100, 200, False, False, noDataScaling=True)
+    assert s.isRaw() and s.getChannel(0).dtype == np.int16
+    assert s.startTime == np.datetime64("2019-03-31T08:15:30.4", "ns")
+    for k in range(3):
+        physical = s.getPhysicalChannel(k)
+        assert np.allclose(physical, scaled[k])
+        assert np.array_equal(physical == gap, np.isin(s.getChannel(k), constant.GAP_SHORT_VALUES))
+    assert (s.getPhysicalChannel(0) == gap).any()
@@ -0,0 +1,150 @@
+import json
+import os
+import runpy
+import sys
+import numpy as np
+import pandas as pd
+from binfilepy import BinFile
+from binfilepy import CFWBINARY
+from binfilepy import CFWBCHANNEL
+from binfilepy import constant
+from wavepipeline import readColumnar
+
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def writeWaveCycleFile(tmp_path, name, startTime, numSamples=480, patient="DE1", secsPerTick=1 / 240.0):
+    # SHORT ADIBIN file of a wave cycle of the patient on the local server directory, with a ramp in each channel
+    folder = tmp_path / "server" / "2013-08-deid" / patient / ("9ICU_13-" + patient)
+    os.makedirs(str(folder), exist_ok=True)
+    with BinFile(str(folder / name), "w") as f:
+        f.setHeader(CFWBINARY(secsPerTick, NChannels=2, DataFormat=constant.FORMAT_SHORT))
+        f.setStartTime(np.datetime64(startTime, "us"))
+        f.addChannel(CFWBCHANNEL("II", "mV", 0.01, 0.0, 10.0, -10.0))
+        f.addChannel(CFWBCHANNEL("ART", "mmHg", 0.1, 5.0, 300.0, -300.0))
+        f.writeHeader()
+        ramp = np.arange(numSamples) % 1000
+        f.writeChannelData(np.array([ramp, ramp + 100]))
+        f.updateSamplesPerChannel(numSamples, True)
+
+
+def runExtraction(tmp_path, monkeypatch, rows, **settings):
+    # run extractContinuousWaveforms.py on the local server directory, returns the output directory
+    output = str(tmp_path / "Output") + "/"
+    os.makedirs(output, exist_ok=True)
+    lines = ["usr=x", "pwd=x", "host=x", "dir_waveform={0}/".format(tmp_path / "server"), "dir_output=" + output, "storage=local"]
+    lines += ["{0}={1}".format(key, value) for key, value in settings.items()]
+    with open(str(tmp_path / "config.txt"), "w") as f:
+        f.write("\n".join(lines) + "\n")
+    pd.DataFrame([dict(Wynton_folder="2013-08-deid", Patient_ID_GE="DE1", WaveCycleUID=1000, ValidStartTime=pd.Timestamp(start),
+                       ValidStopTime=pd.Timestamp(stop)) for start, stop in rows]).to_excel(output + "ValidWaveTime_allEnc.xlsx", index=False)
+    monkeypatch.chdir(str(tmp_path))
+    monkeypatch.setattr(sys, "argv", ["extractContinuousWaveforms.py"])
+    runpy.run_path(os.path.join(SCRIPT_DIR, "extractContinuousWaveforms.py"), run_name="__main__")
+    return output
+
+
+def test_extract_window_boundaries(tmp_path, monkeypatch):
+    # files ending at ValidStartTime or starting at ValidStopTime have no valid waveform, only the file in between is extracted
+    writeWaveCycleFile(tmp_path, "DE1_0_1000.adibin", "2013-05-12T18:59:59")
+    writeWaveCycleFile(tmp_path, "DE1_1_1000.adibin", "2013-05-12T19:00:00")
+    writeWaveCycleFile(tmp_path, "DE1_2_1000.adibin", "2013-05-12T19:00:02")
+    output = runExtraction(tmp_path, monkeypatch, [("2013-05-12 19:00:01", "2013-05-12 19:00:02")], stitch_wavecycles=0)
+    meta_data_adibin = pd.read_excel(output + "2013-08-deid_DE1_1000/meta_data_adibin.xlsx")
+    assert list(meta_data_adibin["exist_valid_waveform"]) == [0, 1, 0]
+    assert list(meta_data_adibin["Binfile_duration_seconds"]) == [0, 1, 0]
+    assert list(meta_data_adibin["OutputFile_dir"].isna()) == [True, False, True]
+    segment = readColumnar(meta_data_adibin["OutputFile_dir"][1])
+    assert segment.startTime == np.datetime64("2013-05-12T19:00:01", "us")
+    assert [len(d) for d in segment.data] == [240, 240]
+    assert np.allclose(segment.data[0], np.arange(240, 480) * 0.01)
+    meta_data_Enc = pd.read_excel(output + "meta_data_Enc.xlsx")
+    assert list(meta_data_Enc["total_dur_seconds"]) == [1]
+
+
+def test_extract_file_per_window(tmp_path, monkeypatch):
+    # two rows of one wave cycle cut the first file differently, each cut has its own output folder, also when resuming
+    writeWaveCycleFile(tmp_path, "DE1_0_1000.adibin", "2013-05-12T19:00:00")
+    writeWaveCycleFile(tmp_path, "DE1_1_1000.adibin", "2013-05-12T19:00:02")
+    rows = [("2013-05-12 19:00:00.5", "2013-05-12 19:00:01.5"), ("2013-05-12 19:00:01", "2013-05-12 19:00:03")]
+    expected = {"0_20130512T190000.500_20130512T190001.500": (0, 120, 360), "0_20130512T190001_20130512T190003": (0, 240, 480),
+                "1_20130512T190001_20130512T190003": (2, 0, 240)}
+    for run in range(2):
+        output = runExtraction(tmp_path, monkeypatch, rows, stitch_wavecycles=0)
+        folder = output + "2013-08-deid_DE1_1000/"
+        assert sorted(name for name in os.listdir(folder) if os.path.isdir(folder + name)) == sorted(expected)
+        if run == 0:
+            mtimes = {name: os.path.getmtime(folder + name + "/waveform.json") for name in expected}
+        for name, (seconds, start, stop) in expected.items():
+            segment = readColumnar(folder + name)
+            assert segment.startTime == np.datetime64("2013-05-12T19:00:00", "ns") + np.timedelta64(int((seconds + start / 240.0) * 1e9), "ns")
+            assert np.allclose(segment.data[0], np.arange(start, stop) * 0.01)
+            # the second run finds all cuts in the checkpoint manifest
+            assert os.path.getmtime(folder + name + "/waveform.json") == mtimes[name]
+        # the meta data is of the last row
+        meta_data_adibin = pd.read_excel(folder + "meta_data_adibin.xlsx")
+        assert list(meta_data_adibin["OutputFile_dir"]) == [folder + "0_20130512T190001_20130512T190003", folder + "1_20130512T190001_20130512T190003"]
+
+
+def runMapping(tmp_path, monkeypatch, encounters):
+    # run mapValidWaveTime.py for the encounters on the local server directory, returns ValidWaveTime_allEnc.xlsx as read back
+    folder = tmp_path / "server" / "2013-03-deid" / "DE101"
+    os.makedirs(str(folder), exist_ok=True)
+    mapping = [("9ICU_1", "05/01/2013 10:00", "05/01/2013 14:00", 1234, "05/01/2013 09:30", "02/17/1969 00:00"),
+               ("9ICU_2", "05/01/2013 15:00", "05/01/2013 19:00", 1234, "05/01/2013 15:10", "02/17/1969 00:00"),
+               ("9ICU_3", "05/02/2013 08:00", "05/02/2013 12:00", 5678, "05/02/2013 08:30", "05/02/2013 11:00")]
+    pd.DataFrame([dict(Wynton_folder="2013-03-deid", MRN_ADT="DE101", UnitBed=u, BedTransfer_In=i, BedTransfer_Out=o, WaveCycleUID=uid,
+                       WaveStartTime=start, WaveStopTime=stop) for u, i, o, uid, start, stop in mapping]).to_csv(str(folder / "MRN-Mapping.csv"), index=False)
+    output = str(tmp_path / "Output") + "/"
+    with open(str(tmp_path / "config.txt"), "w") as f:
+        f.write("usr=x\npwd=x\nhost=x\ndir_waveform={0}/\ndir_output={1}\nstorage=local\n".format(tmp_path / "server", output))
+    pd.DataFrame(dict(Encounter_ID=encounters)).to_excel(str(tmp_path / "sampleEncounterList.xlsx"), index=False)
+    pd.DataFrame([dict(Encounter_ID=11, Wynton_folder="2013-03-deid", Patient_ID_GE=101), dict(Encounter_ID=12, Wynton_folder="x", Patient_ID_GE=1)]).to_excel(
+        str(tmp_path / "encounter_date_offset_table_ver_Apr2024.xlsx"), index=False)
+    monkeypatch.chdir(str(tmp_path))
+    monkeypatch.setattr(sys, "argv", ["mapValidWaveTime.py"])
+    runpy.run_path(os.path.join(SCRIPT_DIR, "mapValidWaveTime.py"), run_name="__main__")
+    return pd.read_excel(output + "ValidWaveTime_allEnc.xlsx")
+
+
+def test_map_valid_wave_time(tmp_path, monkeypatch):
+    mapped = runMapping(tmp_path, monkeypatch, [11, 13])
+    assert list(mapped["WaveCycleUID"]) == [1234, 5678]
+    assert list(mapped["Patient_ID_GE"]) == ["DE101", "DE101"]
+    # a missing wave stop time, in 1969, is the bed transfer out time
+    assert list(mapped["ValidStartTime"]) == [pd.Timestamp("2013-05-01 10:00"), pd.Timestamp("2013-05-02 08:30")]
+    assert list(mapped["ValidStopTime"]) == [pd.Timestamp("2013-05-01 19:00"), pd.Timestamp("2013-05-02 11:00")]
+    # encounters without a mapped patient folder give an empty list with the same columns
+    empty = runMapping(tmp_path, monkeypatch, [13, 99])
+    assert len(empty) == 0
+    assert list(empty.columns) == list(mapped.columns)
+
+
+def test_extract_raw_samples(tmp_path, monkeypatch):
+    # the same files extracted with raw_samples=1 and 0, into a continuous store with a gap between the files
+    segments = {}
+    for raw_samples in [1, 0]:
+        base = tmp_path / str(raw_samples)
+        writeWaveCycleFile(base, "DE1_0_1000.adibin", "2013-05-12T19:00:00")
+        writeWaveCycleFile(base, "DE1_1_1000.adibin", "2013-05-12T19:00:03")
+        output = runExtraction(base, monkeypatch, [("2013-05-12 19:00:00.5", "2013-05-12 19:00:04.5")], raw_samples=raw_samples)
+        path = output + "2013-08-deid_DE1_1000/continuous"
+        with open(os.path.join(path, "waveform.json"), "r") as f:
+            sidecar = json.load(f)
+        segments[raw_samples] = (sidecar, readColumnar(path))
+    sidecar, raw = segments[1]
+    # integer samples with the calibration of each channel in the sidecar
+    assert [(c["dtype"], c["scale"], c["offset"]) for c in sidecar["channels"]] == [("<i2", 0.01, 0.0), ("<i2", 0.1, 5.0)]
+    assert sidecar["gapValue"] == constant.MIN_SHORT_VALUE
+    assert [raw.getChannel(k).dtype for k in range(2)] == [np.int16, np.int16]
+    assert raw.getChannel("II")[:3].tolist() == [120, 121, 122]
+    sidecar, scaled = segments[0]
+    assert all("scale" not in c and c["dtype"] == "<f8" for c in sidecar["channels"])
+    # the calibrated raw samples are the scaled output, gaps included
+    assert (raw.startTime, raw.getNumSamples(), raw.channelNames) == (scaled.startTime, scaled.getNumSamples(), scaled.channelNames)
+    assert raw.getNumSamples() == 960
+    for k in range(2):
+        physical = raw.getPhysicalChannel(k)
+        assert np.array_equal(physical == constant.MIN_DOUBLE_VALUE, scaled.getChannel(k) == constant.MIN_DOUBLE_VALUE)
+        assert np.allclose(physical, scaled.getChannel(k))
+    assert (physical == constant.MIN_DOUBLE_VALUE).sum() == 240
@@ -0,0 +1,651 @@
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from binfilepy import BinFile
+from binfilepy import CFWBINARY
+from binfilepy import CFWBCHANNEL
+from binfilepy import constant
+from binfilepy import WaveformSegment
+from wavepipeline import AdibinCatalog
+from wavepipeline import DirectoryListingCache
+from wavepipeline import RemoteFileCache
+from wavepipeline import SFTPStorage
+from wavepipeline import ColumnarAppender
+from wavepipeline import ChunkedAppender
+from wavepipeline import readChunked
+from wavepipeline import chunked
+from wavepipeline import CheckpointManifest
+from wavepipeline import checkpointKey
+from wavepipeline import PrefetchPool
+from wavepipeline import fetchSampleRange
+from wavepipeline import readColumnar
+from wavepipeline import writeColumnar
+from wavepipeline import MemoryStorage
+from wavepipeline import ValidWindowIndex
+from wavepipeline import StageMetrics
+
+
+def adibinBytes(tmp_path, startTime, numSamples=240, channelNames=("II", "ART"), secsPerTick=1 / 240.0):
+    # bytes of a SHORT ADIBIN file with a ramp in each channel
+    filename = str(tmp_path / "tmp.adibin")
+    if os.path.exists(filename):
+        os.remove(filename)
+    with BinFile(filename, "w") as f:
+        f.setHeader(CFWBINARY(secsPerTick, NChannels=len(channelNames), DataFormat=constant.FORMAT_SHORT))
+        f.setStartTime(np.datetime64(startTime, "us"))
+        for name in channelNames:
+            f.addChannel(CFWBCHANNEL(name, "mV", 0.01, 0.0, 10.0, -10.0))
+        f.writeHeader()
+        ramp = np.arange(numSamples) % 1000
+        numSamples = f.writeChannelData(np.array([ramp + 100 * k for k in range(len(channelNames))]))
+        f.updateSamplesPerChannel(numSamples, True)
+    with open(filename, "rb") as f:
+        return f.read()
+
+
+def test_catalog_refresh(tmp_path):
+    storage = MemoryStorage()
+    storage.put("/w/DE1/a_1.adibin", adibinBytes(tmp_path, "2013-05-12T19:00:00", 480), mtime=100)
+    storage.put("/w/DE1/b_1.adibin", adibinBytes(tmp_path, "2013-05-12T19:00:02"), mtime=100)
+    files = [(p, storage.stat(p).st_size, storage.stat(p).st_mtime) for p in ["/w/DE1/a_1.adibin", "/w/DE1/b_1.adibin"]]
+    with AdibinCatalog(str(tmp_path / "catalog.sqlite")) as catalog:
+        entries = catalog.refresh(storage, files)
+        assert [e.path for e in entries] == ["/w/DE1/a_1.adibin", "/w/DE1/b_1.adibin"]
+        assert entries[0].startTime == np.datetime64("2013-05-12T19:00:00", "us")
+        assert entries[0].endTime == np.datetime64("2013-05-12T19:00:02", "us")
+        assert entries[1].getChannelNames() == ["II", "ART"]
+        assert ([e.path for e in catalog.findOverlapping(np.datetime64("2013-05-12T19:00:02.5"), np.datetime64("2013-05-12T19:00:05"))] ==
+                ["/w/DE1/b_1.adibin"])
+        # a changed file is read again, the others come from the catalog
+        storage.put("/w/DE1/b_1.adibin", adibinBytes(tmp_path, "2013-05-12T19:00:03"), mtime=200)
+        storage.remove("/w/DE1/a_1.adibin")
+        entries = catalog.refresh(storage, [files[0], ("/w/DE1/b_1.adibin", files[1][1], 200)])
+        assert entries[0].startTime == np.datetime64("2013-05-12T19:00:00", "us")
+        assert entries[1].startTime == np.datetime64("2013-05-12T19:00:03", "us")
+
+
+class HeaderCountingStorage(MemoryStorage):
+    # counts the header reads of each file
+    reads = {}
+
+    def readRange(self, path: str, offset: int, length: int):
+        if offset == 0:
+            self.reads[path] = self.reads.get(path, 0) + 1
+        return MemoryStorage.readRange(self, path, offset, length)
+
+
+def test_catalog_refresh_changed(tmp_path):
+    storage = HeaderCountingStorage()
+    storage.reads = {}
+    paths = ["/w/DE1/{0}_1.adibin".format(k) for k in range(3)]
+    for k, path in enumerate(paths):
+        storage.put(path, adibinBytes(tmp_path, "2013-05-12T19:00:0{0}".format(k)), mtime=100)
+
+    def files():
+        return [(p, storage.stat(p).st_size, storage.stat(p).st_mtime) for p in paths]
+
+    filename = str(tmp_path / "catalog.sqlite")
+    with AdibinCatalog(filename) as catalog:
+        catalog.refresh(storage, files())
+    assert storage.reads == {p: 1 for p in paths}
+    # a file with another size and the same mtime, and a file with another mtime and the same size, are read again
+    storage.put(paths[0], adibinBytes(tmp_path, "2013-05-12T19:00:05", numSamples=480), mtime=100)
+    storage.put(paths[1], adibinBytes(tmp_path, "2013-05-12T19:00:06"), mtime=300)
+    with AdibinCatalog(filename) as catalog:
+        entries = catalog.refresh(storage, files())
+        assert storage.reads == {paths[0]: 2, paths[1]: 2, paths[2]: 1}
+        assert ([e.startTime for e in entries] == [np.datetime64("2013-05-12T19:00:05", "us"), np.datetime64("2013-05-12T19:00:06", "us"),
+                                                   np.datetime64("2013-05-12T19:00:02", "us")])
+        assert entries[0].SamplesPerChannel == 480
+        assert (entries[1].size, entries[1].mtime) == (storage.stat(paths[1]).st_size, 300)
+        # the updated entries are stored
+        assert catalog.getEntry(paths[0]).endTime == np.datetime64("2013-05-12T19:00:07", "us")
+        catalog.refresh(storage, files())
+    assert storage.reads == {paths[0]: 2, paths[1]: 2, paths[2]: 1}
+
+
+class LockCheckingStorage(MemoryStorage):
+    # fails a header read while another connection cannot write the catalog
+    filename = ""
+
+    def readRange(self, path: str, offset: int, length: int):
+        db = sqlite3.connect(self.filename, timeout=0)
+        db.execute("CREATE TABLE IF NOT EXISTS other (x INTEGER)")
+        db.execute("INSERT INTO other VALUES (1)")
+        db.commit()
+        db.close()
+        return MemoryStorage.readRange(self, path, offset, length)
+
+
+def test_catalog_refresh_does_not_lock(tmp_path):
+    storage = LockCheckingStorage()
+    storage.filename = str(tmp_path / "catalog.sqlite")
+    for k in range(3):
+        storage.put("/w/DE1/{0}_1.adibin".format(k), adibinBytes(tmp_path, "2013-05-12T19:00:0{0}".format(k)))
+    files = [(a.filename, a.st_size, a.st_mtime) for a in storage.listDir("/w/DE1")]
+    with AdibinCatalog(storage.filename) as catalog:
+        entries = catalog.refresh(storage, [("/w/DE1/" + name, size, mtime) for name, size, mtime in files])
+    assert len(entries) == 3
+
+
+T0 = np.datetime64("2013-05-12T19:00:00", "ns")
+
+
+def segment(seconds, values, channelNames=("II", "ART"), secsPerTick=0.5):
+    # segment starting seconds after T0, values[k] are the samples of channel k
+    return WaveformSegment(T0 + np.timedelta64(int(seconds * 1e9), "ns"), secsPerTick, list(channelNames), ["mV"] * len(channelNames),
+                           np.array(values, dtype=np.float64))
+
+
+def test_write_columnar(tmp_path):
+    startTime = np.datetime64("2013-05-12T19:00:00.123456789", "ns")
+    raw = np.array([[1, 2, -32768, 4, 5, 6], [10, 20, 30, -32767, 50, 60]], dtype=np.int16)
+    path = writeColumnar(str(tmp_path / "0"), WaveformSegment(startTime, 0.5, ["II", "ART"], ["mV", "mmHg"], raw, [0.01, 0.1], [0.0, 5.0],
+                                                              [-32768, -32767]))
+    with open(os.path.join(path, "waveform.json"), "r") as f:
+        sidecar = json.load(f)
+    assert sidecar["startTime"] == "2013-05-12T19:00:00.123456789"
+    assert (sidecar["secsPerTick"], sidecar["numSamples"], sidecar["gapValues"]) == (0.5, 6, [-32768, -32767])
+    assert [(c["name"], c["units"], c["scale"], c["offset"]) for c in sidecar["channels"]] == [("II", "mV", 0.01, 0.0), ("ART", "mmHg", 0.1, 5.0)]
+    for mmap in [True, False]:
+        s = readColumnar(path, mmap)
+        assert s.startTime == startTime
+        assert (s.secsPerTick, s.channelNames, s.units) == (0.5, ["II", "ART"], ["mV", "mmHg"])
+        assert (s.scales, s.offsets, s.gapValues) == ([0.01, 0.1], [0.0, 5.0], [-32768, -32767])
+        # raw samples keep their storage type, gaps are only recognized when they are calibrated
+        assert [s.getChannel(k).dtype for k in range(2)] == [np.int16, np.int16]
+        assert np.array_equal(np.array(s.data), raw)
+        assert np.allclose(s.getPhysicalChannel("ART"), [1.5, 2.5, 3.5, constant.MIN_DOUBLE_VALUE, 5.5, 6.5])
+        # a time range is a view of the samples t0 <= t < t1, starting at the time of its first sample
+        r = readColumnar(path, mmap).between(startTime + np.timedelta64(1, "s"), startTime + np.timedelta64(2500, "ms"))
+        assert r.startTime == startTime + np.timedelta64(1, "s")
+        assert r.getChannel("II").tolist() == [-32768, 4, 5]
+        assert r.getPhysicalChannel("II")[0] == constant.MIN_DOUBLE_VALUE
+    # samples in physical units have no calibration in the sidecar
+    path = writeColumnar(str(tmp_path / "1"), segment(2, [[1.5, 2.5], [10.0, constant.MIN_DOUBLE_VALUE]]))
+    with open(os.path.join(path, "waveform.json"), "r") as f:
+        sidecar = json.load(f)
+    assert "gapValues" not in sidecar and all("scale" not in c for c in sidecar["channels"])
+    s = readColumnar(path)
+    assert (s.startTime, s.scales, s.gapValues) == (T0 + np.timedelta64(2, "s"), None, None)
+    assert s.getChannel("ART").dtype == np.float64
+    assert s.getPhysicalChannel("ART").tolist() == [10.0, constant.MIN_DOUBLE_VALUE]
+
+
+def test_columnar_appender(tmp_path):
+    gap = constant.MIN_DOUBLE_VALUE
+    path = str(tmp_path / "continuous")
+    with ColumnarAppender(path) as store:
+        assert store.append(segment(0, [[1, 2, 3], [10, 20, 30]])) == 3
+        # a gap of 2 samples is filled with gap values
+        assert store.append(segment(2.5, [[4, 5], [40, 50]])) == 4
+        # the first sample overlaps the stored ones and is dropped
+        assert store.append(segment(3, [[6, 7], [60, 70]])) == 1
+        # a new channel starts with gaps, and a channel missing from a segment is filled with gaps
+        assert store.append(segment(4, [[8], [0.5]], ("II", "SpO2"))) == 1
+    s = readColumnar(path)
+    assert s.startTime == T0
+    assert s.secsPerTick == 0.5
+    assert s.channelNames == ["II", "ART", "SpO2"]
+    assert s.getChannel("II").tolist() == [1, 2, 3, gap, gap, 4, 5, 7, 8]
+    assert s.getChannel("ART").tolist() == [10, 20, 30, gap, gap, 40, 50, 70, gap]
+    assert s.getChannel("SpO2").tolist() == [gap] * 8 + [0.5]
+
+
+def test_columnar_appender_resample(tmp_path):
+    gap = constant.MIN_DOUBLE_VALUE
+    path = str(tmp_path / "continuous")
+    with ColumnarAppender(path) as store:
+        store.append(segment(0, [[1, 2], [10, 20]]))
+        # samples at twice the rate are resampled to the secsPerTick of the store, gaps are not interpolated
+        store.append(segment(1, [[3, 3.5, 4, 4.5, gap, 5.5], [30, 35, 40, 45, 50, 55]], secsPerTick=0.25))
+    s = readColumnar(path)
+    assert s.getChannel("II").tolist() == [1, 2, 3, 4, gap]
+    assert s.getChannel("ART").tolist() == [10, 20, 30, 40, 50]
+
+
+def test_columnar_appender_reopen(tmp_path):
+    path = str(tmp_path / "continuous")
+    with ColumnarAppender(path) as store:
+        store.append(segment(0, [[1, 2, 3], [10, 20, 30]]))
+    # samples written after the last sidecar of an interrupted append are dropped when the store is continued
+    with open(os.path.join(path, "0.f8"), "ab") as f:
+        f.write(np.array([99.0]).tobytes())
+    with ColumnarAppender(path) as store:
+        assert store.numSamples == 3
+        store.append(segment(1.5, [[4], [40]]))
+    s = readColumnar(path, mmap=False)
+    assert s.getChannel("II").tolist() == [1, 2, 3, 4]
+    assert s.getChannel("ART").tolist() == [10, 20, 30, 40]
+
+
+def test_columnar_appender_raw(tmp_path):
+    path = str(tmp_path / "continuous")
+    raw = WaveformSegment(T0, 0.5, ["II"], ["mV"], np.array([[1, -32768, 3]], dtype=np.int16), [0.01], [0.0], constant.GAP_SHORT_VALUES)
+    with ColumnarAppender(path, raw=True) as store:
+        store.append(raw)
+        # physical samples are requantized to the calibration of the store
+        store.append(segment(1.5, [[0.04, 0.05]], ("II",)))
+    s = readColumnar(path)
+    assert s.getChannel("II").dtype == np.int16
+    assert s.getChannel("II").tolist() == [1, -32768, 3, 4, 5]
+    assert np.allclose(s.getPhysicalChannel("II"), [0.01, constant.MIN_DOUBLE_VALUE, 0.03, 0.04, 0.05])
+
+
+def test_columnar_appender_float_gaps(tmp_path):
+    # float samples mark gaps with MIN_FLOAT_VALUE, they are stored as the gap value of the store and are never interpolated
+    floatGap = np.float32(constant.MIN_FLOAT_VALUE)
+    filenames = []
+    for k, (seconds, secsPerTick, values) in enumerate([(0, 0.25, [1, 2, floatGap, floatGap, 5, 6, 7, 8]), (2, 0.5, [9, floatGap, 11])]):
+        filename = str(tmp_path / "{0}.adibin".format(k))
+        with BinFile(filename, "w") as f:
+            f.setHeader(CFWBINARY(secsPerTick, NChannels=1, DataFormat=constant.FORMAT_FLOAT))
+            f.setStartTime(np.datetime64(T0, "us") + np.timedelta64(seconds, "s"))
+            f.addChannel(CFWBCHANNEL("II", "mV", 1.0, 0.0, 10.0, -10.0))
+            f.writeHeader()
+            f.updateSamplesPerChannel(f.writeChannelData(np.array([values], dtype=np.float32)), True)
+        filenames.append(filename)
+    # scaled reads are float64 with the float gap value, raw reads keep the float32 samples
+    for raw, gap in [(False, constant.MIN_DOUBLE_VALUE), (True, floatGap)]:
+        path = str(tmp_path / "continuous_{0}".format(int(raw)))
+        with ColumnarAppender(path, secsPerTick=0.5, raw=raw) as store:
+            for filename in filenames:
+                with BinFile(filename, "r") as f:
+                    f.readHeader()
+                    store.append(f.readSegment(0, 0, False, False, noDataScaling=raw))
+        s = readColumnar(path)
+        assert s.getChannel("II").dtype == (np.float32 if raw else np.float64)
+        assert s.getChannel("II").tolist() == [1, gap, 5, 7, 9, gap, 11]
+
+
+def test_valid_window_index():
+    # windows on whole seconds, so that many of them touch each other and the queries, compared with a scan of all windows
+    rng = np.random.default_rng(0)
+    starts = T0 + rng.integers(0, 100, 300).astype("timedelta64[s]")
+    stops = starts + rng.integers(0, 20, 300).astype("timedelta64[s]")
+    starts[::13] = np.datetime64("NaT")
+    stops[::17] = np.datetime64("NaT")
+    keys = [("DE1", 1000 + k % 3) for k in range(300)]
+    index = ValidWindowIndex(starts, stops, keys)
+    allIndex = ValidWindowIndex(list(starts), list(stops))
+    valid = ~(np.isnat(starts) | np.isnat(stops))
+    for t0, t1 in [(T0 + np.timedelta64(a, "s"), T0 + np.timedelta64(a + d, "s")) for a, d in zip(rng.integers(-10, 120, 200), rng.integers(0, 15, 200))]:
+        # windows are closed, a window stopping at t0 or starting at t1 overlaps
+        overlapping = valid & (starts <= t1) & (stops >= t0)
+        for key in [("DE1", 1000), ("DE1", 1001), ("DE1", 1002)]:
+            assert index.findOverlapping(t0, t1, key).tolist() == [r for r in np.flatnonzero(overlapping) if keys[r] == key]
+        assert allIndex.findOverlapping(t0, t1).tolist() == np.flatnonzero(overlapping).tolist()
+        assert len(index.findOverlapping(t0, t1, ("DE2", 1000))) == 0
+        assert len(index.findOverlapping(t0, t1)) == 0
+    # touching boundaries
+    index = ValidWindowIndex([T0, T0 + np.timedelta64(10, "s")], [T0 + np.timedelta64(10, "s"), T0 + np.timedelta64(20, "s")])
+    assert index.findOverlapping(T0 + np.timedelta64(10, "s"), T0 + np.timedelta64(10, "s")).tolist() == [0, 1]
+    assert index.findOverlapping(T0 - np.timedelta64(5, "s"), T0).tolist() == [0]
+    assert index.findOverlapping(T0 + np.timedelta64(20, "s"), T0 + np.timedelta64(30, "s")).tolist() == [1]
+    assert index.findOverlapping(T0 + np.timedelta64(20001, "ms"), T0 + np.timedelta64(30, "s")).tolist() == []
+    # only windows with a missing time, or none at all
+    assert len(ValidWindowIndex([np.datetime64("NaT")], [T0]).findOverlapping(T0, T0)) == 0
+    assert len(ValidWindowIndex([], []).findOverlapping(T0, T0)) == 0
+
+
+def test_checkpoint_manifest(tmp_path):
+    filename = str(tmp_path / "checkpoint.jsonl")
+    key = checkpointKey("/w/a.adibin", 100, 5, np.datetime64("2013-05-12T19:00:00"), np.datetime64("2013-05-12T20:00:00"))
+    # another valid waveform time or a changed file is another key
+    assert key != checkpointKey("/w/a.adibin", 100, 5, np.datetime64("2013-05-12T19:00:01"), np.datetime64("2013-05-12T20:00:00"))
+    assert key != checkpointKey("/w/a.adibin", 100, 6, np.datetime64("2013-05-12T19:00:00"), np.datetime64("2013-05-12T20:00:00"))
+    with CheckpointManifest(filename) as manifest:
+        assert not manifest.isDone(key)
+        manifest.markDone(key, {"OutputFile_dir": "out/continuous"})
+    # the torn last line of an interrupted run is dropped when the manifest is opened again
+    with open(filename, "ab") as f:
+        f.write(b'{"key": "/w/b.adib')
+    with CheckpointManifest(filename) as manifest:
+        assert manifest.isDone(key)
+        assert manifest.get(key)["OutputFile_dir"] == "out/continuous"
+        assert len(manifest.records) == 1
+        manifest.markDone("other", {"OutputFile_dir": "out/1"})
+    with CheckpointManifest(filename) as manifest:
+        assert sorted(manifest.records) == sorted([key, "other"])
+
+
+def test_prefetch_pool(tmp_path):
+    def fetch(data):
+        def write(client, localPath):
+            with open(localPath, "wb") as f:
+                f.write(data)
+            return localPath
+        return write
+
+    with PrefetchPool(lambda: None, numWorkers=2, depth=2, disconnect=lambda client: None, tmpDir=str(tmp_path)) as pool:
+        for k in range(5):
+            pool.submit(k, fetch(bytes([k])))
+        assert pool.submitted(0)
+        # every submitted key has to be taken, also when its file is not used, so that it frees its slot
+        for k in range(5):
+            with open(pool.get(k), "rb") as f:
+                assert f.read() == bytes([k])
+        assert not pool.submitted(0)
+        pool.submit("missing", lambda client, localPath: open(str(tmp_path / "missing" / "x"), "rb"))
+        try:
+            pool.get("missing")
+            assert False
+        except FileNotFoundError:
+            pass
+
+
+def test_binfile_file_object(tmp_path):
+    storage = MemoryStorage()
+    storage.put("/w/DE1/a_1.adibin", adibinBytes(tmp_path, "2013-05-12T19:00:00", 480), mtime=100)
+    with BinFile(str(tmp_path / "tmp.adibin"), "r") as f:
+        f.readHeader()
+        expected = f.readChannelData(0.5, 1.0, True, True)
+    for fileObject in [io.BytesIO(adibinBytes(tmp_path, "2013-05-12T19:00:00", 480)), storage.openFile("/w/DE1/a_1.adibin")]:
+        with fileObject, BinFile(fileObject, "r") as f:
+            f.readHeader()
+            assert f.header.SamplesPerChannel == 480
+            assert f.getChannelNames() == ["II", "ART"]
+            assert f.getStartTime() == np.datetime64("2013-05-12T19:00:00", "us")
+            assert np.array_equal(f.readChannelData(0.5, 1.0, True, True), expected)
+            assert np.array_equal(np.concatenate([block for n, t, block in f.iterChannelData(0.25, 0.5, 1.5)], axis=1), expected)
+
+
+def test_fetch_sample_range(tmp_path, monkeypatch):
+    storage = MemoryStorage()
+    storage.put("/w/DE1/a_1.adibin", adibinBytes(tmp_path, "2013-05-12T19:00:00", 480), mtime=100)
+    with BinFile(str(tmp_path / "tmp.adibin"), "r") as f:
+        f.readHeader()
+        source = f.readChannelData(0, 480, False, False, noDataScaling=True)
+    # blocks of 20 samples, so that the range is copied in several writes
+    monkeypatch.setattr(constant, "WRITE_BLOCK_SIZE", 20 * 2 * 2)
+    for offset, length in [(0, 480), (120, 150), (400, 200)]:
+        localPath = fetchSampleRange(storage, "/w/DE1/a_1.adibin", str(tmp_path / "range_{0}.adibin".format(offset)), offset, length)
+        with BinFile(localPath, "r") as f:
+            f.readHeader()
+            assert f.header.DataFormat == constant.FORMAT_SHORT
+            assert f.getChannelNames() == ["II", "ART"]
+            assert [c.scale for c in f.channels] == [0.01, 0.01]
+            assert f.getStartTime() == np.datetime64("2013-05-12T19:00:00", "us") + np.timedelta64(int(round(offset * 1e6 / 240)), "us")
+            assert f.header.SamplesPerChannel == min(length, 480 - offset)
+            assert np.array_equal(f.readChannelData(0, 0, False, False, noDataScaling=True), source[:, offset:offset + length])
+    # an empty range is not read as the whole file
+    try:
+        fetchSampleRange(storage, "/w/DE1/a_1.adibin", str(tmp_path / "empty.adibin"), 480, 0)
+        assert False
+    except ValueError:
+        pass
+    assert not os.path.exists(str(tmp_path / "empty.adibin"))
+
+
+class CountingStorage(MemoryStorage):
+    # counts the directories listed
+    listed = []
+
+    def listDir(self, path: str):
+        self.listed.append(path)
+        return MemoryStorage.listDir(self, path)
+
+
+def test_directory_listing_cache(tmp_path):
+    storage = CountingStorage()
+    storage.listed = []
+    storage.put("/w/DE1/MRN-Mapping.csv", b"x", mtime=100)
+    storage.put("/w/DE1/9ICU_1/a_1.adibin", b"12", mtime=100)
+    storage.put("/w/DE1/9ICU_2/b_2.adibin", b"123", mtime=100)
+    filename = str(tmp_path / "listing.json")
+    with DirectoryListingCache(filename, numWorkers=2) as listing:
+        assert listing.listFiles(storage, "/w/DE1", minDepth=1) == [("/w/DE1/9ICU_1/a_1.adibin", 2, 100), ("/w/DE1/9ICU_2/b_2.adibin", 3, 100)]
+    assert sorted(storage.listed) == ["/w/DE1", "/w/DE1/9ICU_1", "/w/DE1/9ICU_2"]
+    # only the changed directory is listed again, by the cache saved by the previous run
+    storage.listed = []
+    storage.put("/w/DE1/9ICU_2/c_2.adibin", b"1234", mtime=200)
+    with DirectoryListingCache(filename, numWorkers=2) as listing:
+        files = listing.listFiles(storage, "/w/DE1", minDepth=0)
+    assert storage.listed == ["/w/DE1/9ICU_2"]
+    assert [f[0] for f in files] == ["/w/DE1/MRN-Mapping.csv", "/w/DE1/9ICU_1/a_1.adibin", "/w/DE1/9ICU_2/b_2.adibin", "/w/DE1/9ICU_2/c_2.adibin"]
+
+
+def test_remote_file_cache(tmp_path):
+    storage = MemoryStorage()
+    storage.put("/w/DE1/MRN-Mapping.csv", b"a,b\n1,2\n", mtime=100)
+    storage.put("/w/DE2/MRN-Mapping.csv", b"a,b\n3,4\n", mtime=100)
+    paths = ["/w/DE1/MRN-Mapping.csv", "/w/DE2/MRN-Mapping.csv"]
+    with RemoteFileCache(str(tmp_path / "cache"), numWorkers=2) as cache:
+        local = cache.fetchAll(storage, paths)
+        assert [open(p, "rb").read() for p in local] == [b"a,b\n1,2\n", b"a,b\n3,4\n"]
+        # an unchanged file is not downloaded again, a changed one replaces its older copy
+        storage.remove("/w/DE2/MRN-Mapping.csv")
+        storage.put("/w/DE2/MRN-Mapping.csv", b"a,b\n5,6\n", mtime=200)
+        assert cache.fetch(storage, paths[0]) == local[0]
+        changed = cache.fetch(storage, paths[1])
+        assert open(changed, "rb").read() == b"a,b\n5,6\n"
+        assert not os.path.exists(local[1])
+        assert len(os.listdir(str(tmp_path / "cache"))) == 2
+
+
+class FakeTransport:
+    # connects in connectSeconds, or fails the first failures connections
+    connectSeconds = 0.0
+    failures = 0
+    count = 0
+
+    def __init__(self, address):
+        self.active = False
+
+    def connect(self, username=None, password=None):
+        FakeTransport.count += 1
+        if FakeTransport.count <= FakeTransport.failures:
+            raise EOFError("connection failed")
+        time.sleep(FakeTransport.connectSeconds)
+        self.active = True
+
+    def is_active(self):
+        return self.active
+
+    def set_keepalive(self, interval):
+        pass
+
+    def close(self):
+        self.active = False
+
+
+class FakeSFTPClient:
+    def __init__(self, transport):
+        self.transport = transport
+
+    @staticmethod
+    def from_transport(transport):
+        return FakeSFTPClient(transport)
+
+    def stat(self, path):
+        return path
+
+
+class FakeParamiko:
+    SSHException = IOError
+    Transport = FakeTransport
+    SFTPClient = FakeSFTPClient
+
+
+def openFakeStorage(**kwargs):
+    storage = SFTPStorage("host", "usr", "pwd", retryDelay=0.0, **kwargs)
+    storage._paramiko = FakeParamiko
+    storage._transportErrors = (FakeParamiko.SSHException, EOFError, OSError)
+    return storage
+
+
+def test_sftp_storage_pool():
+    FakeTransport.count = 0
+    FakeTransport.failures = 0
+    FakeTransport.connectSeconds = 0.5
+    storage = openFakeStorage(maxConnections=2, channelsPerConnection=1)
+    assert storage.stat("/w/a") == "/w/a"
+    # a channel is returned and taken again while the second connection is being set up
+    held = storage._acquire()
+    times = []
+    connecting = threading.Thread(target=lambda: times.append(storage.stat("/w/b")))
+    connecting.start()
+    time.sleep(0.1)
+    t = time.perf_counter()
+    storage._release(*held)
+    assert storage.stat("/w/c") == "/w/c"
+    assert time.perf_counter() - t < 0.3
+    connecting.join()
+    assert times == ["/w/b"]
+    assert len(storage._channels) == 2
+    storage.close()
+
+
+def test_sftp_storage_reconnect():
+    # a connection that cannot be set up is retried
+    FakeTransport.count = 0
+    FakeTransport.failures = 2
+    FakeTransport.connectSeconds = 0.0
+    storage = openFakeStorage(retries=2)
+    assert storage.stat("/w/a") == "/w/a"
+    assert storage._connecting == 0
+    storage.close()
+    FakeTransport.count = 0
+    storage = openFakeStorage(retries=1)
+    try:
+        storage.stat("/w/a")
+        assert False
+    except EOFError:
+        pass
+    assert storage._connecting == 0
+
+
+def test_chunk_encoding():
+    # delta encoding of the bits of floats is exact, also for nan, inf and gap values
+    for samples in [np.array([1, -32768, 32767, -5, 0], dtype=np.int16),
+                    np.array([0.1, -1e300, np.nan, np.inf, constant.MIN_DOUBLE_VALUE, 3.0]),
+                    np.array([0.5, -2.25, np.nan], dtype=np.float32)]:
+        for codec in ["zlib", "lzma"]:
+            decoded = chunked.decodeChunk(chunked.encodeChunk(samples, codec), samples.dtype.str, codec)
+            assert decoded.dtype == samples.dtype
+            assert decoded.tobytes() == samples.tobytes()
+
+
+def test_chunked_appender(tmp_path):
+    gap = constant.MIN_DOUBLE_VALUE
+    path = str(tmp_path / "continuous_chunked")
+    expected = str(tmp_path / "continuous")
+    ramp = np.arange(10, dtype=np.float64)
+    segments = [segment(0, [ramp, ramp * 10]), segment(6, [ramp + 10, ramp * 10 + 100]), segment(12, [ramp[:3] + 20], ("II",))]
+    # chunks of 4 samples, the store is continued after each segment like in a rerun
+    for s in segments:
+        with ChunkedAppender(path, codec="lzma", chunkSeconds=2.0) as store:
+            store.append(s)
+        with ColumnarAppender(expected) as store:
+            store.append(s)
+    whole = readColumnar(expected)
+    assert whole.getNumSamples() == 27
+    c = readColumnar(path)
+    assert c.startTime == whole.startTime
+    assert c.channelNames == ["II", "ART"]
+    for name in c.channelNames:
+        assert c.getChannel(name).tolist() == whole.getChannel(name).tolist()
+    assert c.getChannel("ART")[26] == gap
+    # the chunk index has full chunks of 4 samples and a partial last chunk
+    with ChunkedAppender(path) as store:
+        assert store.codec == "lzma"
+        assert [chunk[3] for chunk in store.chunks[0]] == [4, 4, 4, 4, 4, 4, 3]
+        assert store.chunks[0][0][4:] == [0.0, 3.0]
+        assert store.chunks[1][-1][4:] == [None, None]
+
+
+def test_read_chunked_range(tmp_path):
+    path = str(tmp_path / "continuous_chunked")
+    ramp = np.arange(100, dtype=np.float64)
+    with ChunkedAppender(path, codec="zlib", chunkSeconds=5.0) as store:
+        store.append(segment(0, [ramp, -ramp]))
+    whole = readColumnar(path)
+    decoded = []
+    decodeChunk = chunked.decodeChunk
+    chunked.decodeChunk = lambda buf, dtype, codec: decoded.append(len(buf)) or decodeChunk(buf, dtype, codec)
+    try:
+        for t0, t1 in [(0, 50), (3.2, 7.7), (10, 12), (12.5, 12.6), (49.5, 60), (-5, 5), (30, 20)]:
+            decoded.clear()
+            s = readChunked(path, T0 + np.timedelta64(int(t0 * 1e9), "ns"), T0 + np.timedelta64(int(t1 * 1e9), "ns"), channels=["ART"])
+            assert s.channelNames == ["ART"]
+            expected = whole.between(T0 + np.timedelta64(int(t0 * 1e9), "ns"), T0 + np.timedelta64(int(t1 * 1e9), "ns"))
+            assert s.startTime == expected.startTime or s.getNumSamples() == 0
+            assert s.getChannel("ART").tolist() == expected.getChannel("ART").tolist()
+            # only the chunks of 10 samples overlapping the range are decompressed
+            if s.getNumSamples() > 0:
+                first = int(np.ceil(max(t0, 0) / 0.5)) // 10
+                last = (int(np.ceil(min(t1, 50) / 0.5)) - 1) // 10
+                assert len(decoded) == last - first + 1
+    finally:
+        chunked.decodeChunk = decodeChunk
+
+
+def test_chunked_appender_codec(tmp_path):
+    try:
+        ChunkedAppender(str(tmp_path / "x"), codec="zstd")
+        assert False
+    except ValueError:
+        pass
+
+
+def test_stage_metrics(tmp_path):
+    filename = str(tmp_path / "metrics.jsonl")
+    with StageMetrics(filename) as metrics:
+        with metrics.stage("encounter", encounter=3) as outer:
+            for k in range(2):
+                with metrics.stage("decode", encounter=3, file="a_{0}.adibin".format(k)) as record:
+                    record["bytesIn"] = 100
+                    record["samples"] = 240
+            with metrics.stage("write", encounter=3) as record:
+                record["bytesOut"] = 50
+        # the counters of the inner stages are added to the enclosing stage
+        assert (outer["bytesIn"], outer["samples"], outer["bytesOut"]) == (200, 480, 50)
+        totals = metrics.takeTotals()
+    assert totals["decode"]["count"] == 2 and totals["decode"]["samples"] == 480
+    assert totals["encounter"]["count"] == 1 and totals["encounter"]["bytesOut"] == 50
+    assert metrics.totals == {}
+    with open(filename, "r") as f:
+        records = [json.loads(line) for line in f]
+    # a record is written when its stage ends
+    assert [r["stage"] for r in records] == ["decode", "decode", "write", "encounter"]
+    assert records[1]["file"] == "a_1.adibin" and records[1]["encounter"] == 3
+    assert all(r["pid"] == os.getpid() and r["seconds"] >= 0 and r["start"] > 0 for r in records)
+    assert records[3]["seconds"] >= records[0]["seconds"] + records[1]["seconds"]
+    assert "peakMemoryBytes" not in records[0]
+    assert not any(name.startswith("profile_") for name in os.listdir(str(tmp_path)))
+    # totals of other processes are merged for the summary
+    metrics.addTotals(totals)
+    metrics.addTotals(totals)
+    assert metrics.totals["decode"]["count"] == 4 and metrics.totals["decode"]["bytesIn"] == 400
+    assert [line.split()[0] for line in metrics.formatSummary().split("\n")] == ["stage", "decode", "write", "encounter"]
+
+
+def test_stage_metrics_profile(tmp_path):
+    import pstats
+    import tracemalloc
+
+    def run(metrics):
+        for stage in ["decode", "write", "decode"]:
+            with metrics.stage(stage):
+                data = np.ones(1 << 20)
+                data.sum()
+
+    with StageMetrics(str(tmp_path / "cprofile.jsonl"), profileStage="decode", profileMode="cprofile", profileDir=str(tmp_path)) as metrics:
+        run(metrics)
+    stats = pstats.Stats(str(tmp_path / "profile_decode_{0}.prof".format(os.getpid())))
+    assert any(name == "ones" for filename, line, name in stats.stats)
+    # tracemalloc records the peak memory of each run of the profiled stage
+    with StageMetrics(str(tmp_path / "tracemalloc.jsonl"), profileStage="decode", profileMode="tracemalloc", profileDir=str(tmp_path)) as metrics:
+        assert tracemalloc.is_tracing()
+        run(metrics)
+    assert not tracemalloc.is_tracing()
+    with open(str(tmp_path / "tracemalloc.jsonl"), "r") as f:
+        records = [json.loads(line) for line in f]
+    assert [r["stage"] for r in records] == ["decode", "write", "decode"]
+    assert all(r["peakMemoryBytes"] >= 8 << 20 for r in records if r["stage"] == "decode")
+    assert "peakMemoryBytes" not in records[1]
+    assert os.path.exists(str(tmp_path / "profile_decode_{0}.txt".format(os.getpid())))
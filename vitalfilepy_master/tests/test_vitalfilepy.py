@@ -25,8 +25,10 @@ SOFTWARE.
 import os
 import sys
 from pathlib import Path
+import numpy as np
 from vitalfilepy import VitalFile
 from vitalfilepy import VITALBINARY
+from vitalfilepy import VITAL_DTYPE
 
 
 def test_vitalfilewriter():
@@ -40,11 +42,11 @@ def test_vitalfilewriter():
         outfile = Path(filename)
         if outfile.exists():
             outfile.unlink()
-    except:
+    except OSError:
         # ignore error
         pass
     # dummy test for now
-    assert(len(filename) > 0)
+    assert len(filename) > 0
     with VitalFile(filename, "w") as f:
         header = VITALBINARY("HR", "Bpm", "T1ICU", "101", 2019, 3, 31, 8, 15, 30.0)
         f.setHeader(header)
@@ -54,33 +56,184 @@ def test_vitalfilewriter():
     with VitalFile(filename, "r") as f:
         f.readHeader()
         print("Start Date/Time: {0}/{1}/{2} {3}:{4}:{5:.0f}".format(f.header.Month, f.header.Day, f.header.Year, f.header.Hour, f.header.Minute, f.header.Second))
-        assert(f.header.Label == "HR")
-        assert(f.header.Uom == "Bpm")
-        assert(f.header.Unit == "T1ICU")
-        assert(f.header.Bed == "101")
-        assert(f.header.Year == 2019)
-        assert(f.header.Month == 3)
-        assert(f.header.Day == 31)
-        assert(f.header.Hour == 8)
-        assert(f.header.Minute == 15)
-        assert(f.header.Second == 30.0)
+        assert f.header.Label == "HR"
+        assert f.header.Uom == "Bpm"
+        assert f.header.Unit == "T1ICU"
+        assert f.header.Bed == "101"
+        assert f.header.Year == 2019
+        assert f.header.Month == 3
+        assert f.header.Day == 31
+        assert f.header.Hour == 8
+        assert f.header.Minute == 15
+        assert f.header.Second == 30.0
         for i in range(0, 5):
             value, offset, low, high = f.readVitalData()
             print("value, offset, low, high: {0}, {1}, {2}, {3}".format(value, offset, low, high))
-            assert(value == valueList[i])
-            assert(offset == offsetList[i])
-            assert(low == lowList[i])
-            assert(high == highList[i])
+            assert value == valueList[i]
+            assert offset == offsetList[i]
+            assert low == lowList[i]
+            assert high == highList[i]
     # remove temporary file created
     try:
         outfile = Path(filename)
         if outfile.exists():
             outfile.unlink()
-    except:
+    except OSError:
         # ignore error
         pass
     return
 
+
+def test_vitalfilereadall():
+    filename = "tmp_test_vitalfilereadall.vital"
+    valueList = [80, 90, 85, 130, 135]
+    offsetList = [0, 60, 120, 180, 360]
+    lowList = [0, 0, 0, 0, 0]
+    highList = [1000, 1000, 1000, 150, 150]
+    # remove test file if exist
+    try:
+        outfile = Path(filename)
+        if outfile.exists():
+            outfile.unlink()
+    except OSError:
+        # ignore error
+        pass
+    with VitalFile(filename, "w") as f:
+        header = VITALBINARY("HR", "Bpm", "T1ICU", "101", 2019, 3, 31, 8, 15, 30.0)
+        f.setHeader(header)
+        f.writeHeader()
+        for i in range(0, 5):
+            f.writeVitalData(valueList[i], offsetList[i], lowList[i], highList[i])
+    for mode in ["r", "mmap"]:
+        with VitalFile(filename, mode) as f:
+            f.readHeader()
+            records = f.readAll()
+            assert records.dtype == VITAL_DTYPE
+            assert len(records) == 5
+            assert records["value"].tolist() == valueList
+            assert records["offset"].tolist() == offsetList
+            assert records["low"].tolist() == lowList
+            assert records["high"].tolist() == highList
+            del records
+    with VitalFile(filename, "r") as f:
+        f.readHeader()
+        arr = f.readVitalDataBuf(5)
+        assert arr == [(valueList[i], offsetList[i], lowList[i], highList[i]) for i in range(0, 5)]
+    # remove temporary file created
+    try:
+        outfile = Path(filename)
+        if outfile.exists():
+            outfile.unlink()
+    except OSError:
+        # ignore error
+        pass
+    return
+
+
+def test_vitalfilewriterbuf():
+    filename = "tmp_test_vitalfilewriterbuf.vital"
+    filenameRef = "tmp_test_vitalfilewriterbuf_ref.vital"
+    valueList = [80, 90, 85, 130, 135]
+    offsetList = [0, 60, 12, 180, 360]
+    lowList = [0, 0, 0, 0, 0]
+    highList = [1000, 1000, 1000, 150, 150]
+    # remove test files if exist
+    for name in [filename, filenameRef]:
+        try:
+            outfile = Path(name)
+            if outfile.exists():
+                outfile.unlink()
+        except OSError:
+            # ignore error
+            pass
+    header = VITALBINARY("HR", "Bpm", "T1ICU", "101", 2019, 3, 31, 8, 15, 30.0)
+    with VitalFile(filename, "w") as f:
+        f.setHeader(header)
+        f.writeHeader()
+        assert f.writeVitalDataBuf(valueList[:2], offsetList[:2], lowList[:2], highList[:2]) == 2
+        records = np.zeros(3, dtype=VITAL_DTYPE)
+        records["value"], records["offset"], records["low"], records["high"] = valueList[2:], offsetList[2:], lowList[2:], highList[2:]
+        assert f.writeVitalDataBuf(records) == 3
+        assert f.numSamplesInFile == 5
+    with VitalFile(filenameRef, "w") as f:
+        f.setHeader(header)
+        f.writeHeader()
+        for i in range(0, 5):
+            f.writeVitalData(valueList[i], offsetList[i], lowList[i], highList[i])
+    # the bulk writer has the same layout as the record writer
+    assert Path(filename).read_bytes() == Path(filenameRef).read_bytes()
+    with VitalFile(filename, "r") as f:
+        f.readHeader()
+        assert f.numSamplesInFile == 5
+        for i in range(0, 5):
+            value, offset, low, high = f.readVitalData()
+            assert value == valueList[i]
+            assert offset == offsetList[i]
+            assert low == lowList[i]
+            assert high == highList[i]
+    # remove temporary files created
+    for name in [filename, filenameRef]:
+        try:
+            outfile = Path(name)
+            if outfile.exists():
+                outfile.unlink()
+        except OSError:
+            # ignore error
+            pass
+    return
+
+
+def test_vitalfilereadrange():
+    filename = "tmp_test_vitalfilereadrange.vital"
+    numSamples = 1000
+    # one record per minute
+    offsets = np.arange(numSamples) * 60.0
+    values = np.arange(numSamples) % 50 + 60.0
+    # remove test file if exist
+    try:
+        outfile = Path(filename)
+        if outfile.exists():
+            outfile.unlink()
+    except OSError:
+        # ignore error
+        pass
+    with VitalFile(filename, "w") as f:
+        header = VITALBINARY("HR", "Bpm", "T1ICU", "101", 2019, 3, 31, 8, 15, 30.0)
+        f.setHeader(header)
+        f.writeHeader()
+        f.writeVitalDataBuf(values, offsets, np.zeros(numSamples), np.full(numSamples, 1000.0))
+        assert f.getNumSamples() == numSamples
+    for mode in ["r", "mmap"]:
+        with VitalFile(filename, mode) as f:
+            f.readHeader()
+            assert f.getNumSamples() == numSamples
+            records = f.readRange(600, 1200)
+            assert records["offset"].tolist() == offsets[10:20].tolist()
+            assert records["value"].tolist() == values[10:20].tolist()
+            records = f.readRange(590.5, 1200.5)
+            assert records["offset"].tolist() == offsets[10:21].tolist()
+            # 2019-03-31 09:15:30 is 3600 seconds after the start time
+            records = f.readRange(np.datetime64("2019-03-31T09:15:30"), np.datetime64("2019-03-31T09:20:30"))
+            assert records["offset"].tolist() == offsets[60:65].tolist()
+            assert len(f.readRange(-100, 0)) == 0
+            assert len(f.readRange(numSamples * 60.0, numSamples * 120.0)) == 0
+            assert len(f.readRange(1200, 600)) == 0
+            assert len(f.readRange(-100, numSamples * 60.0)) == numSamples
+            del records
+    # remove temporary file created
+    try:
+        outfile = Path(filename)
+        if outfile.exists():
+            outfile.unlink()
+    except OSError:
+        # ignore error
+        pass
+    return
+
+
 if __name__ == "__main__":
     # execute only if run as a script
     test_vitalfilewriter()
+    test_vitalfilereadall()
+    test_vitalfilewriterbuf()
+    test_vitalfilereadrange()
@@ -1,3 +1,4 @@
 from .vitalfile import VITALBINARY
 from .vitalfile import VitalFileError
 from .vitalfile import VitalFile
+from .vitalfile import VITAL_DTYPE
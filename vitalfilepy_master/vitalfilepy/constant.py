@@ -32,3 +32,5 @@ INT32_SIZE = 4
 FLOAT_SIZE = 4
 DOUBLE_SIZE = 8
 VITALHEADER_SIZE = LABEL_LEN + UOM_LEN + UNIT_LEN + BED_LEN + INT32_SIZE * 5 + DOUBLE_SIZE
+# one record is value, offset, low, high as doubles
+VITALRECORD_SIZE = DOUBLE_SIZE * 4
@@ -25,14 +25,19 @@ SOFTWARE.
 
 import os
 import sys
+import mmap
 from pathlib import Path
 import datetime
 from array import array
 import struct
 from typing import List
 from typing import Any
+import numpy as np
 from . import constant
 
+# numpy layout of a record, same as struct "dddd"
+VITAL_DTYPE = np.dtype([("value", "<f8"), ("offset", "<f8"), ("low", "<f8"), ("high", "<f8")])
+
 
 class VITALBINARY:
     Label = ""                          # 16 char
@@ -87,13 +92,15 @@ class VitalFile:
     numSamplesInFile = 0    # filesize in byte
 
     def __init__(self, filename: str, mode: str):
+        # mode "mmap" is read only like "r", and readAll() returns a view of the mapped file
         self.filename = filename
         self.mode = mode
         self.header = None
         self.numSamplesInFile = 0
+        self._map = None
 
     def open(self):
-        if self.mode == "r":
+        if self.mode == "r" or self.mode == "mmap":
             try:
                 fileSize = os.path.getsize(self.filename)
                 self.numSamplesInFile = int((fileSize - constant.VITALHEADER_SIZE) / (constant.DOUBLE_SIZE * 4))
@@ -161,7 +168,52 @@ class VitalFile:
         self.f.write(struct.pack("d", self.header.Second))
 
     def getNumSamples(self):
-        (self.fileSize - constant.VITALHEADER_SIZE) / (constant.DOUBLE_SIZE * 4)
+        # number of records in the file, including the ones written since open()
+        self.f.flush()
+        fileSize = os.fstat(self.f.fileno()).st_size
+        return max(int((fileSize - constant.VITALHEADER_SIZE) / constant.VITALRECORD_SIZE), 0)
+
+    def getStartTime(self):
+        # start time of the header as datetime64 in microseconds, offsets are seconds from it
+        startTime = np.datetime64("{0:04}-{1:02}-{2:02}T{3:02}:{4:02}".format(
+            self.header.Year, self.header.Month, self.header.Day, self.header.Hour, self.header.Minute), "us")
+        return startTime + np.timedelta64(int(round(self.header.Second * 1e6)), "us")
+
+    def _toOffset(self, t):
+        # a time as datetime64 or datetime is converted to the offset in seconds from the start time
+        if isinstance(t, (np.datetime64, datetime.datetime)):
+            return (np.datetime64(t, "us") - self.getStartTime()) / np.timedelta64(1, "s")
+        return float(t)
+
+    def _readOffset(self, sampleNum: int):
+        pos = constant.VITALHEADER_SIZE + sampleNum * constant.VITALRECORD_SIZE + constant.DOUBLE_SIZE
+        if self.mode == "mmap":
+            self._mapRecords()
+            return struct.unpack_from("d", self._map, pos)[0]
+        self.f.seek(pos, 0)
+        return struct.unpack("d", self.f.read(constant.DOUBLE_SIZE))[0]
+
+    def _searchOffset(self, offset: float):
+        # index of the first record with an offset >= offset, offsets increase monotonically
+        lo = 0
+        hi = self.numSamplesInFile
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._readOffset(mid) < offset:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    # return structured array of the records with t0 <= offset < t1, found by binary search over the offsets,
+    # t0 and t1 are offsets in seconds, or times as datetime64 or datetime (readHeader() first)
+    def readRange(self, t0, t1):
+        lo = self._searchOffset(self._toOffset(t0))
+        hi = max(self._searchOffset(self._toOffset(t1)), lo)
+        if self.mode == "mmap":
+            return self._mapRecords()[lo:hi]
+        self.f.seek(constant.VITALHEADER_SIZE + lo * constant.VITALRECORD_SIZE, 0)
+        return self.readVitalDataArray(hi - lo)
 
     # return value, offset, low, high
     def readVitalData(self):
@@ -170,16 +222,28 @@ class VitalFile:
 
     # return array of tuples of (value, offset, low, high)
     def readVitalDataBuf(self, numSamples):
-        buf = self.f.read(constant.DOUBLE_SIZE * 4 * numSamples)
-        trunkSize = constant.DOUBLE_SIZE * 4
-        curr = 0
-        arr = []
-        while curr < len(buf):
-            mv = memoryview(buf[curr:curr + trunkSize])
-            t = struct.unpack("dddd", mv)
-            arr.append(t)
-            curr += trunkSize
-        return arr
+        return self.readVitalDataArray(numSamples).tolist()
+
+    # return structured array with fields value, offset, low, high of the next numSamples records, read in one call
+    def readVitalDataArray(self, numSamples):
+        buf = self.f.read(constant.VITALRECORD_SIZE * max(numSamples, 0))
+        return np.frombuffer(buf, dtype=VITAL_DTYPE, count=len(buf) // constant.VITALRECORD_SIZE)
+
+    def _mapRecords(self):
+        # map the file read-only, returns all records as a structured array view without copy
+        if self._map is None:
+            try:
+                self._map = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                raise VitalFileError("Cannot map file!")
+        return np.frombuffer(self._map, dtype=VITAL_DTYPE, count=self.numSamplesInFile, offset=constant.VITALHEADER_SIZE)
+
+    # return structured array of all numSamplesInFile records, mapped in mode "mmap"
+    def readAll(self):
+        if self.mode == "mmap":
+            return self._mapRecords()
+        self.f.seek(constant.VITALHEADER_SIZE, 0)
+        return self.readVitalDataArray(self.numSamplesInFile)
 
     def writeVitalData(self, value: float, offset: float, low: float, high: float):
         # set to end of file
@@ -190,8 +254,35 @@ class VitalFile:
         self.f.write(struct.pack("d", high))
         self.numSamplesInFile += 1
 
+    # write a batch of records in one call, values is either an array of values with offsets, lows and highs of the same length,
+    # or a structured array with fields value, offset, low, high, returns the number of records written
+    def writeVitalDataBuf(self, values, offsets=None, lows=None, highs=None):
+        if offsets is None and getattr(values, "dtype", None) is not None and values.dtype.names is not None:
+            records = np.empty(len(values), dtype=VITAL_DTYPE)
+            for name in VITAL_DTYPE.names:
+                records[name] = values[name]
+        else:
+            columns = [np.asarray(c, dtype=np.float64) for c in [values, offsets, lows, highs]]
+            if any(len(c) != len(columns[0]) for c in columns):
+                raise VitalFileError("Array lengths do not match!")
+            records = np.empty(len(columns[0]), dtype=VITAL_DTYPE)
+            for name, c in zip(VITAL_DTYPE.names, columns):
+                records[name] = c
+        # set to end of file
+        self.f.seek(0, 2)
+        self.f.write(records.tobytes())
+        self.numSamplesInFile += len(records)
+        return len(records)
+
     def close(self):
         # print("Close")
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # arrays returned by readAll() are still alive, the map is released with them
+                pass
+            self._map = None
         if self.f is not None:
             self.f.flush()
             self.f.close()
@@ -0,0 +1,19 @@
+from .catalog import CatalogEntry
+from .catalog import AdibinCatalog
+from .prefetch import fetchSampleRange
+from .prefetch import PrefetchPool
+from .columnar import writeColumnar
+from .columnar import readColumnar
+from .columnar import ColumnarAppender
+from .checkpoint import checkpointKey
+from .checkpoint import CheckpointManifest
+from .listing import DirectoryListingCache
+from .filecache import RemoteFileCache
+from .intervals import ValidWindowIndex
+from .storage import FileAttributes
+from .storage import LocalStorage
+from .storage import MemoryStorage
+from .storage import SFTPStorage
+from .metrics import StageMetrics
+from .chunked import ChunkedAppender
+from .chunked import readChunked
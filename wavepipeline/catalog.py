@@ -0,0 +1,143 @@
+# Persistent catalog of ADIBIN file headers, so that files can be selected by time without downloading them
+# Only the header (CFWB_SIZE + CHANNEL_SIZE * NChannels bytes) of new or changed files is read from the server
+
+import io
+import json
+import sqlite3
+import struct
+from typing import List
+from typing import Tuple
+import numpy as np
+from binfilepy import BinFile
+from binfilepy import constant
+
+
+class CatalogEntry:
+    path = ""
+    size = 0
+    mtime = 0
+    startTime = None            # datetime64[us] of the first sample
+    endTime = None              # datetime64[us], startTime + SamplesPerChannel * secsPerTick
+    secsPerTick = 0.0
+    DataFormat = 0
+    NChannels = 0
+    SamplesPerChannel = 0
+    channelTitles = []
+
+    def __init__(self, path: str, size: int, mtime: int, startTime: np.datetime64, endTime: np.datetime64,
+                 secsPerTick: float, DataFormat: int, NChannels: int, SamplesPerChannel: int, channelTitles: List[str]):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.startTime = startTime
+        self.endTime = endTime
+        self.secsPerTick = secsPerTick
+        self.DataFormat = DataFormat
+        self.NChannels = NChannels
+        self.SamplesPerChannel = SamplesPerChannel
+        self.channelTitles = channelTitles
+
+    def getChannelNames(self):
+        # same naming as BinFile.getChannelNames()
+        return [t if t else "Unnamed_Channel_{0}".format(i + 1) for i, t in enumerate(self.channelTitles)]
+
+    def getDurationSeconds(self):
+        return self.SamplesPerChannel * self.secsPerTick
+
+
+def _toMicroseconds(t):
+    return int(np.datetime64(t, "us").astype(np.int64))
+
+
+def _escapeLike(s: str):
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def readRemoteHeader(storage, path: str):
+    # read only the file header and the channel headers of a file on a storage backend, returns BinFile with header and channels set
+    buf = storage.readRange(path, 0, constant.CFWB_SIZE)
+    nChannels = struct.unpack_from("i", buf, constant.N_SAMPLE_POSITION - constant.INT32_SIZE)[0]
+    buf += storage.readRange(path, constant.CFWB_SIZE, constant.CHANNEL_SIZE * nChannels)
+    with BinFile(io.BytesIO(buf), "r") as binFile:
+        binFile.readHeader()
+    return binFile
+
+
+class AdibinCatalog:
+    filename = ""
+    db = None
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.db = None
+
+    def open(self):
+        # several extraction processes can share the catalog, wait for the lock of another writer
+        self.db = sqlite3.connect(self.filename, timeout=60)
+        self.db.execute("CREATE TABLE IF NOT EXISTS adibin ("
+                        "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, start_time INTEGER, end_time INTEGER, "
+                        "secs_per_tick REAL, data_format INTEGER, n_channels INTEGER, samples_per_channel INTEGER, "
+                        "channel_titles TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS adibin_time ON adibin (start_time, end_time)")
+        self.db.commit()
+
+    def _toEntry(self, row):
+        return CatalogEntry(row[0], row[1], row[2], np.datetime64(row[3], "us"), np.datetime64(row[4], "us"),
+                            row[5], row[6], row[7], row[8], json.loads(row[9]))
+
+    def getEntry(self, path: str):
+        row = self.db.execute("SELECT * FROM adibin WHERE path = ?", (path,)).fetchone()
+        return self._toEntry(row) if row is not None else None
+
+    def _headerEntry(self, path: str, size: int, mtime: int, binFile: BinFile):
+        startTime = binFile.getStartTime()
+        endTime = startTime + np.timedelta64(int(binFile.header.SamplesPerChannel * binFile.header.secsPerTick * 1e6), "us")
+        return CatalogEntry(path, size, mtime, startTime, endTime, binFile.header.secsPerTick, binFile.header.DataFormat,
+                            binFile.header.NChannels, binFile.header.SamplesPerChannel, [c.Title for c in binFile.channels])
+
+    def _insert(self, entry: CatalogEntry):
+        self.db.execute("INSERT OR REPLACE INTO adibin VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (entry.path, entry.size, entry.mtime, _toMicroseconds(entry.startTime), _toMicroseconds(entry.endTime),
+                         entry.secsPerTick, entry.DataFormat, entry.NChannels, entry.SamplesPerChannel, json.dumps(entry.channelTitles)))
+
+    def addHeader(self, path: str, size: int, mtime: int, binFile: BinFile):
+        entry = self._headerEntry(path, size, mtime, binFile)
+        self._insert(entry)
+        return entry
+
+    def refresh(self, storage, files: List[Tuple[str, int, int]]):
+        # files is a list of (path, size, mtime), headers are only read for files not in the catalog
+        # or with a different size or mtime, returns the catalog entries of files in the same order
+        entries = []
+        changed = []
+        for path, size, mtime in files:
+            entry = self.getEntry(path)
+            if entry is None or entry.size != size or entry.mtime != mtime:
+                entry = self._headerEntry(path, size, mtime, readRemoteHeader(storage, path))
+                changed.append(entry)
+            entries.append(entry)
+        # the headers are written in one short transaction after they are all read, so the other processes sharing the catalog
+        # are not locked out while the headers are read from the server
+        with self.db:
+            for entry in changed:
+                self._insert(entry)
+        return entries
+
+    def findOverlapping(self, startTime, endTime, pathPrefix: str = "", pathSuffix: str = ""):
+        # entries of files with data in [startTime, endTime], sorted by path
+        rows = self.db.execute("SELECT * FROM adibin WHERE start_time <= ? AND end_time >= ? AND path LIKE ? ESCAPE '\\' ORDER BY path",
+                               (_toMicroseconds(endTime), _toMicroseconds(startTime), _escapeLike(pathPrefix) + "%" + _escapeLike(pathSuffix))).fetchall()
+        return [self._toEntry(row) for row in rows]
+
+    def close(self):
+        if self.db is not None:
+            self.db.commit()
+            self.db.close()
+            self.db = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
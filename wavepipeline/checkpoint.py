@@ -0,0 +1,64 @@
+# Checkpoint manifest of the extracted files, so that a rerun skips the files already extracted
+# One JSON line is appended per file after its output is complete, a torn last line of an interrupted run is dropped
+
+import json
+import os
+import numpy as np
+
+
+def checkpointKey(path: str, size: int, mtime: int, validStartTime: np.datetime64, validStopTime: np.datetime64):
+    # a file is extracted again when it changed on the server or was cut with another valid waveform time
+    return "{0}|{1}|{2}|{3}|{4}".format(path, size, mtime, np.datetime64(validStartTime, "us"), np.datetime64(validStopTime, "us"))
+
+
+class CheckpointManifest:
+    filename = ""
+    records = {}
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.records = {}
+        self.f = None
+
+    def open(self):
+        if os.path.exists(self.filename):
+            with open(self.filename, "rb") as f:
+                buf = f.read()
+            # keep the complete lines only
+            end = buf.rfind(b"\n") + 1
+            for line in buf[:end].splitlines():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self.records[record["key"]] = record
+            if end < len(buf):
+                with open(self.filename, "r+b") as f:
+                    f.truncate(end)
+        self.f = open(self.filename, "ab")
+
+    def isDone(self, key: str):
+        return key in self.records
+
+    def get(self, key: str):
+        return self.records.get(key)
+
+    def markDone(self, key: str, record: dict):
+        # one write of a whole line, flushed to the disk before returning
+        record = dict(record, key=key)
+        self.f.write((json.dumps(record) + "\n").encode("utf-8"))
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.records[key] = record
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -0,0 +1,175 @@
+# Compressed waveform store: each channel is split into chunks of chunkSeconds, delta encoded and compressed with zlib or lzma
+# The sidecar holds an index of the chunks of each channel (start sample, byte offset, byte length, number of samples, min, max),
+# so a reader only decompresses the chunks overlapping the requested time range
+# Float samples are delta encoded as the integers of their bits, the differences wrap around and decode exactly
+
+import json
+import lzma
+import os
+import zlib
+import numpy as np
+from binfilepy import WaveformSegment
+from .columnar import ColumnarAppender
+from .columnar import SIDECAR_NAME
+
+CODECS = {
+    "zlib": (lambda buf, level: zlib.compress(buf, level), zlib.decompress),
+    "lzma": (lambda buf, level: lzma.compress(buf, preset=level), lzma.decompress),
+}
+
+
+def _deltaType(dtype: str):
+    # integer type of the same size, e.g. <i8 for <f8
+    return "<i{0}".format(np.dtype(dtype).itemsize)
+
+
+def encodeChunk(samples: np.ndarray, codec: str, level: int = 6):
+    ints = np.ascontiguousarray(samples).view(_deltaType(samples.dtype))
+    delta = np.diff(ints, prepend=ints.dtype.type(0))
+    return CODECS[codec][0](delta.tobytes(), level)
+
+
+def decodeChunk(buf: bytes, dtype: str, codec: str):
+    delta = np.frombuffer(CODECS[codec][1](buf), dtype=_deltaType(dtype))
+    return np.cumsum(delta, dtype=delta.dtype).view(dtype)
+
+
+class ChunkedAppender(ColumnarAppender):
+    # ColumnarAppender writing compressed chunks, the last chunk is partial until enough samples are appended,
+    # it is written at every flush and written again when it grows
+    chunkSeconds = 0.0
+    chunkSamples = 0
+    codec = ""
+    level = 0
+    chunks = []                 # per channel list of [startSample, byteOffset, byteLength, numSamples, min, max]
+
+    def __init__(self, path: str, secsPerTick: float = 0.0, raw: bool = False, codec: str = "zlib", level: int = 6,
+                 chunkSeconds: float = 60.0):
+        # codec and chunkSeconds of a new store, an existing store keeps its own
+        super().__init__(path, secsPerTick, raw)
+        if codec not in CODECS:
+            raise ValueError("Unknown codec: {0}".format(codec))
+        self.codec = codec
+        self.level = level
+        self.chunkSeconds = chunkSeconds
+        self.chunkSamples = 0
+        self.chunks = []
+        self._tails = []
+        self._tailWritten = []
+
+    def _openChannel(self, channel: dict, sidecar: dict):
+        # the bytes after the indexed chunks are dropped, and a partial last chunk is decompressed to be continued
+        self.codec = sidecar["codec"]
+        self.chunkSamples = sidecar["chunkSamples"]
+        chunks = [list(c) for c in channel["chunks"]]
+        f = open(os.path.join(self.path, channel["file"]), "r+b")
+        f.truncate(chunks[-1][1] + chunks[-1][2] if len(chunks) > 0 else 0)
+        f.seek(0, 2)
+        tail = np.empty(0, dtype=self.dtype)
+        if len(chunks) > 0 and chunks[-1][3] < self.chunkSamples:
+            f.seek(chunks[-1][1])
+            tail = decodeChunk(f.read(chunks[-1][2]), self.dtype, self.codec)
+            f.seek(0, 2)
+        self.chunks.append(chunks)
+        self._tails.append(tail)
+        self._tailWritten.append(len(tail) > 0)
+        return f
+
+    def _channelFile(self, k: int):
+        # e.g. 0.i2.zlib
+        return "{0}.{1}.{2}".format(k, self.dtype[1:], self.codec)
+
+    def _writeChunk(self, k: int, samples: np.ndarray):
+        f = self._files[k]
+        chunks = self.chunks[k]
+        start = chunks[-1][0] + chunks[-1][3] if len(chunks) > 0 else 0
+        buf = encodeChunk(samples, self.codec, self.level)
+        offset = f.tell()
+        f.write(buf)
+        # min and max of the samples that are not gaps, None for a chunk of gaps only
+        valid = samples[~np.isin(samples, self.gapValues or [self.gapValue])]
+        low = valid.min().item() if len(valid) > 0 else None
+        high = valid.max().item() if len(valid) > 0 else None
+        chunks.append([start, offset, len(buf), len(samples), low, high])
+
+    def _addChannel(self, name: str, units: str, scale: float, offset: float):
+        self.chunks.append([])
+        self._tails.append(np.empty(0, dtype=self.dtype))
+        self._tailWritten.append(False)
+        super()._addChannel(name, units, scale, offset)
+
+    def _writeSamples(self, k: int, samples: np.ndarray):
+        if self.chunkSamples == 0:
+            self.chunkSamples = max(int(round(self.chunkSeconds / self.secsPerTick)), 1)
+        if self._tailWritten[k]:
+            # the partial last chunk is replaced by the chunks with the new samples
+            chunk = self.chunks[k].pop()
+            self._files[k].seek(chunk[1])
+            self._files[k].truncate()
+            self._tailWritten[k] = False
+        tail = np.concatenate([self._tails[k], samples])
+        numFull = len(tail) // self.chunkSamples * self.chunkSamples
+        for start in range(0, numFull, self.chunkSamples):
+            self._writeChunk(k, tail[start:start + self.chunkSamples])
+        self._tails[k] = tail[numFull:]
+
+    def _flushChannels(self):
+        for k in range(len(self._files)):
+            if len(self._tails[k]) > 0 and not self._tailWritten[k]:
+                self._writeChunk(k, self._tails[k])
+                self._tailWritten[k] = True
+        super()._flushChannels()
+
+    def _sidecar(self):
+        sidecar = super()._sidecar()
+        sidecar["codec"] = self.codec
+        sidecar["chunkSamples"] = self.chunkSamples
+        for k, c in enumerate(sidecar["channels"]):
+            c["chunks"] = self.chunks[k]
+        return sidecar
+
+
+def _sampleIndex(sidecar: dict, t: np.datetime64):
+    # index of the first sample at or after t, like WaveformSegment.getSampleIndex()
+    seconds = (np.datetime64(t, "ns") - np.datetime64(sidecar["startTime"], "ns")) / np.timedelta64(1, "s")
+    index = int(np.ceil(seconds / sidecar["secsPerTick"] - 1e-6))
+    return min(max(index, 0), sidecar["numSamples"])
+
+
+def _readChunks(filename: str, chunks: list, dtype: str, codec: str, start: int, stop: int):
+    # samples [start, stop) of a channel, only the chunks overlapping them are read and decompressed
+    out = np.empty(stop - start, dtype=dtype)
+    if stop <= start:
+        return out
+    starts = np.array([c[0] for c in chunks], dtype=np.int64)
+    first = max(np.searchsorted(starts, start, side="right") - 1, 0)
+    last = np.searchsorted(starts, stop, side="left")
+    with open(filename, "rb") as f:
+        for chunkStart, offset, length, numSamples, low, high in chunks[first:last]:
+            f.seek(offset)
+            samples = decodeChunk(f.read(length), dtype, codec)
+            lo = max(start, chunkStart)
+            hi = min(stop, chunkStart + numSamples)
+            out[lo - start:hi - start] = samples[lo - chunkStart:hi - chunkStart]
+    return out
+
+
+def readChunked(path: str, startTime: np.datetime64 = None, endTime: np.datetime64 = None, channels: list = None):
+    # returns a WaveformSegment of the samples with timestamps startTime <= t < endTime, None means the start or end of the store,
+    # channels is a list of channel names, None means all channels
+    with open(os.path.join(path, SIDECAR_NAME), "r") as f:
+        sidecar = json.load(f)
+    entries = sidecar["channels"]
+    if channels is not None:
+        entries = [c for c in entries if c["name"] in channels]
+    start = 0 if startTime is None else _sampleIndex(sidecar, startTime)
+    stop = sidecar["numSamples"] if endTime is None else _sampleIndex(sidecar, endTime)
+    stop = max(stop, start)
+    data = np.array([_readChunks(os.path.join(path, c["file"]), c["chunks"], c["dtype"], sidecar["codec"], start, stop) for c in entries])
+    scales = offsets = None
+    if any("scale" in c for c in entries):
+        scales = [c.get("scale") for c in entries]
+        offsets = [c.get("offset") for c in entries]
+    segmentStart = np.datetime64(sidecar["startTime"], "ns") + np.timedelta64(int(round(start * sidecar["secsPerTick"] * 1e9)), "ns")
+    return WaveformSegment(segmentStart, sidecar["secsPerTick"], [c["name"] for c in entries], [c["units"] for c in entries], data,
+                           scales, offsets, sidecar.get("gapValues"))
@@ -0,0 +1,268 @@
+# Columnar output of extracted waveforms: one .npy file per channel and a JSON sidecar with the time axis
+# There is no time column, the timestamp of sample n is startTime + n * secsPerTick and is computed on demand
+# ColumnarAppender stitches consecutive segments into one store of raw per-channel files that grows by appending
+# Raw segments, e.g. int16 samples read with noDataScaling, keep their storage type, with the scale and offset of each channel in the sidecar
+
+import json
+import os
+import numpy as np
+from binfilepy import WaveformSegment
+from binfilepy import constant
+from binfilepy.fixsampling import resample
+
+SIDECAR_NAME = "waveform.json"
+
+
+def writeColumnar(path: str, segment: WaveformSegment):
+    if not os.path.exists(path):
+        os.makedirs(path)
+    channels = []
+    for k, name in enumerate(segment.channelNames):
+        filename = "{0}.npy".format(k)
+        np.save(os.path.join(path, filename), np.ascontiguousarray(segment.data[k][:]))
+        channels.append(_channelSidecar(name, segment.units[k], filename, None, segment.scales, segment.offsets, k))
+    sidecar = {
+        "startTime": str(segment.startTime),
+        "secsPerTick": segment.secsPerTick,
+        "numSamples": segment.getNumSamples(),
+        "channels": channels,
+    }
+    if segment.gapValues:
+        sidecar["gapValues"] = segment.gapValues
+    # the sidecar is written last, so that a folder with a sidecar is complete
+    _writeSidecar(path, sidecar)
+    return path
+
+
+def _channelSidecar(name: str, units: str, filename: str, dtype: str, scales: list, offsets: list, k: int):
+    # the scale and offset are only written for raw channels
+    channel = {"name": name, "units": units, "file": filename}
+    if dtype is not None:
+        channel["dtype"] = dtype
+    if scales is not None and scales[k] is not None:
+        channel["scale"] = scales[k]
+        channel["offset"] = offsets[k]
+    return channel
+
+
+def _writeSidecar(path: str, sidecar: dict):
+    # replace the sidecar atomically, readers see either the old or the new one
+    tmpName = os.path.join(path, SIDECAR_NAME + ".tmp")
+    with open(tmpName, "w") as f:
+        json.dump(sidecar, f, indent=1)
+    os.replace(tmpName, os.path.join(path, SIDECAR_NAME))
+
+
+def readColumnar(path: str, mmap: bool = True):
+    # returns a WaveformSegment, with mmap the channels are memory-mapped read-only and only the pages used are read from the disk,
+    # raw channels are returned in their storage type, segment.getPhysicalChannel() calibrates them
+    with open(os.path.join(path, SIDECAR_NAME), "r") as f:
+        sidecar = json.load(f)
+    if "codec" in sidecar:
+        # compressed store of ChunkedAppender, read whole
+        from .chunked import readChunked
+        return readChunked(path)
+    channels = sidecar["channels"]
+    data = [_loadChannel(os.path.join(path, c["file"]), c.get("dtype"), sidecar["numSamples"], mmap) for c in channels]
+    scales = offsets = None
+    if any("scale" in c for c in channels):
+        scales = [c.get("scale") for c in channels]
+        offsets = [c.get("offset") for c in channels]
+    return WaveformSegment(np.datetime64(sidecar["startTime"], "ns"), sidecar["secsPerTick"],
+                           [c["name"] for c in channels], [c["units"] for c in channels], data, scales, offsets, sidecar.get("gapValues"))
+
+
+def _loadChannel(filename: str, dtype: str, numSamples: int, mmap: bool):
+    # .npy files of writeColumnar, or raw files of ColumnarAppender, which can be longer than numSamples after an interrupted append
+    if filename.endswith(".npy"):
+        return np.load(filename, mmap_mode="r" if mmap else None)
+    if mmap and numSamples > 0:
+        return np.memmap(filename, dtype=dtype, mode="r", shape=(numSamples,))
+    return np.fromfile(filename, dtype=dtype, count=numSamples)
+
+
+# gap value of the samples of a store for each storage type
+GAP_VALUES = {"<f8": constant.MIN_DOUBLE_VALUE, "<f4": constant.MIN_FLOAT_VALUE, "<i2": constant.MIN_SHORT_VALUE}
+# largest physical value of a gap sample, the gap fill value of float samples, calibrated gaps are MIN_DOUBLE_VALUE
+PHYSICAL_GAP_VALUE = float(np.array(constant.GAP_FILL_VALUES[constant.FORMAT_FLOAT], dtype="<f4"))
+
+
+class ColumnarAppender:
+    # samples are stored as float64, or with raw in the storage type of the first segment, e.g. int16 with the scale and offset of each channel,
+    # gaps between segments and channels missing from a segment are filled with gapValue
+    path = ""
+    raw = False
+    dtype = "<f8"
+    startTime = None            # datetime64[ns] of the first sample
+    secsPerTick = 0.0
+    channelNames = []
+    units = []
+    scales = []                 # per channel scale of raw samples, None for samples in physical units
+    offsets = []
+    numSamples = 0
+    gapValue = constant.MIN_DOUBLE_VALUE
+    gapValues = None            # raw values of gap samples, including gapValue, for raw stores
+
+    def __init__(self, path: str, secsPerTick: float = 0.0, raw: bool = False):
+        # secsPerTick of the store, 0 means the secsPerTick of the first segment, other segments are resampled to it
+        self.path = path
+        self.secsPerTick = secsPerTick
+        self.raw = raw
+        self.dtype = "<f8"
+        self.startTime = None
+        self.channelNames = []
+        self.units = []
+        self.scales = []
+        self.offsets = []
+        self.numSamples = 0
+        self.gapValues = None
+        self._files = []
+
+    def open(self):
+        # an existing store is continued in its storage type, samples after numSamples of its sidecar are dropped
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        sidecarName = os.path.join(self.path, SIDECAR_NAME)
+        if os.path.exists(sidecarName):
+            with open(sidecarName, "r") as f:
+                sidecar = json.load(f)
+            self.startTime = np.datetime64(sidecar["startTime"], "ns") if sidecar["numSamples"] > 0 else None
+            self.secsPerTick = sidecar["secsPerTick"]
+            self.numSamples = sidecar["numSamples"]
+            self.gapValue = sidecar["gapValue"]
+            self.gapValues = sidecar.get("gapValues")
+            for c in sidecar["channels"]:
+                self.dtype = c.get("dtype", "<f8")
+                self.channelNames.append(c["name"])
+                self.units.append(c["units"])
+                self.scales.append(c.get("scale"))
+                self.offsets.append(c.get("offset"))
+                self._files.append(self._openChannel(c, sidecar))
+            self.raw = self.dtype != "<f8" or self.gapValues is not None
+
+    def _openChannel(self, channel: dict, sidecar: dict):
+        # open the file of a stored channel for appending
+        f = open(os.path.join(self.path, channel["file"]), "r+b")
+        f.truncate(self.numSamples * np.dtype(self.dtype).itemsize)
+        f.seek(0, 2)
+        return f
+
+    def _channelFile(self, k: int):
+        # e.g. 0.f8, or 0.i2 for int16
+        return "{0}.{1}".format(k, self.dtype[1:])
+
+    def _writeSamples(self, k: int, samples: np.ndarray):
+        self._files[k].write(samples.tobytes())
+
+    def _writeGap(self, k: int, numSamples: int):
+        # write the gap samples in blocks of bounded size
+        blockSize = constant.WRITE_BLOCK_SIZE // np.dtype(self.dtype).itemsize
+        for j in range(0, numSamples, blockSize):
+            self._writeSamples(k, np.full(min(blockSize, numSamples - j), self.gapValue, dtype=self.dtype))
+
+    def _addChannel(self, name: str, units: str, scale: float, offset: float):
+        # a channel that appears later starts with gaps for the samples already stored
+        if scale is None and np.dtype(self.dtype).kind == "i":
+            scale, offset = 1.0, 0.0
+        self._files.append(open(os.path.join(self.path, self._channelFile(len(self._files))), "wb"))
+        self.channelNames.append(name)
+        self.units.append(units)
+        self.scales.append(scale)
+        self.offsets.append(offset)
+        self._writeGap(len(self._files) - 1, self.numSamples)
+
+    def _storedSamples(self, k: int, segment: WaveformSegment, j: int, physical: np.ndarray):
+        # samples of channel j of the segment in the representation of channel k of the store, physical is the resampled
+        # channel in physical units or None, raw samples with the calibration of the store channel are copied as they are
+        if physical is None:
+            if self.scales[k] is not None and segment.scales is not None and \
+                    (segment.scales[j], segment.offsets[j]) == (self.scales[k], self.offsets[k]):
+                return np.asarray(segment.data[j][:], dtype=self.dtype)
+            physical = segment.getPhysicalChannel(j)
+        gaps = physical <= PHYSICAL_GAP_VALUE
+        if self.scales[k] is None:
+            samples = physical.astype(self.dtype)
+        else:
+            # other calibrations are requantized to the one of the store, with gap values left out of the valid range
+            samples = np.rint(physical / self.scales[k] - self.offsets[k])
+            if np.dtype(self.dtype).kind == "i":
+                samples = np.clip(samples, self.gapValue + 1, np.iinfo(self.dtype).max)
+            samples = samples.astype(self.dtype)
+        samples[gaps] = self.gapValue
+        return samples
+
+    def append(self, segment: WaveformSegment):
+        # append a segment at its place on the time axis, like writeChannelData(gapInSecs=...):
+        # a gap after the stored samples is filled with gapValue, and samples overlapping the stored ones are dropped
+        if segment.getNumSamples() == 0:
+            return 0
+        if self.secsPerTick == 0.0:
+            self.secsPerTick = segment.secsPerTick
+        if self.raw and len(self.channelNames) == 0:
+            self.dtype = np.asarray(segment.data[0][:0]).dtype.newbyteorder("<").str
+            self.gapValue = GAP_VALUES.get(self.dtype, constant.MIN_DOUBLE_VALUE)
+            self.gapValues = sorted(set([self.gapValue] + list(segment.gapValues or [])))
+        physical = None
+        numSamples = segment.getNumSamples()
+        if segment.secsPerTick != self.secsPerTick:
+            physical = resample(np.array([segment.getPhysicalChannel(j) for j in range(len(segment.channelNames))]),
+                                segment.secsPerTick / self.secsPerTick, gapValue=PHYSICAL_GAP_VALUE)
+            numSamples = physical.shape[1]
+        if self.startTime is None:
+            self.startTime = segment.startTime
+            gapSamples = 0
+        else:
+            position = int(round((segment.startTime - self.startTime) / np.timedelta64(1, "s") / self.secsPerTick))
+            gapSamples = position - self.numSamples
+        overlappedSamples = min(-gapSamples, numSamples) if gapSamples < 0 else 0
+
+        for j, name in enumerate(segment.channelNames):
+            if name not in self.channelNames:
+                raw = self.raw and segment.scales is not None
+                self._addChannel(name, segment.units[j], segment.scales[j] if raw else None, segment.offsets[j] if raw else None)
+        for k, name in enumerate(self.channelNames):
+            self._writeGap(k, max(gapSamples, 0))
+            if name in segment.channelNames:
+                j = segment.channelNames.index(name)
+                samples = self._storedSamples(k, segment, j, physical[j] if physical is not None else None)
+                self._writeSamples(k, samples[overlappedSamples:])
+            else:
+                self._writeGap(k, numSamples - overlappedSamples)
+        numSamplesWritten = max(gapSamples, 0) + numSamples - overlappedSamples
+        self.numSamples += numSamplesWritten
+        self.flush()
+        return numSamplesWritten
+
+    def _flushChannels(self):
+        for f in self._files:
+            f.flush()
+
+    def _sidecar(self):
+        sidecar = {
+            "startTime": str(self.startTime) if self.startTime is not None else None,
+            "secsPerTick": self.secsPerTick,
+            "numSamples": self.numSamples,
+            "gapValue": self.gapValue,
+            "channels": [_channelSidecar(name, self.units[k], self._channelFile(k), self.dtype, self.scales, self.offsets, k)
+                         for k, name in enumerate(self.channelNames)],
+        }
+        if self.gapValues is not None:
+            sidecar["gapValues"] = self.gapValues
+        return sidecar
+
+    def flush(self):
+        # the sidecar is written after the samples, so it never counts samples that are not on the disk
+        self._flushChannels()
+        _writeSidecar(self.path, self._sidecar())
+
+    def close(self):
+        for f in self._files:
+            f.close()
+        self._files = []
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -0,0 +1,59 @@
+# Local cache of small remote files, e.g. the MRN-Mapping.csv of each patient folder
+# A file is downloaded again only when its size or mtime on the server changed
+
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+
+class RemoteFileCache:
+    # files are fetched concurrently by numWorkers threads sharing the storage backend
+    cacheDir = ""
+    numWorkers = 0
+
+    def __init__(self, cacheDir: str, numWorkers: int = 4):
+        self.cacheDir = cacheDir
+        self.numWorkers = numWorkers
+        self._executor = None
+
+    def open(self):
+        if not os.path.exists(self.cacheDir):
+            os.makedirs(self.cacheDir)
+        if self.numWorkers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.numWorkers)
+
+    def fetch(self, storage, remotePath: str):
+        # returns the local copy of remotePath, the name of the copy holds the size and mtime it was downloaded with
+        attr = storage.stat(remotePath)
+        name = hashlib.sha1(remotePath.encode("utf-8")).hexdigest()
+        ext = os.path.splitext(remotePath)[1]
+        localPath = os.path.join(self.cacheDir, "{0}_{1}_{2}{3}".format(name, attr.st_size, attr.st_mtime, ext))
+        if not os.path.exists(localPath):
+            tmpName = localPath + ".{0}.tmp".format(threading.get_ident())
+            storage.get(remotePath, tmpName)
+            os.replace(tmpName, localPath)
+            # remove the copies of older versions
+            for other in os.listdir(self.cacheDir):
+                if other.startswith(name + "_") and other != os.path.basename(localPath) and not other.endswith(".tmp"):
+                    os.remove(os.path.join(self.cacheDir, other))
+        return localPath
+
+    def fetchAll(self, storage, remotePaths: List[str]):
+        # fetch concurrently, returns the local copies in the order of remotePaths
+        if self._executor is not None and len(remotePaths) > 1:
+            return list(self._executor.map(lambda p: self.fetch(storage, p), remotePaths))
+        return [self.fetch(storage, p) for p in remotePaths]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -0,0 +1,45 @@
+# Index of time windows, e.g. the valid waveform time of the wave cycles, to find the windows overlapping a time range
+# The windows of each key are sorted by start time together with the running maximum of their stop times,
+# so a query is two binary searches and a filter of the candidates in between
+
+from typing import Any
+from typing import List
+import numpy as np
+
+
+class ValidWindowIndex:
+    windows = {}                # key -> (starts, stops, maxStops, rows), times in int64 microseconds sorted by start
+
+    def __init__(self, startTimes, stopTimes, keys: List[Any] = None):
+        # windows are [startTimes[i], stopTimes[i]], rows returned by findOverlapping() are indices into these lists,
+        # windows with a missing start or stop time are left out
+        starts = np.asarray(startTimes, dtype="datetime64[us]")
+        stops = np.asarray(stopTimes, dtype="datetime64[us]")
+        rows = np.flatnonzero(~(np.isnat(starts) | np.isnat(stops)))
+        codes = {}
+        if keys is None:
+            keyCodes = np.zeros(len(rows), dtype=np.int64)
+            codes[None] = 0
+        else:
+            keyCodes = np.array([codes.setdefault(keys[r], len(codes)) for r in rows], dtype=np.int64)
+        starts = starts[rows].astype(np.int64)
+        stops = stops[rows].astype(np.int64)
+        order = np.lexsort((starts, keyCodes))
+        keyCodes = keyCodes[order]
+        bounds = np.searchsorted(keyCodes, np.arange(len(codes) + 1))
+        self.windows = {}
+        for key, code in codes.items():
+            sl = order[bounds[code]:bounds[code + 1]]
+            self.windows[key] = (starts[sl], stops[sl], np.maximum.accumulate(stops[sl]) if len(sl) > 0 else stops[sl], rows[sl])
+
+    def findOverlapping(self, startTime: np.datetime64, endTime: np.datetime64, key: Any = None):
+        # rows of the windows of key with data in [startTime, endTime], in increasing order
+        if key not in self.windows:
+            return np.empty(0, dtype=np.int64)
+        starts, stops, maxStops, rows = self.windows[key]
+        t0 = np.datetime64(startTime, "us").astype(np.int64)
+        t1 = np.datetime64(endTime, "us").astype(np.int64)
+        # windows after hi start after endTime, windows before lo all stop before startTime
+        hi = np.searchsorted(starts, t1, side="right")
+        lo = np.searchsorted(maxStops[:hi], t0, side="left")
+        return np.sort(rows[lo:hi][stops[lo:hi] >= t0])
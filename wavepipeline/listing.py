@@ -0,0 +1,97 @@
+# Cache of remote directory listings, so that a patient folder is walked once and then only checked for changes
+# Each directory is checked with a stat, and listed again when its mtime changed, i.e. when files were added, removed or renamed in it
+# A file rewritten in place does not change the mtime of its directory, and keeps its cached size and mtime
+
+import json
+import os
+import posixpath
+import stat
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DirectoryListingCache:
+    # the directories of a level are refreshed concurrently by numWorkers threads sharing the storage backend
+    filename = ""
+    numWorkers = 0
+    listings = {}               # directory -> (mtime, [(filename, st_mode, st_size, st_mtime)])
+
+    def __init__(self, filename: str = None, numWorkers: int = 4):
+        # filename is the optional persistent form of the cache, loaded by open() and saved by save() and close()
+        self.filename = filename
+        self.numWorkers = numWorkers
+        self.listings = {}
+        self._executor = None
+
+    def open(self):
+        if self.filename and os.path.exists(self.filename):
+            with open(self.filename, "r") as f:
+                self.listings = {d: (mtime, [tuple(e) for e in entries]) for d, (mtime, entries) in json.load(f).items()}
+        if self.numWorkers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.numWorkers)
+
+    def _listdir(self, storage, dirPath: str):
+        return [(a.filename, a.st_mode, a.st_size, a.st_mtime) for a in storage.listDir(dirPath)]
+
+    def _refresh(self, storage, dirPath: str, mtime: int):
+        # returns (mtime, entries, listed) of a directory, mtime None means unknown and the directory is stat'ed,
+        # only a directory not in the cache or changed since is listed
+        if mtime is None:
+            mtime = storage.stat(dirPath).st_mtime
+        cached = self.listings.get(dirPath)
+        if cached is not None and cached[0] == mtime:
+            return mtime, cached[1], False
+        return mtime, self._listdir(storage, dirPath), True
+
+    def _refreshLevel(self, storage, directories: list):
+        # refresh a list of (path, mtime) concurrently when there is more than one
+        if self._executor is not None and len(directories) > 1:
+            return list(self._executor.map(lambda d: self._refresh(storage, d[0], d[1]), directories))
+        return [self._refresh(storage, d, mtime) for d, mtime in directories]
+
+    def listFiles(self, storage, dirPath: str, minDepth: int = 0):
+        # all files under dirPath as (path, size, mtime), files directly in dirPath have depth 0,
+        # every directory is checked with one stat, and only the changed ones are listed again
+        files = []
+        level = [(dirPath, None)]
+        depth = 0
+        while len(level) > 0:
+            nextLevel = []
+            for (d, _), (mtime, entries, listed) in zip(level, self._refreshLevel(storage, level)):
+                self.listings[d] = (mtime, entries)
+                for filename, mode, size, itemMtime in entries:
+                    # Use posixpath.join to ensure Unix-style paths
+                    itemPath = posixpath.join(d, filename)
+                    if stat.S_ISDIR(mode):
+                        # the mtime of a subdirectory is only current if its parent was just listed
+                        nextLevel.append((itemPath, itemMtime if listed else None))
+                    elif depth >= minDepth:
+                        files.append((itemPath, size, itemMtime))
+            level = nextLevel
+            depth += 1
+        return files
+
+    def save(self):
+        # merge with the listings saved by other processes since open(), the listings of this process take precedence
+        if self.filename:
+            listings = {}
+            if os.path.exists(self.filename):
+                with open(self.filename, "r") as f:
+                    listings = json.load(f)
+            listings.update(self.listings)
+            tmpName = "{0}.{1}.tmp".format(self.filename, os.getpid())
+            with open(tmpName, "w") as f:
+                json.dump(listings, f)
+            os.replace(tmpName, self.filename)
+
+    def close(self):
+        self.save()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -0,0 +1,158 @@
+# Wall time, bytes read, samples decoded and bytes written by the stages of the extraction, e.g. listing, downloading and decoding
+# Each run of a stage is written as a JSON line with its encounter and file, and the totals per stage are kept for a summary table
+# One chosen stage can be profiled with cProfile or tracemalloc
+
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+# counters of a stage record, added to the totals and to the enclosing stages of the same thread
+COUNTERS = ("bytesIn", "samples", "bytesOut")
+
+
+class StageMetrics:
+    filename = ""
+    profileStage = ""
+    profileMode = ""            # "cprofile" or "tracemalloc"
+    profileDir = ""
+    totals = {}                 # stage -> {"count", "seconds", "bytesIn", "samples", "bytesOut"}
+
+    def __init__(self, filename: str = None, profileStage: str = "", profileMode: str = "cprofile", profileDir: str = ""):
+        # filename is the JSON lines file, appended to by every process, profiles are saved to profileDir by flush() and close()
+        self.filename = filename
+        self.profileStage = profileStage
+        self.profileMode = profileMode
+        self.profileDir = profileDir
+        self.totals = {}
+        self._f = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profile = None
+        self._profiling = False
+        self._profiled = False
+
+    def open(self):
+        if self.filename:
+            self._f = open(self.filename, "a")
+        if self.profileStage:
+            if self.profileMode == "tracemalloc":
+                tracemalloc.start()
+            else:
+                self._profile = cProfile.Profile()
+
+    def _startProfile(self):
+        # only one run of the profiled stage is profiled at a time, the other threads run it unprofiled
+        with self._lock:
+            if self._profiling:
+                return False
+            self._profiling = True
+            self._profiled = True
+        if self._profile is not None:
+            self._profile.enable()
+        else:
+            tracemalloc.reset_peak()
+        return True
+
+    def _stopProfile(self, record: dict):
+        if self._profile is not None:
+            self._profile.disable()
+        else:
+            record["peakMemoryBytes"] = tracemalloc.get_traced_memory()[1]
+        with self._lock:
+            self._profiling = False
+
+    @contextlib.contextmanager
+    def stage(self, name: str, **context):
+        # yields the record of the stage, the caller sets its bytesIn, samples and bytesOut or adds other fields,
+        # context (e.g. encounter and file) is written with it
+        record = dict(stage=name, **context)
+        for c in COUNTERS:
+            record[c] = 0
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        profiled = name == self.profileStage and self._startProfile()
+        stack.append(record)
+        start = time.time()
+        t = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - t
+            stack.pop()
+            if profiled:
+                self._stopProfile(record)
+            record["start"] = start
+            record["pid"] = os.getpid()
+            self._add(record, stack)
+
+    def _add(self, record: dict, stack: list):
+        for outer in stack:
+            for c in COUNTERS:
+                outer[c] += record[c]
+        with self._lock:
+            total = self.totals.setdefault(record["stage"], dict(count=0, seconds=0.0, **{c: 0 for c in COUNTERS}))
+            total["count"] += 1
+            total["seconds"] += record["seconds"]
+            for c in COUNTERS:
+                total[c] += record[c]
+            if self._f is not None:
+                self._f.write(json.dumps(record, default=str) + "\n")
+                self._f.flush()
+
+    def takeTotals(self):
+        # returns the totals since the last call, e.g. to send them from a worker process to the main process
+        with self._lock:
+            totals = self.totals
+            self.totals = {}
+        return totals
+
+    def addTotals(self, totals: dict):
+        with self._lock:
+            for name, total in totals.items():
+                mine = self.totals.setdefault(name, dict(count=0, seconds=0.0, **{c: 0 for c in COUNTERS}))
+                for k, v in total.items():
+                    mine[k] += v
+
+    def formatSummary(self):
+        # table of the totals per stage, stages run concurrently (e.g. downloads) can add up to more than the wall time
+        lines = ["{0:<12} {1:>8} {2:>12} {3:>12} {4:>14} {5:>12} {6:>10}".format(
+            "stage", "count", "seconds", "MB in", "samples", "MB out", "MB/s")]
+        for name, total in self.totals.items():
+            mb = max(total["bytesIn"], total["bytesOut"]) / 1e6
+            lines.append("{0:<12} {1:>8} {2:>12.3f} {3:>12.2f} {4:>14} {5:>12.2f} {6:>10}".format(
+                name, total["count"], total["seconds"], total["bytesIn"] / 1e6, total["samples"], total["bytesOut"] / 1e6,
+                "{0:.1f}".format(mb / total["seconds"]) if total["seconds"] > 0 and mb > 0 else ""))
+        return "\n".join(lines)
+
+    def flush(self):
+        # save the profile of the profiled stage so far, one file per process that ran the stage,
+        # tracemalloc saves the allocations still alive
+        if not self._profiled:
+            return
+        name = os.path.join(self.profileDir, "profile_{0}_{1}".format(self.profileStage, os.getpid()))
+        if self._profile is not None:
+            self._profile.dump_stats(name + ".prof")
+        else:
+            with open(name + ".txt", "w") as f:
+                for stat in tracemalloc.take_snapshot().statistics("lineno")[:50]:
+                    f.write(str(stat) + "\n")
+
+    def close(self):
+        self.flush()
+        if self.profileStage and self.profileMode == "tracemalloc":
+            tracemalloc.stop()
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -0,0 +1,160 @@
+# Bounded pool of download threads that fetch upcoming ADIBIN files while the current one is decoded
+# Each thread keeps its own connection from connect(), e.g. a shared pooled storage backend, and reconnects and retries on transport errors
+
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from typing import Any
+from typing import Callable
+import numpy as np
+from binfilepy import BinFile
+from binfilepy import CFWBINARY
+from binfilepy import constant
+
+
+def fetchSampleRange(storage, remotePath: str, localPath: str, offsetSampleNum: int, lengthSampleNum: int):
+    # copy samples [offsetSampleNum, offsetSampleNum + lengthSampleNum) of a file on a storage backend to a local ADIBIN file,
+    # only the header and that byte range are transferred, and the local header starts at the first copied sample,
+    # the samples are copied in blocks of at most WRITE_BLOCK_SIZE bytes, so a long range is never held in memory,
+    # an empty range is refused, it is not a request for the whole file like length 0 in readSegment()
+    if lengthSampleNum <= 0:
+        raise ValueError("Empty sample range: offset {0}, length {1}".format(offsetSampleNum, lengthSampleNum))
+    with storage.openFile(remotePath, "rb") as remoteFile, BinFile(remoteFile, "r") as f, BinFile(localPath, "w") as out:
+        f.readHeader()
+        out.setHeader(CFWBINARY(f.header.secsPerTick, trigger=f.header.trigger, NChannels=f.header.NChannels,
+                                TimeChannel=f.header.TimeChannel, DataFormat=f.header.DataFormat))
+        out.header.Version = f.header.Version
+        out.setStartTime(f._sampleTime(offsetSampleNum))
+        out.channels = f.channels
+        out.writeHeader()
+        blockSize = max(constant.WRITE_BLOCK_SIZE // (np.dtype(f._sampleType()).itemsize * max(f.header.NChannels, 1)), 1)
+        numSamples = 0
+        for sampleNum, startTime, block in f.iterChannelData(blockSize * f.header.secsPerTick, offsetSampleNum,
+                                                             offsetSampleNum + lengthSampleNum, False, noDataScaling=True):
+            numSamples += out.writeChannelData(block)
+        out.updateSamplesPerChannel(numSamples, True)
+    return localPath
+
+
+class PrefetchPool:
+    # connect() returns a storage backend for a download thread, disconnect(client) closes it
+    connect = None
+    disconnect = None
+    numWorkers = 0
+    depth = 0
+    retries = 0
+    retryDelay = 0.0
+    transportErrors = ()
+    tmpDir = ""
+
+    def __init__(self, connect: Callable[[], Any], numWorkers: int = 4, depth: int = 8, retries: int = 3, retryDelay: float = 1.0,
+                 disconnect: Callable[[Any], None] = None, transportErrors: tuple = (EOFError, OSError), tmpDir: str = None):
+        self.connect = connect
+        self.disconnect = disconnect if disconnect is not None else (lambda client: client.close())
+        self.numWorkers = numWorkers
+        self.depth = depth
+        self.retries = retries
+        self.retryDelay = retryDelay
+        self.transportErrors = transportErrors
+        self.tmpDir = tempfile.mkdtemp(prefix="adibin_", dir=tmpDir)
+        self._queue = queue.Queue()
+        # at most depth files are downloading or downloaded and not yet taken by get()
+        self._slots = threading.Semaphore(depth)
+        self._results = {}
+        self._done = threading.Condition()
+        self._count = 0
+        self._threads = []
+        self._closed = False
+
+    def open(self):
+        for i in range(self.numWorkers):
+            t = threading.Thread(target=self._work, daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, key: str, fetch: Callable[[Any, str], str]):
+        # fetch(storage, localPath) downloads into the unique localPath and returns it, get(key) waits for the result
+        self._count += 1
+        localPath = os.path.join(self.tmpDir, "{0}.adibin".format(self._count))
+        with self._done:
+            self._results[key] = None
+        self._queue.put((key, fetch, localPath))
+
+    def submitted(self, key: str):
+        with self._done:
+            return key in self._results
+
+    def get(self, key: str):
+        # wait for the download of key, returns the local path, the caller removes the file when done with it
+        # keys have to be taken in the order they were submitted
+        with self._done:
+            while self._results[key] is None:
+                self._done.wait()
+            ok, result = self._results.pop(key)
+        self._slots.release()
+        if not ok:
+            raise result
+        return result
+
+    def _fetch(self, client, fetch, localPath):
+        # returns (client, (ok, result)), the connection is replaced after a transport error
+        for attempt in range(self.retries + 1):
+            try:
+                if client is None:
+                    client = self.connect()
+                if os.path.exists(localPath):
+                    os.remove(localPath)
+                return client, (True, fetch(client, localPath))
+            except (FileNotFoundError, PermissionError) as e:
+                return client, (False, e)
+            except self.transportErrors as e:
+                if client is not None:
+                    try:
+                        self.disconnect(client)
+                    except Exception:
+                        pass
+                client = None
+                if attempt == self.retries:
+                    return client, (False, e)
+                time.sleep(self.retryDelay * 2 ** attempt)
+            except BaseException as e:
+                return client, (False, e)
+
+    def _work(self):
+        client = None
+        while True:
+            # take a free slot first, so that files are fetched in the order they were submitted
+            self._slots.acquire()
+            item = self._queue.get()
+            if item is None or self._closed:
+                break
+            key, fetch, localPath = item
+            client, result = self._fetch(client, fetch, localPath)
+            with self._done:
+                self._results[key] = result
+                self._done.notify_all()
+        if client is not None:
+            self.disconnect(client)
+
+    def close(self):
+        # drop the downloads not started yet, and wake up the threads waiting for a free slot
+        self._closed = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        for t in self._threads:
+            self._queue.put(None)
+            self._slots.release()
+        for t in self._threads:
+            t.join()
+        self._threads = []
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
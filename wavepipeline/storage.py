@@ -0,0 +1,349 @@
+# Storage backends holding the waveform files: a pooled SFTP server, the local filesystem (e.g. an NFS mount) and memory for tests
+# The backends list, stat, open and get files, and read byte ranges, and are safe to share between threads,
+# so the catalog, the listing cache and the download threads take any of them
+
+import io
+import os
+import posixpath
+import shutil
+import stat
+import threading
+import time
+
+
+class FileAttributes:
+    # the fields of paramiko.SFTPAttributes used by the pipeline
+    filename = ""
+    st_mode = 0
+    st_size = 0
+    st_mtime = 0
+
+    def __init__(self, filename: str, st_mode: int, st_size: int, st_mtime: int):
+        self.filename = filename
+        self.st_mode = st_mode
+        self.st_size = st_size
+        self.st_mtime = st_mtime
+
+
+class LocalStorage:
+    # files of the local filesystem, e.g. /labs/hulab/UCSF/ mounted over NFS on the cluster nodes, paths are local paths
+    def open(self):
+        pass
+
+    def _attributes(self, path: str, filename: str = ""):
+        st = os.stat(path)
+        return FileAttributes(filename, st.st_mode, st.st_size, int(st.st_mtime))
+
+    def listDir(self, path: str):
+        return [self._attributes(os.path.join(path, filename), filename) for filename in sorted(os.listdir(path))]
+
+    def stat(self, path: str):
+        return self._attributes(path, os.path.basename(path))
+
+    def openFile(self, path: str, mode: str = "rb"):
+        return open(path, mode if "b" in mode else mode + "b")
+
+    def readRange(self, path: str, offset: int, length: int):
+        with open(path, "rb") as f:
+            return os.pread(f.fileno(), length, offset)
+
+    def get(self, remotePath: str, localPath: str):
+        shutil.copyfile(remotePath, localPath)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class MemoryStorage:
+    # files held in memory, for tests, put() adds a file and updates the mtime of its directories like a filesystem
+    files = {}                  # path -> (data, mtime)
+    directories = {}            # path -> mtime
+
+    def __init__(self):
+        self.files = {}
+        self.directories = {"/": 0}
+        self._lock = threading.Lock()
+
+    def open(self):
+        pass
+
+    def _normalize(self, path: str):
+        return posixpath.normpath("/" + path).replace("//", "/")
+
+    def put(self, path: str, data: bytes, mtime: int = None):
+        path = self._normalize(path)
+        mtime = int(time.time()) if mtime is None else mtime
+        with self._lock:
+            isNew = path not in self.files
+            self.files[path] = (bytes(data), mtime)
+            # a new entry changes the mtime of its directory, and a new directory the mtime of its parent
+            parent = posixpath.dirname(path)
+            while isNew:
+                isNew = parent not in self.directories
+                self.directories[parent] = mtime
+                parent = posixpath.dirname(parent)
+
+    def remove(self, path: str, mtime: int = None):
+        path = self._normalize(path)
+        with self._lock:
+            del self.files[path]
+            self.directories[posixpath.dirname(path)] = int(time.time()) if mtime is None else mtime
+
+    def listDir(self, path: str):
+        path = self._normalize(path)
+        with self._lock:
+            if path not in self.directories:
+                raise FileNotFoundError(path)
+            prefix = path.rstrip("/") + "/"
+            entries = {}
+            for p in list(self.files) + list(self.directories):
+                if p.startswith(prefix) and p != prefix:
+                    name = p[len(prefix):].split("/")[0]
+                    entries[name] = self._attributes(prefix + name, name)
+        return [entries[name] for name in sorted(entries)]
+
+    def _attributes(self, path: str, filename: str):
+        if path in self.files:
+            data, mtime = self.files[path]
+            return FileAttributes(filename, stat.S_IFREG | 0o644, len(data), mtime)
+        if path in self.directories:
+            return FileAttributes(filename, stat.S_IFDIR | 0o755, 0, self.directories[path])
+        raise FileNotFoundError(path)
+
+    def stat(self, path: str):
+        path = self._normalize(path)
+        with self._lock:
+            return self._attributes(path, posixpath.basename(path))
+
+    def openFile(self, path: str, mode: str = "rb"):
+        path = self._normalize(path)
+        with self._lock:
+            if path not in self.files:
+                raise FileNotFoundError(path)
+            return io.BytesIO(self.files[path][0])
+
+    def readRange(self, path: str, offset: int, length: int):
+        with self.openFile(path) as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def get(self, remotePath: str, localPath: str):
+        with self.openFile(remotePath) as rf, open(localPath, "wb") as f:
+            f.write(rf.read())
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class PooledFile:
+    # remote file that holds its SFTP channel until it is closed, the channel then goes back to the pool
+    def __init__(self, storage, client, transport, f):
+        self._storage = storage
+        self._client = client
+        self._transport = transport
+        self._f = f
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def close(self):
+        if self._f is not None:
+            try:
+                self._f.close()
+            finally:
+                self._storage._release(self._client, self._transport)
+                self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class SFTPStorage:
+    # SFTP server with a pool of up to maxConnections SSH connections, each multiplexing up to channelsPerConnection SFTP channels,
+    # a channel is taken from the pool for each request, the connections send keepalive packets every keepalive seconds,
+    # dead connections are replaced and a request failing with a transport error is retried on a new channel
+    host = ""
+    port = 22
+    username = ""
+    password = ""
+    maxConnections = 0
+    channelsPerConnection = 0
+    keepalive = 0
+    retries = 0
+    retryDelay = 0.0
+
+    def __init__(self, host: str, username: str, password: str, port: int = 22, maxConnections: int = 2, channelsPerConnection: int = 4,
+                 keepalive: int = 30, retries: int = 3, retryDelay: float = 1.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.maxConnections = maxConnections
+        self.channelsPerConnection = channelsPerConnection
+        self.keepalive = keepalive
+        self.retries = retries
+        self.retryDelay = retryDelay
+        self._paramiko = None
+        self._transportErrors = (EOFError, OSError)
+        # idle (client, transport), the number of open channels of each transport, and the connections being set up
+        self._idle = []
+        self._channels = {}
+        self._connecting = 0
+        self._cond = threading.Condition()
+
+    def open(self):
+        # paramiko is only needed by this backend
+        import paramiko
+        self._paramiko = paramiko
+        self._transportErrors = (paramiko.SSHException, EOFError, OSError)
+
+    def _connect(self):
+        transport = self._paramiko.Transport((self.host, self.port))
+        try:
+            transport.connect(username=self.username, password=self.password)
+        except BaseException:
+            transport.close()
+            raise
+        if self.keepalive > 0:
+            transport.set_keepalive(self.keepalive)
+        return transport
+
+    def _dropTransport(self, transport):
+        # called with the lock held
+        self._channels.pop(transport, None)
+        try:
+            transport.close()
+        except Exception:
+            pass
+
+    def _reserve(self):
+        # returns an idle (client, transport), or reserves a channel of a connection with room for one as (None, transport),
+        # or a new connection as (None, None), or waits for one
+        with self._cond:
+            while True:
+                while len(self._idle) > 0:
+                    client, transport = self._idle.pop()
+                    if transport in self._channels and transport.is_active():
+                        return client, transport
+                    self._dropTransport(transport)
+                for transport in list(self._channels):
+                    if not transport.is_active():
+                        self._dropTransport(transport)
+                    elif self._channels[transport] < self.channelsPerConnection:
+                        self._channels[transport] += 1
+                        return None, transport
+                if len(self._channels) + self._connecting < self.maxConnections:
+                    self._connecting += 1
+                    return None, None
+                self._cond.wait()
+
+    def _acquire(self):
+        # returns an idle channel, a new channel of a connection with room for one, or of a new connection,
+        # the connection and the channel are set up without the lock, so the other threads take and return channels meanwhile
+        client, transport = self._reserve()
+        if client is not None:
+            return client, transport
+        if transport is None:
+            try:
+                transport = self._connect()
+            finally:
+                with self._cond:
+                    self._connecting -= 1
+                    if transport is not None:
+                        self._channels[transport] = 1
+                    self._cond.notify()
+        try:
+            return self._paramiko.SFTPClient.from_transport(transport), transport
+        except BaseException:
+            self._release(None, transport, broken=True)
+            raise
+
+    def _release(self, client, transport, broken: bool = False):
+        # a transport error closes the whole connection, its other channels are dropped when they come back
+        with self._cond:
+            if broken:
+                self._dropTransport(transport)
+            elif transport in self._channels:
+                self._idle.append((client, transport))
+            self._cond.notify()
+
+    def _call(self, fn, keep: bool = False):
+        # returns fn(client) run on a pooled channel, keep returns (result, client, transport) without releasing the channel
+        for attempt in range(self.retries + 1):
+            try:
+                client, transport = self._acquire()
+            except self._transportErrors:
+                # the connection could not be set up
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.retryDelay * 2 ** attempt)
+                continue
+            try:
+                result = fn(client)
+            except (FileNotFoundError, PermissionError):
+                self._release(client, transport)
+                raise
+            except self._transportErrors:
+                self._release(client, transport, broken=True)
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.retryDelay * 2 ** attempt)
+                continue
+            except BaseException:
+                self._release(client, transport)
+                raise
+            if keep:
+                return result, client, transport
+            self._release(client, transport)
+            return result
+
+    def listDir(self, path: str):
+        return self._call(lambda client: client.listdir_attr(path))
+
+    def stat(self, path: str):
+        return self._call(lambda client: client.stat(path))
+
+    def openFile(self, path: str, mode: str = "rb"):
+        # the channel stays taken until the file is closed
+        f, client, transport = self._call(lambda client: client.open(path, mode), keep=True)
+        return PooledFile(self, client, transport, f)
+
+    def readRange(self, path: str, offset: int, length: int):
+        def read(client):
+            with client.open(path, "rb") as f:
+                return b"".join(f.readv([(offset, length)])) if length > 0 else b""
+        return self._call(read)
+
+    def get(self, remotePath: str, localPath: str):
+        self._call(lambda client: client.get(remotePath, localPath))
+
+    def close(self):
+        with self._cond:
+            for transport in list(self._channels):
+                self._dropTransport(transport)
+            self._idle = []
+            self._cond.notify_all()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()